@@ -4,41 +4,93 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 
 import os
+import bisect
 import collections
 from math import *
-import time
 
 from cursor import *
 from selection import *
+from datasource import *
+from glyphs import *
+from highlights import *
+from dirty import *
+from metrics import *
+from search import *
+from rowcache import *
+from history import *
+from provider import *
+from overview import *
+from bindiff import *
+from workers import *
+from formats import *
+from model import *
+from analytics import *
+from layout import *
+from export import *
 
 # Use the same orange highlight for changed memory values
 dirtycolor = QColor(255, 153, 51)
 
+def _modelAttribute(name):
+    """ A HexDisplay attribute that's kept on its model """
+    return property(lambda self: getattr(self.model, name), lambda self, value: setattr(self.model, name, value))
+
+
+def _modelMethod(name):
+    """ A HexDisplay method that calls the model's method of the same name """
+    def method(self, *args, **kwargs):
+        return getattr(self.model, name)(*args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = getattr(HexModel, name).__doc__
+    return method
+
+
 class HexDisplay(QAbstractScrollArea):
     """
     Modified from https://github.com/csarn/qthexedit/blob/master/hexwidget.py
     Most of the dead code should be gone, but there could be something I missed.
     Does all sorts of nasty unmaintanable things, but the most important thing
-    to know is that the memory contents are just stored as a string, and addresses
-    are 0-index internally, with the offset corresponding to the actual memory addresses
-    added after-the-fact during rendering.
+    to know is that the memory contents live in a DataSource (see datasource.py) that
+    behaves like a string, and addresses are 0-index internally, with the offset
+    corresponding to the actual memory addresses added after-the-fact during rendering.
+    Files are memory-mapped rather than read, so only the visible pages are ever touched.
+    The memory, dirty bytes and highlights are kept on a HexModel (see model.py) that
+    several displays can share; the display only has its own scrolling, cursor and selection.
     """
     selectionChanged = pyqtSignal()
-    def __init__(self, parent=None, filename=None, starting_address=0):
+    framePainted = pyqtSignal(object) # the metrics.Frame for every paintEvent
+    topLineChanged = pyqtSignal(object) # the new top line, whenever the view scrolls
+    def __init__(self, parent=None, filename=None, starting_address=0, source=None, model=None):
+        """ Shows `model` if it's given, so several displays can share one HexModel;
+        otherwise makes a model of its own for `source`, `filename` or an empty buffer. """
         super(HexDisplay, self).__init__(parent)
-        if filename is not None:
+        self.rowCache = RowCache() # rendered text of recently painted lines
+        self._painting = False
+        if model is not None:
+            self.filename = "<model>"
+        elif source is not None:
+            self.filename = "<source>"
+            model = HexModel(source, starting_address)
+        elif filename is not None:
             self.filename = filename
-            self.data = open(filename, 'rb').read()
+            model = HexModel(MmapSource(filename), starting_address)
         else:
-            self.data = ""
             self.filename = "<buffer>"
-        self.old_data = self.data
+            model = HexModel(b"", starting_address)
+        self.model = model
+        model.dataReplaced.connect(self._dataReplaced)
+        model.bytesChanged.connect(self._bytesChanged)
+        model.updated.connect(self._updated)
+        self.glyphs = GlyphAtlas(self, hex_table, ascii_table)
+        # Fonts that aren't fixed pitch are always drawn from the glyph atlas. Set this to
+        # blit fixed pitch fonts from it too, rather than drawing each run as text.
+        self.useGlyphCache = False
         self.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
         self.charWidth = self.fontMetrics().width("2")
         self.charHeight = self.fontMetrics().height()
+        # Whole runs of text can only be drawn at once if every glyph is charWidth wide
+        self.fixedPitch = QFontInfo(self.font()).fixedPitch()
         self.magic_font_offset = 2
-        self.starting_address = starting_address # Stores the memory address to start numbering from
-        self.dirty = [] # Stores whether a given byte should be highlighted
 
         self.viewport().setCursor(Qt.IBeamCursor)
         # constants
@@ -47,21 +99,38 @@ class HexDisplay(QAbstractScrollArea):
         self.addr_start = 1
         self.gap2 = 2
         self.gap3 = 2
-        self.data_width = self.maxWidth()
-        self.data_start = self.addr_start + self.addr_width + self.gap2
-        self.code_start = self.data_start + self.data_width + self.gap3
+        self.mode = MODES["hex"] # how the hex column shows the bytes, see setDisplayMode
+        self.layoutColumns()
 
-        self.pos = 0
+        self.pos = 0 # index of the first byte on the top line
         self.blink = False
 
-        self.selection = Selection(active=False)
-
-        self.highlights = []
+        # The line at the top of the view is tracked here as a Python int, and the vertical
+        # scrollbar only reflects it: with up to scrollResolution lines it holds the top line
+        # itself, beyond that it's scaled down (QScrollBar values are 32 bit ints).
+        self.topLine = 0
+        self.scrollResolution = 1 << 20
+        self._wheelRemainder = 0.0 # lines scrolled by the wheel but not applied yet
+        self._syncingBar = False
+        self.verticalScrollBar().valueChanged.connect(self._barMoved)
+
+        self.selection = Selection(active=False, color=Qt.green)
+
+        self.stats = FrameStats() # rolling paint timings, see metrics.py
+        self.slowFrameLog = None
+
+        self.searchResults = [] # 0-based indexes of the matches of the last search, in order
+        self.searchEnds = [] # and the index just past each of them, in the same order
+        self.searchColor = Qt.darkCyan
+        self.searchError = None # why the last search stopped early, if it failed
+        self._search = None # (thread, worker) of the search in progress
+        # How many screens ahead of the scroll direction to ask an AsyncSource for
+        self.prefetchScreens = 2
+        self._lastPos = None
+        self._scrollDirection = 1
         self._cursor = Cursor(32,1)
 
         self.cursor.changed.connect(self.cursorMove)
-        self.setMinimumWidth((self.code_start + self.bpl + 5) * self.charWidth)
-        self.setMaximumWidth((self.code_start + self.bpl + 5) * self.charWidth)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
         self.adjust()
 
@@ -73,6 +142,19 @@ class HexDisplay(QAbstractScrollArea):
     def cursor(self, value):
         self._cursor.update(value)
 
+    def _dataReplaced(self):
+        self.rowCache.clear()
+        if not self._painting:
+            self.redraw()
+
+    def _bytesChanged(self, start, end):
+        self.rowCache.invalidate(start, end, self.bpl)
+        self._updated(start, end)
+
+    def _updated(self, start, end):
+        if not self._painting:
+            self.invalidateRange(start, end)
+
     @property
     def raw_data(self):
         return self.data
@@ -83,96 +165,213 @@ class HexDisplay(QAbstractScrollArea):
         self.adjust()
 
     def clear(self):
-        self.data = ""
-        # self.redraw()
-
-    def set_new_offset(self, newoffset):
-        """ Sets a new starting offset. Has to be this complicated to make sure
-        highlighting doesn't get weird """
-        old = self.starting_address
-        if(self.starting_address != newoffset):
-            # print("Changing starting address from {0} to {1}".format(hex(self.starting_address), hex(newoffset)))
-            self.starting_address = newoffset
-        self.dirty = []
-        if(newoffset > old):
-            dif = newoffset - old
-            for l, r in zip(self.old_data[dif:], self.data):
-                self.dirty.append(l != r)
-        elif(newoffset < old): # Stack *growing*
-            dif = old - newoffset
-            for _ in range(dif):
-                self.dirty.append(True)
-            for l, r in zip(self.old_data, self.data[dif:]):
-                self.dirty.append(l != r)
-        else:
-            for l, r in zip(self.old_data, self.data):
-                self.dirty.append(l != r)
+        self.data = b""
         # self.redraw()
 
-    def highlight_address(self, address, length, color=Qt.darkRed, name="*"):
-        """ Uses named selections, which track absolute addresses instead of indexes.
-        This means this will move if the offset is changed, and that .contains will work
-        properly on addresses instead of indices. """
-        select = NamedSelection(self, name, address, address + length - 1, color)
-        self.highlights.append(select)
-        # self.redraw()
-
-    def clear_highlight(self, address):
-        """ Deletes all the highlights that contain a given address """
-        adj_addr = address - self.starting_address
-        self.highlights = [s for s in filter(lambda h: not h.contains(adj_addr), self.highlights)]
-        # self.redraw()
-
-    def clear_named_highlight(self, name):
-        """ Deletes all the highlights with the given name """
-        new_highlights = []
-        for h in self.highlights:
-            if hasattr(h, 'name'):
-                if h.name == name:
-                    pass
-                else:
-                    new_highlights.append(h)
-            else:
-                new_highlights.append(h)
-        self.highlights = new_highlights
-
-    def update_addr(self, addr, newval):
-        """ Updates the display. Works a lot better if you just pass in the entire
-        new block of memory at address 0x0 rather than try to be precise about it.
-        It strips off anything following the new memory, so updating in the above way
-        is probably in your best interest anyway."""
-        length = len(self.data)
-        # print("Writing",len(newval),"bytes at", hex(addr))
-        if (addr > length):
-            raise ValueError("Attempted to display data outside the contiguous bounds of this memory segment!")
-        part_one = self.data[0:(addr - self.starting_address)] + newval
-        #newdata = part_one + self.data[len(part_one):] # Overwrite, don't append
-        self.old_data = self.data
-        self.data = part_one #newdata
-        # self.redraw()
+    # The memory itself, and the updates to it, are the model's (see model.py)
+    data = _modelAttribute("data")
+    old_data = _modelAttribute("old_data")
+    starting_address = _modelAttribute("starting_address")
+    dirty = _modelAttribute("dirty")
+    history = _modelAttribute("history")
+    dirtyBaseline = _modelAttribute("dirtyBaseline")
+    highlights = _modelAttribute("highlights")
+    maxFrameRate = _modelAttribute("maxFrameRate")
+    throttleUpdates = _modelAttribute("throttleUpdates")
+    batch = _modelMethod("batch")
+    flush = _modelMethod("flush")
+    set_new_offset = _modelMethod("set_new_offset")
+    checkpoint = _modelMethod("checkpoint")
+    setDirtyBaseline = _modelMethod("setDirtyBaseline")
+    highlight_address = _modelMethod("highlight_address")
+    clear_highlight = _modelMethod("clear_highlight")
+    clear_named_highlight = _modelMethod("clear_named_highlight")
+    write_range = _modelMethod("write_range")
+    write_ranges = _modelMethod("write_ranges")
+    update_addr = _modelMethod("update_addr")
+    is_dirty = _modelMethod("is_dirty")
+    addSegment = _modelMethod("addSegment")
+    indexToAddress = _modelMethod("indexToAddress")
+    addressToIndex = _modelMethod("addressToIndex")
+    linearBase = _modelMethod("linearBase")
+    refresh = _modelMethod("refresh")
+
+    def search(self, pattern, kind="bytes", color=Qt.darkCyan, overlap=4096, limit=None):
+        """ Starts looking for `pattern` in a background thread (see search.compile_pattern
+        for the kinds of pattern). Matches are collected in searchResults as they come in,
+        painted in `color` straight from there, and can be stepped through with nextMatch and
+        previousMatch. `overlap` is the longest regex match that's guaranteed to be found
+        in full; it's ignored for patterns of a fixed length.
+        Returns the SearchWorker, whose signals report matches, progress, and completion. """
+        regex, length = compile_pattern(pattern, kind)
+        self.cancelSearch()
+        self.clearSearch()
+        self.searchColor = color
+        worker = SearchWorker(self.data, regex, overlap if length is None else length - 1, limit=limit)
+        thread = QThread(self)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.matchesFound.connect(self.addSearchMatches)
+        worker.failed.connect(self._searchFailed)
+        worker.finished.connect(thread.quit)
+        thread.finished.connect(self._searchDone)
+        self._search = (thread, worker)
+        thread.start()
+        return worker
+
+    def cancelSearch(self):
+        """ Stops the search in progress, if any. Matches found so far are kept. """
+        if self._search is None:
+            return
+        thread, worker = self._search
+        worker.cancel()
+        thread.quit()
+        thread.wait()
+        self._search = None
+
+    def clearSearch(self):
+        """ Forgets the matches of the last search """
+        if self.searchResults:
+            self.viewport().update()
+        self.searchResults = []
+        self.searchEnds = []
+        self.searchError = None
+
+    def _searchFailed(self, message):
+        if self._search is not None and self.sender() is self._search[1]:
+            self.searchError = message
+
+    def _searchDone(self):
+        if self._search is not None and not self._search[0].isRunning():
+            self._search = None
+
+    def addSearchMatches(self, matches):
+        if self._search is None or self.sender() is not self._search[1]:
+            return # left over from a search that was cancelled
+        if not matches:
+            return
+        # matches arrive in order and don't overlap, so both lists stay sorted
+        self.searchResults.extend(index for index, length in matches)
+        self.searchEnds.extend(index + length for index, length in matches)
+        self.invalidateRange(matches[0][0], self.searchEnds[-1])
+
+    def nextMatch(self):
+        """ Moves the cursor to the first match after it. Returns False if there isn't one. """
+        i = bisect.bisect_right(self.searchResults, self.cursor.address)
+        if i >= len(self.searchResults):
+            return False
+        self.goto(self.searchResults[i])
+        return True
 
-    def is_dirty(self, index):
-        """ Figures out if a given index was modified in the last update """
-        if len(self.dirty) <= index:
+    def previousMatch(self):
+        """ Moves the cursor to the last match before it. Returns False if there isn't one. """
+        i = bisect.bisect_left(self.searchResults, self.cursor.address)
+        if i == 0:
             return False
-        return self.dirty[index]
+        self.goto(self.searchResults[i - 1])
+        return True
 
     # I didn't write most of the following code, so I'm afraid it's mostly undocumented.
     # However, it should continue to Just Work(TM) so long as the 0-based indexing scheme isn't messed up.
     def toAscii(self, string):
-        return "".join([x if ord(x) >= 33 and ord(x) <= 126 else "." for x in string])
+        return to_ascii(string)
+
+    def row(self, index):
+        """ Returns the rendered text of the line starting at `index`, from the row cache
+        if it's there. Lines start at multiples of bpl. """
+        base = self.indexToAddress(index) - index
+        row = self.rowCache.get(index, base)
+        if row is None:
+            values = self.raw_data[index:index+self.bpl]
+            row = self._makeRow(index, base, values, self.mode.render(values, self.bpl)[0] if values else "")
+        return row
+
+    def decodeRows(self, start, end):
+        """ Renders the lines in [start, end) that aren't in the row cache yet with one
+        read and one display mode decode for all of them, rather than one per line """
+        source = self.raw_data
+        end = min(end, len(source))
+        missing = [index for index in range(start, end, self.bpl)
+                   if self.rowCache.get(index, self.indexToAddress(index) - index) is None]
+        if len(missing) < 2:
+            return # row() is just as quick
+        lo = missing[0]
+        data = source[lo:min(missing[-1] + self.bpl, end)]
+        texts = self.mode.render(data, self.bpl)
+        for index in missing:
+            offset = index - lo
+            self._makeRow(index, self.indexToAddress(index) - index, data[offset:offset + self.bpl],
+                          texts[offset // self.bpl])
+
+    def _makeRow(self, index, base, values, hex_text):
+        """ Builds the Row for a line, masks whatever isn't mapped or loaded, and caches it """
+        source = self.raw_data
+        row = Row(values, index, base, hex_text, self.mode)
+        if isinstance(source, SegmentMap):
+            unmapped = source.unmapped(index, min(index + self.bpl, len(source)))
+            if unmapped:
+                row.mask([(lo - index, hi - index) for lo, hi in unmapped], " ")
+                if unmapped == [(index, index + len(row.values))]:
+                    row.address = "" # nothing on the line is mapped
+        loading = source.unloaded(index, index + self.bpl) if isinstance(source, AsyncSource) else None
+        if loading:
+            row.mask([(lo - index, hi - index) for lo, hi in loading])
+        else:
+            self.rowCache.put(index, row)
+        return row
+
+    def prefetch(self):
+        """ Asks an AsyncSource for the next few screens in the direction the view was
+        last scrolled, so they're there by the time they're scrolled to """
+        source = self.raw_data
+        if not isinstance(source, AsyncSource) or self.pos == self._lastPos:
+            return
+        if self._lastPos is not None:
+            self._scrollDirection = 1 if self.pos > self._lastPos else -1
+        self._lastPos = self.pos
+        screen = self.visibleLines() * self.bpl
+        ahead = screen * self.prefetchScreens
+        if self._scrollDirection > 0:
+            source.prefetch(self.pos + screen, self.pos + screen + ahead)
+        else:
+            source.prefetch(self.pos - ahead, self.pos, backwards=True)
 
     def getLines(self, pos=0):
         while pos < len(self.raw_data)-self.bpl:
-            yield (pos, self.bpl, self.toAscii(self.raw_data[pos:pos+self.bpl]))
+            yield (pos, self.bpl, self.row(pos).ascii)
             pos += self.bpl
-        yield (pos, len(self.raw_data)-pos, self.toAscii(self.raw_data[pos:]))
+        yield (pos, len(self.raw_data)-pos, self.row(pos).ascii)
+
+    def layoutColumns(self):
+        """ Works out where the hex and ascii columns start from bpl, and sizes the widget to fit """
+        self.data_width = self.maxWidth()
+        self.data_start = self.addr_start + self.addr_width + self.gap2
+        self.code_start = self.data_start + self.data_width + self.gap3
+        self.setMinimumWidth((self.code_start + self.bpl + 5) * self.charWidth)
+        self.setMaximumWidth((self.code_start + self.bpl + 5) * self.charWidth)
+
+    def setBytesPerLine(self, bpl):
+        top = self.topLine * self.bpl
+        self.bpl = max(bpl - bpl % self.mode.size, self.mode.size) # whole elements only
+        self.rowCache.clear()
+        self.layoutColumns()
+        self.redraw()
+        self.setTopLine(top // self.bpl) # keep the same bytes in view
+
+    def setDisplayMode(self, mode):
+        """ Picks how the hex column shows each line: "hex" for bytes (the default),
+        "u16le", "u32be", "u64le" etc. for integers, "f32le", "f64be" etc. for floats, or
+        "ptr"/"ptr32" for little endian pointers. Takes a name from formats.MODES or a
+        DisplayMode. bpl is rounded down to a whole number of elements if it has to be. """
+        self.mode = MODES[mode] if not isinstance(mode, DisplayMode) else mode
+        self.rowCache.clear()
+        self.setBytesPerLine(self.bpl)
 
     def maxWidth(self):
-        return self.bpl * 3 - 1
+        return -(-self.bpl // self.mode.size) * self.mode.cell - 1
 
     def numLines(self):
-        return int(ceil(float(len(self.raw_data))/ self.bpl))
+        return (len(self.raw_data) + self.bpl - 1) // self.bpl # no floats, lines can go past 2**53
 
     def visibleColumns(self):
         ret = int(ceil(float(self.viewport().width())/self.charWidth))
@@ -182,19 +381,69 @@ class HexDisplay(QAbstractScrollArea):
         return int(ceil(float(self.viewport().height())/self.charHeight))
 
     def totalCharsPerLine(self):
-        ret = self.bpl * 4 + self.addr_width + self.addr_start + self.gap2 + self.gap3
+        ret = self.maxWidth() + 1 + self.bpl + self.addr_width + self.addr_start + self.gap2 + self.gap3
         return ret
 
     def adjust(self):
         self.horizontalScrollBar().setRange(0, self.totalCharsPerLine() - self.visibleColumns() + 1)
         self.horizontalScrollBar().setPageStep(self.visibleColumns())
-        self.verticalScrollBar().setRange(0, self.numLines() - self.visibleLines() + 1)
-        self.verticalScrollBar().setPageStep(self.visibleLines())
+        bar = self.verticalScrollBar()
+        top = self.maxTopLine()
+        self._syncingBar = True
+        if top <= self.scrollResolution:
+            bar.setRange(0, top)
+            bar.setPageStep(self.visibleLines())
+        else:
+            bar.setRange(0, self.scrollResolution)
+            bar.setPageStep(max(self.visibleLines() * self.scrollResolution // top, 1))
+        self._syncingBar = False
+        self.setTopLine(self.topLine)
+
+    def maxTopLine(self):
+        return max(self.numLines() - self.visibleLines() + 1, 0)
+
+    def setTopLine(self, line, moveBar=True):
+        """ Scrolls so that `line` is at the top of the view, exactly, however many lines
+        there are. The scrollbar is moved to match. """
+        line = max(min(line, self.maxTopLine()), 0)
+        changed = line != self.topLine
+        self.topLine = line
+        self.pos = line * self.bpl
+        if moveBar:
+            top = self.maxTopLine()
+            bar = self.verticalScrollBar()
+            self._syncingBar = True
+            if top <= self.scrollResolution:
+                bar.setValue(line)
+            else:
+                bar.setValue((line * self.scrollResolution + top // 2) // top)
+            self._syncingBar = False
+        if changed:
+            self.viewport().update()
+            self.topLineChanged.emit(line)
+
+    def scrollLines(self, count):
+        self.setTopLine(self.topLine + count)
+
+    def _barMoved(self, value):
+        """ The scrollbar was dragged or clicked: work out which line it points at """
+        if self._syncingBar:
+            return
+        top = self.maxTopLine()
+        if top <= self.scrollResolution:
+            self.setTopLine(value, False)
+        else:
+            self.setTopLine(value * top // self.scrollResolution, False)
 
     def goto(self, address):
         self.cursor.nibble = 0
         self.cursor.address = address
 
+    def gotoAddress(self, address):
+        """ Like goto, but takes a memory address rather than a 0-based index. Addresses
+        between segments go to the start of the next one. """
+        self.goto(min(self.addressToIndex(address, after=True), max(len(self.raw_data) - 1, 0)))
+
     # =====================  Coordinate Juggling  ============================
 
     def pxToCharCoords(self, px, py):
@@ -212,21 +461,24 @@ class HexDisplay(QAbstractScrollArea):
         column, row = self.pxToCharCoords(coord.x()+self.charWidth/2, coord.y())
         if column >= self.data_start and column < self.code_start:
             rel_column = column-self.data_start
-            line_index = rel_column - (rel_column / 3)
-            addr = self.pos + line_index/2 + row * self.bpl
+            if self.mode.size > 1: # the cursor goes to the first byte of the element
+                addr = self.pos + rel_column // self.mode.cell * self.mode.size + row * self.bpl
+                return Cursor(addr, 0)
+            line_index = rel_column - (rel_column // 3)
+            addr = self.pos + line_index//2 + row * self.bpl
             return Cursor(addr, 1 if rel_column % 3 == 1 else 0)
 
     def indexToHexCharCoords(self, index):
         rel_index = index - self.pos
-        cy = rel_index / self.bpl
+        cy = rel_index // self.bpl
         line_index = rel_index % self.bpl
-        rel_column = line_index * 3
+        rel_column = line_index // self.mode.size * self.mode.cell
         cx = rel_column + self.data_start
         return (cx, cy)
 
     def indexToAsciiCharCoords(self, index):
         rel_index = index - self.pos
-        cy = rel_index / self.bpl
+        cy = rel_index // self.bpl
         line_index = rel_index % self.bpl
         cx = line_index + self.code_start
         return (cx, cy)
@@ -241,28 +493,77 @@ class HexDisplay(QAbstractScrollArea):
     def cursorMove(self):
         x, y = self.indexToAsciiCharCoords(self.cursor.address)
         if y > self.visibleLines() - 4:
-            self.verticalScrollBar().setValue(self.verticalScrollBar().value() + y - self.visibleLines() + 4)
+            self.scrollLines(y - self.visibleLines() + 4)
         if y < 4:
-            self.verticalScrollBar().setValue(self.verticalScrollBar().value() + y - 4)
+            self.scrollLines(y - 4)
+
+    def wheelEvent(self, event):
+        """ Scrolls by lines through the top line rather than the scrollbar, which might
+        be too coarse to move by a single line. Fractions of a line from high resolution
+        wheels and touchpads are carried over to the next event. """
+        # kept in lines as a float, so that small deltas round the same way in both directions
+        delta = event.pixelDelta().y()
+        if delta:
+            self._wheelRemainder += delta / float(max(self.charHeight, 1))
+        else:
+            self._wheelRemainder += event.angleDelta().y() * QApplication.wheelScrollLines() / 120.0
+        lines = int(self._wheelRemainder) # towards zero; the rest carries over
+        self._wheelRemainder -= lines
+        self.scrollLines(-lines)
+        event.accept()
+
+    def keyPressEvent(self, event):
+        key = event.key()
+        if key == Qt.Key_PageDown:
+            self.scrollLines(self.visibleLines() - 1)
+        elif key == Qt.Key_PageUp:
+            self.scrollLines(1 - self.visibleLines())
+        elif key == Qt.Key_Down:
+            self.scrollLines(1)
+        elif key == Qt.Key_Up:
+            self.scrollLines(-1)
+        elif key == Qt.Key_Home and event.modifiers() & Qt.ControlModifier:
+            self.setTopLine(0)
+        elif key == Qt.Key_End and event.modifiers() & Qt.ControlModifier:
+            self.setTopLine(self.maxTopLine())
+        else:
+            super(HexDisplay, self).keyPressEvent(event)
 
     def mousePressEvent(self, event):
         cur = self.pxCoordToCursor(event.pos())
         if cur is not None:
             if self.selection.active:
                 self.selection.active = False
+                self.invalidateRange(self.selection.start, self.selection.end + 1)
                 self.selection.start = self.selection.end = cur.address
-                self.viewport().update()
+                self.selectionChanged.emit()
             self.blink = False
             self.cursor = cur
 
+    def selectedRange(self):
+        """ Returns the selected indexes as a range (start, end), or None if nothing is selected """
+        if not self.selection.active:
+            return None
+        return self.selection.start, self.selection.end + 1
+
+    def exportSelection(self, path, fmt="hexdump"):
+        """ Writes the selection to the file at `path` in one of export.FORMATS, a chunk at
+        a time, so any size of selection can be saved. Returns the number of bytes written. """
+        selected = self.selectedRange()
+        if selected is None:
+            return 0
+        start, end = selected
+        return export_file(self.raw_data, path, start, end, fmt, bpl=self.bpl, address=self.indexToAddress(start))
+
     def mouseMoveEvent(self, event):
+        old = (self.selection.active, self.selection.start, self.selection.end)
         self.selection.start = self.cursor.address
         new_cursor = self.pxCoordToCursor(event.pos())
         if new_cursor is None:
             return
         self.selection.end = new_cursor.address
         self.selection.active = True
-        self.viewport().update()
+        self.invalidateSelection(*old)
         self.selectionChanged.emit()
 
     def mouseReleaseEvent(self, event):
@@ -270,107 +571,214 @@ class HexDisplay(QAbstractScrollArea):
         if cur is not None:
             self.cursor = cur
 
+    def setSlowFrameLog(self, sink=print, threshold=1 / 60.0, interval=5.0):
+        """ Reports frames slower than `threshold` seconds to `sink`, at most once every
+        `interval` seconds. Pass sink=None to turn reporting off. """
+        self.slowFrameLog = SlowFrameLog(sink, threshold, interval) if sink is not None else None
+
+    def invalidateRange(self, start, end):
+        """ Schedules a repaint of only the visible lines that hold the indexes [start, end) """
+        if start >= end or self.model.pending:
+            return # the whole view gets repainted once the pending updates are flushed
+        first = max((start - self.pos) // self.bpl, 0)
+        last = min((end - 1 - self.pos) // self.bpl, self.visibleLines())
+        if first > last:
+            return
+        top = first * self.charHeight + self.magic_font_offset
+        self.viewport().update(QRect(0, top, self.viewport().width(), (last - first + 1) * self.charHeight))
+
+    def invalidateSelection(self, was_active, old_start, old_end):
+        """ Repaints the lines whose selection state differs from what it was before """
+        sel = self.selection
+        if was_active and sel.active:
+            # only the lines between the old and new ends have changed
+            self.invalidateRange(min(old_start, sel.start), max(old_start, sel.start) + 1)
+            self.invalidateRange(min(old_end, sel.end), max(old_end, sel.end) + 1)
+            return
+        if was_active:
+            self.invalidateRange(old_start, old_end + 1)
+        if sel.active:
+            self.invalidateRange(sel.start, sel.end + 1)
+
+    def invalidateHighlight(self, highlight):
+        self.invalidateRange(highlight.start, highlight.end + 1)
+
     def resizeEvent(self, event):
         self.adjust()
 
-    def paintHighlight(self, painter, line, selection):
-        if self.selection.active:
-            cx_start_hex, cy_start_hex = self.indexToHexCharCoords(self.selection.start)
-            cx_end_hex, cy_end_hex = self.indexToHexCharCoords(self.selection.end)
-            cx_start_ascii, cy_start_ascii = self.indexToAsciiCharCoords(self.selection.start)
-            cx_end_ascii, cy_end_ascii = self.indexToAsciiCharCoords(self.selection.end)
-            if line == cy_start_hex:
-                topleft_hex = QPoint(self.charToPxCoords(cx_start_hex, line))
-                topleft_ascii = QPoint(self.charToPxCoords(cx_start_ascii, line))
-                if line == cy_end_hex: # single line selection
-                    bottomright_hex = QPoint(self.charToPxCoords(cx_end_hex, line))
-                    bottomright_ascii = QPoint(self.charToPxCoords(cx_end_ascii, line))
-                else:
-                    bottomright_hex = QPoint(self.charToPxCoords(self.code_start - self.gap2, line))
-                    bottomright_ascii = QPoint(self.charToPxCoords(self.code_start + self.bpl, line))
-                bottomright_hex += QPoint(0, self.charHeight)
-                bottomright_ascii += QPoint(0, self.charHeight)
-                painter.fillRect(QRect(topleft_hex, bottomright_hex), selection.color)
-                painter.fillRect(QRect(topleft_ascii, bottomright_ascii), selection.color)
-            elif line > cy_start_hex and line <= cy_end_hex:
-                topleft_hex = QPoint(self.charToPxCoords(self.data_start, line))
-                topleft_ascii = QPoint(self.charToPxCoords(self.code_start, line))
-                if line == cy_end_hex:
-                    bottomright_hex = QPoint(self.charToPxCoords(cx_end_hex, line))
-                    bottomright_ascii = QPoint(self.charToPxCoords(cx_end_ascii, line))
-                else:
-                    bottomright_hex = QPoint(self.charToPxCoords(self.code_start - self.gap2, line))
-                    bottomright_ascii = QPoint(self.charToPxCoords(self.code_start + self.bpl, line))
-                bottomright_hex += QPoint(0, self.charHeight)
-                bottomright_ascii += QPoint(0, self.charHeight)
-                painter.fillRect(QRect(topleft_hex, bottomright_hex), selection.color)
-                painter.fillRect(QRect(topleft_ascii, bottomright_ascii), selection.color)
-
-
-    def paintHex(self, painter, row, column):
-        addr = self.pos + row * self.bpl + column
-        topleft = self.charToPxCoords(column*3 + self.data_start, row)
-        bottomleft = topleft + QPoint(0, self.charHeight-self.magic_font_offset)
-        byte = "{:02x}".format(ord(self.raw_data[addr]))
-        size = QSize(self.charWidth*3, self.charHeight)
-        rect = QRect(topleft, size)
-        dirty = self.is_dirty(addr)
-        for sel in [self.selection] + self.highlights:
-            if sel.active and sel.contains(addr):
-                painter.fillRect(rect, sel.color)
-                if not dirty:
-                    painter.setPen(self.palette().color(QPalette.HighlightedText))
-                else:
-                    painter.setPen(dirtycolor)
-                painter.drawText(bottomleft, byte)
-                painter.setPen(self.palette().color(QPalette.WindowText))
-                break
-        else:
-            if row % 2 == 0:
-                painter.fillRect(rect, self.palette().color(QPalette.AlternateBase))
-            if not dirty:
-                painter.setPen(self.palette().color(QPalette.WindowText))
+    def changeEvent(self, event):
+        if event.type() == QEvent.FontChange:
+            self.charWidth = self.fontMetrics().width("2")
+            self.charHeight = self.fontMetrics().height()
+            self.fixedPitch = QFontInfo(self.font()).fixedPitch()
+            self.glyphs.invalidate()
+        elif event.type() == QEvent.PaletteChange:
+            self.glyphs.invalidate()
+        super(HexDisplay, self).changeEvent(event)
+
+    def visibleHighlights(self, start, end):
+        """ Returns the selection, every highlight and every search match overlapping the
+        indexes [start, end), in order of precedence. Paint asks for this once per frame. """
+        return ([self.selection] + self.highlights.overlapping(self.indexToAddress(start),
+                                                               self.indexToAddress(end - 1))
+                + self.visibleMatches(start, end))
+
+    def visibleMatches(self, start, end):
+        """ The search matches overlapping the indexes [start, end), as selections. They're
+        found by bisecting searchEnds, so the number of matches doesn't matter. """
+        i = bisect.bisect_right(self.searchEnds, start)
+        matches = []
+        while i < len(self.searchResults) and self.searchResults[i] < end:
+            matches.append(Selection(self.searchResults[i], self.searchEnds[i] - 1, True, self.searchColor))
+            i += 1
+        return matches
+
+    def highlightsByLine(self, first, last):
+        """ Sorts the selection and the highlights into the visible lines [first, last]
+        they cover, so each line only has to look at its own. Returns one list per line,
+        each in order of precedence. """
+        start = self.pos + first * self.bpl
+        end = self.pos + (last + 1) * self.bpl
+        lines = [[] for _ in range(first, last + 1)]
+        for sel in self.visibleHighlights(start, end):
+            if not sel.active:
+                continue
+            lo = max(sel.start, start)
+            hi = min(sel.end, end - 1)
+            for line in range((lo - start) // self.bpl, (hi - start) // self.bpl + 1):
+                lines[line].append(sel)
+        return lines
+
+    def rowStyles(self, address, length, selections, loading=None, size=1):
+        """ Works out the background color and dirty flag of every byte on a line in one
+        pass, and groups them into runs of identically styled bytes. `selections` is the
+        line's list from highlightsByLine, and `loading` the columns of the Row that are
+        still placeholders. With a `size` above 1 the runs are of whole elements instead,
+        which take the background of their first byte and are dirty or loading if any of
+        their bytes are, and the columns returned are element numbers.
+        Returns a list of (first column, last column + 1, background or None, dirty, loading). """
+        backgrounds = [None] * length
+        waiting = [False] * length
+        for lo, hi in loading or ():
+            waiting[lo:hi] = [True] * (hi - lo)
+        last = address + length - 1
+        for sel in selections:
+            if not sel.active:
+                continue
+            lo = max(sel.start, address)
+            hi = min(sel.end, last)
+            for i in range(lo - address, hi - address + 1):
+                if backgrounds[i] is None: # earlier selections take precedence
+                    backgrounds[i] = sel.color
+
+        styles = list(zip(backgrounds, self.dirty.flags(address, length), waiting))
+        if size > 1:
+            styles = [(styles[col][0], any(style[1] for style in styles[col:col + size]),
+                       any(style[2] for style in styles[col:col + size])) for col in range(0, length, size)]
+
+        runs = []
+        run_start = 0
+        run_style = None
+        for col, style in enumerate(styles):
+            if col == 0:
+                run_style = style
+            elif style != run_style:
+                runs.append((run_start, col) + run_style)
+                run_start = col
+                run_style = style
+        if styles:
+            runs.append((run_start, len(styles)) + run_style)
+        return runs
+
+    def paintRow(self, painter, row, address, text, selections, frame):
+        """ Paints the hex and ascii columns of a line, issuing one fillRect/drawText
+        per run of identically styled bytes rather than one per byte. `text` is the
+        line's Row from the row cache, which the text of every run is sliced out of.
+        Bytes that are still loading are drawn as placeholder text in gray. In display
+        modes other than hex, runs are of whole elements (see rowStyles).
+        Time spent and painter calls made are added to `frame`. """
+        t = clock()
+        values = bytearray(text.values)
+        charw = self.charWidth
+        charh = self.charHeight
+        baseline = (row + 1) * charh
+        top = row * charh + self.magic_font_offset
+        normal = self.palette().color(QPalette.WindowText)
+        selected = self.palette().color(QPalette.HighlightedText)
+        placeholder = QColor(Qt.gray)
+        size = self.mode.size
+        cell = self.mode.cell
+        runs = []
+        for start, end, background, dirty, loading in self.rowStyles(address, len(values), selections,
+                                                                     text.loading, size):
+            if loading:
+                pen = placeholder
+            elif dirty:
+                pen = dirtycolor
+            elif background is not None:
+                pen = selected
             else:
-                painter.setPen(dirtycolor)
-            painter.drawText(bottomleft, byte)
-
-
-    def paintAscii(self, painter, row, column):
-        addr = self.pos + row * self.bpl + column
-        topleft = self.charToPxCoords(column + self.code_start, row)
-        bottomleft = topleft + QPoint(0, self.charHeight-self.magic_font_offset)
-        byte = self.toAscii(self.raw_data[addr])
-        size = QSize(self.charWidth, self.charHeight)
-        rect = QRect(topleft, size)
-        dirty = self.is_dirty(addr)
-        for sel in [self.selection] + self.highlights:
-            if sel.active and sel.contains(addr):
-                painter.fillRect(rect, sel.color)
-                if not dirty:
-                    painter.setPen(self.palette().color(QPalette.HighlightedText))
-                else:
-                    painter.setPen(dirtycolor)
-                painter.drawText(bottomleft, byte)
-                painter.setPen(self.palette().color(QPalette.WindowText))
-                break
-        else:
-            if row % 2 == 0:
-                painter.fillRect(rect, self.palette().color(QPalette.AlternateBase))
-            if not dirty:
-                painter.setPen(self.palette().color(QPalette.WindowText))
+                pen = normal
+            runs.append((start, end, background, pen, values[start * size:end * size]))
+        now = clock()
+        frame.phases["highlights"] += now - t
+        t = now
+
+        glyphs = not self.fixedPitch or self.useGlyphCache
+        current_pen = None
+        for start, end, background, pen, run in runs:
+            hex_x = (self.data_start + start * cell) * charw
+            if background is not None:
+                painter.fillRect(hex_x, top, (end - start) * cell * charw, charh, background)
+                frame.calls += 1
+            if glyphs and pen is not placeholder and size == 1:
+                self.glyphs.drawRun(painter, self.data_start * charw, top, start, run, pen, cell * charw)
             else:
-                painter.setPen(dirtycolor)
-            painter.drawText(bottomleft, byte)
-
+                if pen is not current_pen:
+                    painter.setPen(pen)
+                    current_pen = pen
+                    frame.calls += 1
+                if self.fixedPitch:
+                    painter.drawText(hex_x, baseline, text.hex[start * cell:end * cell - 1])
+                else: # the atlas only has bytes, so keep other elements aligned by drawing them one by one
+                    for element in range(start, end):
+                        painter.drawText((self.data_start + element * cell) * charw, baseline,
+                                         text.hex[element * cell:(element + 1) * cell - 1])
+                        frame.calls += 1
+            frame.calls += 1
+        now = clock()
+        frame.phases["hex"] += now - t
+        t = now
+
+        for start, end, background, pen, run in runs:
+            start *= size
+            end = start + len(run)
+            ascii_x = (self.code_start + start) * charw
+            if background is not None:
+                painter.fillRect(ascii_x, top, (end - start) * charw, charh, background)
+                frame.calls += 1
+            if glyphs and pen is not placeholder:
+                self.glyphs.drawRun(painter, self.code_start * charw, top, start, run, pen, charw, ascii=True)
+            else:
+                if pen is not current_pen:
+                    painter.setPen(pen)
+                    current_pen = pen
+                    frame.calls += 1
+                painter.drawText(ascii_x, baseline, text.ascii[start:end])
+            frame.calls += 1
+        frame.phases["ascii"] += clock() - t
 
     def paintEvent(self, event):
-        start = time.time()
+        self._painting = True
+        try:
+            self.model.settle()
+        finally:
+            self._painting = False
+        frame = Frame()
         painter = QPainter(self.viewport())
-        palette = self.viewport().palette()
 
         charh = self.charHeight
         charw = self.charWidth
-        charw3 = 3*charw
         data_width = self.data_width
         addr_width = self.addr_width
         addr_start = self.addr_start
@@ -389,42 +797,181 @@ class HexDisplay(QAbstractScrollArea):
         data_start *= charw
         code_start *= charw
 
-        self.pos = self.verticalScrollBar().value() * self.bpl
-
-        for i, line in enumerate(self.getLines(self.pos)):
-            if i > self.visibleLines():
+        self.pos = self.topLine * self.bpl
+        self.prefetch()
+
+        # only the lines that intersect the damaged area need to be painted
+        damaged = event.rect()
+        first = max((damaged.top() - self.magic_font_offset) // charh, 0)
+        last = min((damaged.bottom() - self.magic_font_offset) // charh, self.visibleLines())
+
+        t = clock()
+        self.decodeRows(self.pos + first * self.bpl, self.pos + (last + 1) * self.bpl)
+        frame.phases["background"] += clock() - t
+        t = clock()
+        selections = self.highlightsByLine(first, last)
+        frame.phases["highlights"] += clock() - t
+        alternate = self.palette().color(QPalette.AlternateBase)
+        address_color = QColor(0xA2, 0xD9, 0xAF)
+        length = len(self.raw_data)
+        for i in range(first, last + 1):
+            address = self.pos + i * self.bpl
+            if address > length or (address == length and length > 0):
                 break
+            frame.rows += 1
 
+            t = clock()
             if i % 2 == 0:
                 painter.fillRect(0, (i)*charh+self.magic_font_offset,
-                                 self.viewport().width(), charh,
-                                 self.palette().color(QPalette.AlternateBase))
-            (address, length, _ascii) = line
-
-            data = self.raw_data[address:address+length]
-
-
-            # selection highlight
-            self.paintHighlight(painter, i, self.selection)
-            for h in self.highlights:
-                self.paintHighlight(painter, i, h)
+                                 self.viewport().width(), charh, alternate)
+                frame.calls += 1
+            text = self.row(address)
+            now = clock()
+            frame.phases["background"] += now - t
 
             # address
-            painter.setPen(QColor(0xA2, 0xD9, 0xAF))
-            painter.drawText(addr_start, (i+1)*charh, "{:016x}".format(address+self.starting_address))
-            painter.setPen(self.palette().color(QPalette.WindowText))
+            painter.setPen(address_color)
+            painter.drawText(addr_start, (i+1)*charh, text.address)
+            frame.calls += 2
+            frame.phases["address"] += clock() - now
 
-            # hex data
-            for j, _byte in enumerate(data):
-                self.paintHex(painter, i, j)
-                self.paintAscii(painter, i, j)
+            # hex and ascii data
+            self.paintRow(painter, i, address, text, selections[i - first], frame)
 
         painter.setPen(Qt.gray)
+        if isinstance(self.raw_data, SegmentMap):
+            # rule off the lines where a gap between segments was collapsed
+            for boundary in self.raw_data.boundaries(self.pos + first * self.bpl, self.pos + (last + 1) * self.bpl):
+                y = (boundary - self.pos) // self.bpl * charh + self.magic_font_offset
+                painter.drawLine(0, y, self.viewport().width(), y)
+                frame.calls += 1
         painter.drawLine(data_start-charw, 0, data_start-charw, self.height())
         painter.drawLine(code_start-charw, 0, code_start-charw, self.height())
-
-        duration = time.time()-start
-        if duration > 0.1: # reasonably this should be something like 1/60th of a second,
-        # but since we repaint the entire window frequently I don't think it's possible
-        # to get that fast without a substantial redesign.
-            print("painting took:", duration, 'seconds')
+        frame.calls += 3
+
+        self.stats.record(frame.finish())
+        if self.slowFrameLog is not None:
+            self.slowFrameLog(frame)
+        self.framePainted.emit(frame)
+
+
+class DiffView(QWidget):
+    """ Two HexDisplays side by side for comparing two versions of some memory, eg:
+    firmware revisions or heap snapshots, where data may have been inserted or moved.
+    The diff runs in a background thread (see bindiff.py). Once it's done, both sides
+    are laid out so that matching blocks line up, with padding across from insertions
+    and deletions, and the two panes scroll together. Bytes that were replaced are
+    dirty on both sides; deletions are highlighted on the left and insertions on the
+    right. Until then, the two buffers are shown as they are. """
+    diffFinished = pyqtSignal(object) # the list of DiffBlocks
+    deleteColor = QColor(150, 40, 40)
+    insertColor = QColor(40, 120, 40)
+
+    def __init__(self, old, new, old_address=0, new_address=0, parent=None, window=32):
+        super(DiffView, self).__init__(parent)
+        self.old = old if isinstance(old, DataSource) else BufferSource(old)
+        self.new = new if isinstance(new, DataSource) else BufferSource(new)
+        self.old_address = old_address
+        self.new_address = new_address
+        self.window = window
+        self.blocks = None
+        self.placed = []
+        self._diff = None # (thread, worker) of the diff in progress
+
+        self.left = HexDisplay(self, source=self.old, starting_address=old_address)
+        self.right = HexDisplay(self, source=self.new, starting_address=new_address)
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.left)
+        layout.addWidget(self.right)
+        # setTopLine only emits when the line changes, so this doesn't go back and forth
+        self.left.topLineChanged.connect(self.right.setTopLine)
+        self.right.topLineChanged.connect(self.left.setTopLine)
+        self.compare()
+
+    def compare(self):
+        """ (Re)starts the diff in the background """
+        self.cancel()
+        worker = DiffWorker(self.old, self.new, self.window)
+        thread = QThread(self)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.finished.connect(self._diffDone)
+        worker.finished.connect(thread.quit)
+        self._diff = (thread, worker)
+        thread.start()
+        return worker
+
+    def cancel(self):
+        if self._diff is None:
+            return
+        thread, worker = self._diff
+        worker.cancel()
+        thread.quit()
+        thread.wait()
+        self._diff = None
+
+    def _diffDone(self, blocks):
+        if self._diff is None or self.sender() is not self._diff[1] or blocks is None:
+            return # cancelled
+        thread = self._diff[0]
+        self._diff = None
+        thread.quit()
+        thread.wait() # the worker is done, so this only waits for the thread to exit
+        self.blocks = blocks
+        self.layoutBlocks()
+        self.diffFinished.emit(blocks)
+
+    def layoutBlocks(self):
+        """ Shows the blocks of the diff, lined up at the current bytes per line """
+        if self.blocks is None:
+            return
+        old_side, new_side, self.placed = align_blocks(self.blocks, self.old, self.new,
+                                                       self.old_address, self.new_address, self.left.bpl)
+        # replaced blocks of the same length sit at the same index on both sides, so
+        # one diff of the two sides over just those blocks finds the changed bytes
+        spans = [(index, index + block.old_end - block.old_start) for block, index in self.placed
+                 if block.kind == "replace" and block.old_end - block.old_start == block.new_end - block.new_start]
+        changed = DirtyMap.diff(old_side, new_side, spans=spans)
+        for display, side, dirty in ((self.left, old_side, changed.copy()), (self.right, new_side, changed)):
+            display.data = side
+            display.old_data = side
+            display.starting_address = 0
+            display.dirty = dirty
+            display.clear_named_highlight("diff")
+        for block, index in self.placed:
+            old_length = block.old_end - block.old_start
+            new_length = block.new_end - block.new_start
+            if block.kind == "replace" and old_length != new_length:
+                self.left.dirty.set_range(index, index + old_length)
+                self.right.dirty.set_range(index, index + new_length)
+            elif block.kind == "delete":
+                self.left.highlight_address(self.old_address + block.old_start, old_length, self.deleteColor, "diff")
+            elif block.kind == "insert":
+                self.right.highlight_address(self.new_address + block.new_start, new_length, self.insertColor, "diff")
+        self.left.redraw()
+        self.right.redraw()
+
+    def setBytesPerLine(self, bpl):
+        self.left.setBytesPerLine(bpl)
+        self.right.setBytesPerLine(bpl)
+        self.layoutBlocks()
+
+    def nextChange(self):
+        """ Scrolls both panes to the first block after the top line that isn't equal.
+        Returns False if there isn't one. """
+        top = self.left.topLine * self.left.bpl
+        for block, index in self.placed:
+            if block.kind != "equal" and index > top:
+                self.left.setTopLine(index // self.left.bpl)
+                return True
+        return False
+
+    def previousChange(self):
+        """ Like nextChange, but looks above the top line """
+        top = self.left.topLine * self.left.bpl
+        for block, index in reversed(self.placed):
+            if block.kind != "equal" and index < top:
+                self.left.setTopLine(index // self.left.bpl)
+                return True
+        return False
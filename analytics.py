@@ -0,0 +1,401 @@
+import collections
+import hashlib
+import math
+import threading
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # histograms fall back to collections.Counter, which is a lot slower
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QPainter, QPalette
+from PyQt5.QtWidgets import QLabel, QProgressBar, QVBoxLayout, QWidget
+
+# The result of analyze() or AnalyticsEngine, for the indexes [start, end). sha256 is a
+# hex digest, crc32 an unsigned int, histogram a list of 256 counts and entropy in bits per byte.
+Analysis = collections.namedtuple("Analysis", "start end sha256 crc32 histogram entropy")
+
+# Size of the blocks whose results are cached, which is also how much is read at a time
+BLOCK = 1 << 20
+
+
+def histogram(data):
+    """ Returns how many times each byte value occurs in `data`, as a list of 256 counts """
+    if numpy is not None:
+        return numpy.bincount(numpy.frombuffer(data, numpy.uint8), minlength=256).tolist()
+    counter = collections.Counter()
+    for start in range(0, len(data), 1 << 16): # Counter holds the GIL, so give other threads a turn now and then
+        counter.update(bytearray(data[start:start + (1 << 16)]))
+    counts = [0] * 256
+    for value, count in counter.items():
+        counts[value] = count
+    return counts
+
+
+def entropy(counts):
+    """ Returns the Shannon entropy of a histogram, in bits per byte """
+    total = float(sum(counts))
+    result = 0.0
+    for count in counts:
+        if count:
+            p = count / total
+            result -= p * math.log(p, 2)
+    return result
+
+
+# CRC-32s of consecutive pieces are joined the way zlib's crc32_combine does it: running
+# a CRC over n zero bytes is a linear map over GF(2), kept as a 32 x 32 bit matrix (one
+# int per column), and joining is that map applied to the first CRC, xor the second.
+
+def _gf2_times(matrix, vector):
+    total = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return total
+
+
+def _gf2_compose(a, b):
+    return [_gf2_times(a, column) for column in b]
+
+
+_zero_operators = {}
+
+
+def _zero_operator(length):
+    """ Returns the matrix that moves a CRC-32 past `length` zero bytes """
+    operator = _zero_operators.get(length)
+    if operator is not None:
+        return operator
+    power = [0xedb88320] + [1 << i for i in range(31)] # one zero bit
+    for _ in range(3): # eight zero bits
+        power = _gf2_compose(power, power)
+    operator = [1 << i for i in range(32)]
+    n = length
+    while n:
+        if n & 1:
+            operator = _gf2_compose(power, operator)
+        n >>= 1
+        if n:
+            power = _gf2_compose(power, power)
+    if len(_zero_operators) > 64:
+        _zero_operators.clear()
+    _zero_operators[length] = operator
+    return operator
+
+
+def crc32_combine(crc1, crc2, length2):
+    """ Returns the CRC-32 of a + b, given the CRC-32s of a and b and the length of b """
+    return _gf2_times(_zero_operator(length2), crc1) ^ crc2
+
+
+def _stats(data):
+    return zlib.crc32(data) & 0xffffffff, histogram(data)
+
+
+def analyze(source, start, end, block_size=BLOCK):
+    """ Analyzes the indexes [start, end) of `source` one block at a time on the calling
+    thread, eg: from a script. See AnalyticsEngine for doing it in the background. """
+    end = min(end, len(source))
+    hasher = hashlib.sha256()
+    crc = 0
+    counts = [0] * 256
+    for pos in range(start, end, block_size):
+        data = source[pos:min(pos + block_size, end)]
+        hasher.update(data)
+        crc = zlib.crc32(data, crc) & 0xffffffff
+        counts = [a + b for a, b in zip(counts, histogram(data))]
+    return Analysis(start, end, hasher.hexdigest(), crc, counts, entropy(counts))
+
+
+class _Task(QRunnable):
+    def __init__(self, function, *args):
+        super(_Task, self).__init__()
+        self.function = function
+        self.args = args
+        self.setAutoDelete(True)
+
+    def run(self):
+        self.function(*self.args)
+
+
+class _Job(object):
+    def __init__(self, source, start, end, generation=0):
+        self.source = source
+        self.generation = generation # of the engine's caches when the job started
+        self.start = start
+        self.end = end
+        self.pieces = [] # [start, end) of the pieces the CRC and histogram are made of, in order
+        self.results = {} # piece start -> (crc32, histogram)
+        self.sha256 = None
+        self.done = 0 # bytes hashed plus bytes of pieces worked out
+        self.total = 0
+        self.cancelled = threading.Event()
+
+
+class AnalyticsEngine(QObject):
+    """ Works out the SHA-256, CRC-32, byte histogram and entropy of a range of a data
+    source on a thread pool, without blocking the GUI thread. The range is split on
+    block_size boundaries: the CRC and histogram of each piece are worked out in parallel
+    and then joined, and the CRC and histogram of whole blocks are cached, so extending
+    a range only costs the new blocks. SHA-256 can't be split up that way, so one task
+    hashes the range from its start, keeping a copy of the hash state at every block
+    boundary to carry on from when the same range is extended or cut short.
+
+    Starting another analysis cancels the one in progress, so analyze() can be called on
+    every step of a drag. zlib and hashlib let go of the GIL while they work; histograms
+    only run in parallel when numpy is installed. """
+    progress = pyqtSignal(object, object) # work done, total work
+    finished = pyqtSignal(object) # the Analysis, unless it was cancelled
+    _pieceDone = pyqtSignal(object, object, object) # job, piece start or None for the hash, result
+    _hashed = pyqtSignal(object, object) # job, bytes hashed
+
+    def __init__(self, block_size=BLOCK, max_blocks=4096, threads=None, parent=None):
+        super(AnalyticsEngine, self).__init__(parent)
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.pool = QThreadPool(self)
+        if threads is None and numpy is None:
+            threads = 2 # one to hash, one for the pieces: Counter histograms can't run side by side anyway
+        if threads is not None:
+            self.pool.setMaxThreadCount(threads)
+        self.source = None
+        self.blocks = collections.OrderedDict() # block index -> (crc32, histogram), most recently used last
+        self.hashes = collections.OrderedDict() # start -> {position: sha256 state}, for the last few starts
+        self.lock = threading.Lock() # for self.hashes, which the hashing task adds to
+        # bumped whenever cached results are dropped, so that tasks which read the bytes
+        # before that don't put their results back
+        self.generation = 0
+        self.job = None
+        self._pieceDone.connect(self._collect, Qt.QueuedConnection)
+        self._hashed.connect(self._progress, Qt.QueuedConnection)
+
+    def analyze(self, source, start, end):
+        """ Starts analyzing the indexes [start, end) of `source`, cancelling whatever
+        was being analyzed. The result comes out of `finished`. """
+        self.cancel()
+        if source is not self.source:
+            self.clear()
+            self.source = source
+        end = min(end, len(source))
+        job = self.job = _Job(source, start, max(end, start), self.generation)
+        size = self.block_size
+        lo = start
+        while lo < job.end:
+            hi = min((lo // size + 1) * size, job.end)
+            job.pieces.append((lo, hi))
+            lo = hi
+        job.total = 2 * (job.end - start)
+
+        with self.lock:
+            snapshots = self.hashes.pop(start, {})
+            self.hashes[start] = snapshots # most recently used
+            while len(self.hashes) > 8:
+                self.hashes.popitem(last=False)
+            state = snapshots.get(job.end)
+        if state is not None:
+            job.sha256 = state.hexdigest()
+            job.done += job.end - start
+        else:
+            self.pool.start(_Task(self._hash, job))
+        for lo, hi in job.pieces:
+            cached = self.blocks.pop(lo // size, None) if hi - lo == size else None
+            if cached is not None:
+                self.blocks[lo // size] = cached
+                job.results[lo] = cached
+                job.done += hi - lo
+            else:
+                self.pool.start(_Task(self._piece, job, lo, hi))
+        self._finish(job)
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancelled.set()
+            self.job = None
+        self.pool.clear() # tasks that haven't started yet
+
+    def clear(self):
+        """ Forgets every cached result """
+        self.blocks.clear()
+        with self.lock:
+            self.generation += 1
+            self.hashes.clear()
+
+    def invalidate(self, start, end):
+        """ Forgets the cached results that depend on the indexes [start, end), eg: after
+        they've been written to """
+        size = self.block_size
+        for index in [i for i in self.blocks if i * size < end and (i + 1) * size > start]:
+            del self.blocks[index]
+        with self.lock:
+            self.generation += 1
+            for first, snapshots in self.hashes.items():
+                if first < end:
+                    for position in [p for p in snapshots if p > start]:
+                        del snapshots[position]
+
+    def close(self):
+        self.cancel()
+        self.pool.waitForDone()
+
+    def _hash(self, job):
+        """ Runs on the pool: hashes the job's range, carrying on from the furthest
+        snapshot that doesn't go past its end """
+        with self.lock:
+            snapshots = self.hashes.get(job.start, {})
+            positions = [p for p in snapshots if p <= job.end]
+            pos = max(positions) if positions else job.start
+            hasher = snapshots[pos].copy() if positions else hashlib.sha256()
+        if pos > job.start:
+            self._hashed.emit(job, pos - job.start)
+        while pos < job.end:
+            if job.cancelled.is_set():
+                return
+            next_pos = min((pos // self.block_size + 1) * self.block_size, job.end)
+            hasher.update(job.source[pos:next_pos])
+            self._hashed.emit(job, next_pos - pos)
+            pos = next_pos
+            if pos % self.block_size == 0 or pos == job.end:
+                with self.lock:
+                    if job.cancelled.is_set():
+                        return
+                    if job.generation == self.generation: # else the bytes may have changed since they were read
+                        snapshots[pos] = hasher.copy()
+        with self.lock: # besides block boundaries, only the latest end is worth keeping
+            for position in [p for p in snapshots if p % self.block_size and p != job.end]:
+                del snapshots[position]
+        self._pieceDone.emit(job, None, hasher.hexdigest())
+
+    def _piece(self, job, start, end):
+        """ Runs on the pool: works out the CRC and histogram of one piece """
+        if not job.cancelled.is_set():
+            self._pieceDone.emit(job, start, _stats(job.source[start:end]))
+
+    def _progress(self, job, count):
+        if job is self.job:
+            job.done += count
+            self.progress.emit(job.done, job.total)
+
+    def _collect(self, job, start, result):
+        if job is not self.job:
+            return # left over from a cancelled analysis
+        if start is None:
+            job.sha256 = result
+            self.progress.emit(job.done, job.total)
+        else:
+            job.results[start] = result
+            end = min((start // self.block_size + 1) * self.block_size, job.end)
+            if end - start == self.block_size and job.generation == self.generation:
+                self.blocks[start // self.block_size] = result
+                while len(self.blocks) > self.max_blocks:
+                    self.blocks.popitem(last=False)
+            self._progress(job, end - start)
+        self._finish(job)
+
+    def _finish(self, job):
+        if job.sha256 is None or len(job.results) < len(job.pieces):
+            return
+        crc = 0
+        counts = [0] * 256
+        for lo, hi in job.pieces:
+            piece_crc, piece_counts = job.results[lo]
+            crc = crc32_combine(crc, piece_crc, hi - lo)
+            counts = [a + b for a, b in zip(counts, piece_counts)]
+        self.job = None
+        self.progress.emit(job.total, job.total)
+        self.finished.emit(Analysis(job.start, job.end, job.sha256, crc, counts, entropy(counts)))
+
+
+class HistogramView(QWidget):
+    """ Bars for the 256 counts of a histogram, on a log scale so rare values still show """
+    bar_color = QColor(80, 140, 255)
+
+    def __init__(self, parent=None):
+        super(HistogramView, self).__init__(parent)
+        self.counts = None
+        self.setMinimumSize(256, 64)
+
+    def setCounts(self, counts):
+        self.counts = counts
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.palette().color(QPalette.Base))
+        if not self.counts:
+            return
+        top = math.log(max(self.counts) + 1)
+        if not top:
+            return
+        width = self.width() / 256.0
+        height = self.height()
+        for value, count in enumerate(self.counts):
+            if count:
+                bar = int(math.log(count + 1) / top * height)
+                painter.fillRect(int(value * width), height - bar, max(int(width), 1), bar, self.bar_color)
+
+
+class AnalyticsPanel(QWidget):
+    """ Shows the SHA-256, CRC-32, entropy and byte histogram of a HexDisplay's selection,
+    redone in the background whenever the selection or the bytes under it change, eg:
+
+        layout.addWidget(display)
+        layout.addWidget(AnalyticsPanel(display)) """
+
+    def __init__(self, display, parent=None, engine=None):
+        super(AnalyticsPanel, self).__init__(parent)
+        self.display = display
+        self.engine = engine or AnalyticsEngine(parent=self)
+        self.result = None
+        self.summary = QLabel(self)
+        self.summary.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.summary.setFont(display.font())
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setRange(0, 1000)
+        self.histogram = HistogramView(self)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.summary)
+        layout.addWidget(self.progressBar)
+        layout.addWidget(self.histogram)
+        self.engine.progress.connect(self.showProgress)
+        self.engine.finished.connect(self.showResult)
+        display.selectionChanged.connect(self.selectionChanged)
+        display.model.bytesChanged.connect(self.bytesChanged)
+        display.model.dataReplaced.connect(self.selectionChanged)
+        self.selectionChanged()
+
+    def closeEvent(self, event):
+        self.engine.close()
+        super(AnalyticsPanel, self).closeEvent(event)
+
+    def selectionChanged(self):
+        selected = self.display.selectedRange()
+        if selected is None:
+            self.engine.cancel()
+            self.result = None
+            self.summary.setText("Nothing selected")
+            self.progressBar.setValue(0)
+            self.histogram.setCounts(None)
+            return
+        self.engine.analyze(self.display.raw_data, *selected)
+
+    def bytesChanged(self, start, end):
+        self.engine.invalidate(start, end)
+        selected = self.display.selectedRange()
+        if selected is not None and start < selected[1] and end > selected[0]:
+            self.selectionChanged()
+
+    def showProgress(self, done, total):
+        self.progressBar.setValue(1000 * done // total if total else 1000)
+
+    def showResult(self, result):
+        self.result = result
+        self.summary.setText("{:x}-{:x} ({} bytes)\nSHA-256  {}\nCRC-32   {:08x}\nEntropy  {:.4f} bits/byte".format(
+            self.display.indexToAddress(result.start), self.display.indexToAddress(max(result.end - 1, result.start)),
+            result.end - result.start, result.sha256, result.crc32, result.entropy))
+        self.histogram.setCounts(result.histogram)
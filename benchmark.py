@@ -0,0 +1,367 @@
+""" Headless benchmarks for HexDisplay.
+
+Run from the plugin directory with an offscreen Qt platform:
+
+    QT_QPA_PLATFORM=offscreen python benchmark.py --output results.json
+
+Each benchmark varies one parameter at a time away from a baseline (1 MiB of data,
+32 bytes per line, no highlights, nothing dirty, no selection) so a regression can
+be pinned on whatever it is sensitive to. Results are written as JSON, and two runs
+(eg: before and after a change) can be compared with
+
+    python benchmark.py --compare before.json after.json
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+KiB = 1 << 10
+MiB = 1 << 20
+GiB = 1 << 30
+
+SIZES = [4 * KiB, 1 * MiB, 64 * MiB, 1 * GiB]
+BYTES_PER_LINE = [8, 16, 32, 64]
+HIGHLIGHT_COUNTS = [0, 10, 100, 1000, 10000]
+DIRTY_RATIOS = [0.0, 0.01, 0.1, 0.5, 1.0]
+SELECTION_SPANS = [0, 64, 4 * KiB, 64 * KiB]
+
+# Anything bigger than this is served from a sparse memory-mapped file rather than
+# a buffer, and skipped by the benchmarks that have to copy the whole segment.
+IN_MEMORY_LIMIT = 64 * MiB
+
+try:
+    clock = time.perf_counter
+except AttributeError: # python 2
+    clock = time.time
+
+
+def measure(fn, repeat):
+    """ Calls fn `repeat` times and returns the min/median/mean of the wall times """
+    times = []
+    for _ in range(repeat):
+        start = clock()
+        fn()
+        times.append(clock() - start)
+    times.sort()
+    return {"min": times[0], "median": times[len(times) // 2],
+            "mean": sum(times) / len(times), "runs": repeat}
+
+
+class Bench(object):
+    def __init__(self, repeat, sizes, height):
+        from PyQt5.QtWidgets import QApplication
+        self.app = QApplication.instance() or QApplication(sys.argv[:1])
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import __init__ as hexview
+        self.hexview = hexview
+        self.repeat = repeat
+        self.sizes = sizes
+        self.height = height
+        self.results = []
+        self.tempfiles = []
+
+    def close(self):
+        for name in self.tempfiles:
+            os.remove(name)
+
+    def record(self, name, params, timing, **extra):
+        result = {"name": name, "params": params}
+        result.update(timing)
+        result.update(extra)
+        self.results.append(result)
+        print("{:<16} {:<60} median {:9.3f} ms".format(
+            name, json.dumps(params, sort_keys=True), timing["median"] * 1000))
+
+    def data(self, size, seed=0):
+        """ Returns random bytes for sizes that fit in memory, or a sparse file otherwise """
+        if size <= IN_MEMORY_LIMIT:
+            rng = random.Random(seed)
+            return bytes(bytearray(rng.getrandbits(8) for _ in range(min(size, 64 * KiB)))) * (size // (64 * KiB) or 1)
+        handle, name = tempfile.mkstemp(prefix="hexview-bench-")
+        os.ftruncate(handle, size)
+        os.close(handle)
+        self.tempfiles.append(name)
+        return self.hexview.MmapSource(name)
+
+    def widget(self, size, bpl=32):
+        data = self.data(size)
+        if isinstance(data, self.hexview.DataSource):
+            widget = self.hexview.HexDisplay(source=data)
+        else:
+            widget = self.hexview.HexDisplay()
+            widget.data = data[:size]
+            widget.old_data = widget.data
+        if bpl != widget.bpl:
+            widget.setBytesPerLine(bpl)
+        widget.resize(widget.maximumWidth(), self.height)
+        return widget
+
+    def paint(self, widget):
+        from PyQt5.QtGui import QImage
+        image = QImage(widget.viewport().size(), QImage.Format_ARGB32)
+        calls = []
+        widget.framePainted.connect(lambda frame: calls.append(frame.calls))
+        timing = measure(lambda: widget.viewport().render(image), self.repeat)
+        timing["painter_calls"] = calls[-1] if calls else 0
+        return timing
+
+    # =====================  Benchmarks  ============================
+
+    def bench_paint(self):
+        for size in self.sizes:
+            self.record("paint", {"size": size}, self.paint(self.widget(size)))
+        for bpl in BYTES_PER_LINE:
+            self.record("paint", {"size": MiB, "bpl": bpl}, self.paint(self.widget(MiB, bpl)))
+        for count in HIGHLIGHT_COUNTS:
+            widget = self.widget(MiB)
+            # spread over the first screenful so that every highlight is actually drawn
+            visible = widget.visibleLines() * widget.bpl
+            for i in range(count):
+                start = (i * visible) // max(count, 1)
+                widget.highlight_address(start, max(visible // max(count, 1) // 2, 1), name=str(i % 16))
+            self.record("paint", {"size": MiB, "highlights": count}, self.paint(widget))
+        for ratio in DIRTY_RATIOS:
+            widget = self.widget(MiB)
+            widget.dirty = self.hexview.DirtyMap(MiB)
+            rng = random.Random(1)
+            for i in range(widget.visibleLines() * widget.bpl):
+                if rng.random() < ratio:
+                    widget.dirty.set(i)
+            self.record("paint", {"size": MiB, "dirty_ratio": ratio}, self.paint(widget))
+        for span in SELECTION_SPANS:
+            widget = self.widget(MiB)
+            widget.selection.active = span > 0
+            widget.selection.start = 16
+            widget.selection.end = 16 + span
+            self.record("paint", {"size": MiB, "selection": span}, self.paint(widget))
+
+    def bench_set_new_offset(self):
+        for size in self.sizes:
+            for shift in (0, 8, -8):
+                widget = self.widget(size)
+                if size <= IN_MEMORY_LIMIT:
+                    # a realistic single step: a handful of bytes changed
+                    changed = bytearray(widget.data[:])
+                    for i in range(0, size, max(size // 16, 1)):
+                        changed[i] ^= 0xff
+                    widget.data = bytes(changed)
+                base = widget.starting_address
+                def step():
+                    widget.starting_address = base
+                    widget.set_new_offset(base + shift)
+                self.record("set_new_offset", {"size": size, "shift": shift}, measure(step, self.repeat))
+
+    def bench_update_addr(self):
+        for size in self.sizes:
+            if size > IN_MEMORY_LIMIT:
+                continue # update_addr copies the whole segment
+            widget = self.widget(size)
+            block = widget.data[:]
+            def update():
+                widget.update_addr(0, block)
+            self.record("update_addr", {"size": size}, measure(update, self.repeat))
+
+    def bench_write_ranges(self):
+        for size in self.sizes:
+            widget = self.widget(size)
+            rng = random.Random(2)
+            writes = [(rng.randrange(0, size - 8), b"\x41" * 8) for _ in range(64)]
+            self.record("write_ranges", {"size": size, "writes": len(writes)},
+                        measure(lambda: widget.write_ranges(writes), self.repeat))
+
+    def bench_scroll(self):
+        from PyQt5.QtGui import QImage
+        for size in self.sizes:
+            widget = self.widget(size)
+            image = QImage(widget.viewport().size(), QImage.Format_ARGB32)
+            bar = widget.verticalScrollBar()
+            steps = 50
+            def scroll():
+                for i in range(steps):
+                    bar.setValue((i * 7919) % max(bar.maximum(), 1))
+                    widget.viewport().render(image)
+            timing = measure(scroll, max(self.repeat // 5, 1))
+            self.record("scroll", {"size": size, "steps": steps}, timing,
+                        frames_per_second=steps / timing["median"])
+
+    def bench_push(self):
+        """ A tracer pushing a step at a time (new memory, offset and highlight), with
+        every step applied as it comes and with the steps merged by throttleUpdates """
+        steps = 100
+        for size in self.sizes:
+            if size > IN_MEMORY_LIMIT:
+                continue # update_addr copies the whole segment
+            for throttle in (False, True):
+                widget = self.widget(size)
+                widget.throttleUpdates = throttle
+                block = bytearray(widget.data[:])
+                def push():
+                    for i in range(steps):
+                        block[i] ^= 0xff
+                        widget.update_addr(0, bytes(block))
+                        widget.set_new_offset(0)
+                        widget.clear_named_highlight("pc")
+                        widget.highlight_address(i, 4, name="pc")
+                    widget.flush()
+                self.record("push", {"size": size, "steps": steps, "throttle": throttle},
+                            measure(push, max(self.repeat // 5, 1)))
+
+    def bench_shared_views(self):
+        """ An update followed by a repaint of every display showing the model, to check
+        that the diff is done once however many displays there are """
+        from PyQt5.QtGui import QImage
+        for views in (1, 2, 4):
+            first = self.widget(MiB)
+            widgets = [first] + [self.hexview.HexDisplay(model=first.model) for _ in range(views - 1)]
+            for widget in widgets[1:]:
+                widget.resize(widget.maximumWidth(), self.height)
+            images = [QImage(w.viewport().size(), QImage.Format_ARGB32) for w in widgets]
+            block = bytearray(first.data[:])
+            def update():
+                block[0] ^= 0xff
+                first.update_addr(0, bytes(block))
+                first.set_new_offset(0)
+                for widget, image in zip(widgets, images):
+                    widget.viewport().render(image)
+            self.record("shared_views", {"size": MiB, "views": views}, measure(update, self.repeat))
+
+    def bench_analytics(self):
+        """ Analyzing half of a segment from scratch, and extending an analyzed range by a
+        block, which should only cost that block and the end of the hash """
+        for size in self.sizes:
+            if size > IN_MEMORY_LIMIT:
+                continue
+            source = self.hexview.BufferSource(self.data(size)[:size])
+            block = max(size // 64, 64)
+            engine = self.hexview.AnalyticsEngine(block_size=block)
+            results = []
+            engine.finished.connect(results.append)
+            def run(end):
+                count = len(results)
+                engine.analyze(source, 0, end)
+                while len(results) == count:
+                    self.app.processEvents()
+            def fresh():
+                engine.clear()
+                run(size // 2)
+            ends = iter(range(size // 2 + block, size + 1, block))
+            self.record("analytics", {"size": size // 2}, measure(fresh, max(self.repeat // 5, 1)))
+            self.record("analytics", {"size": size // 2, "extend": block},
+                        measure(lambda: run(next(ends)), max(self.repeat // 5, 1)))
+            engine.close()
+
+    def bench_export(self):
+        """ Exporting a whole segment to a file in every format """
+        for size in self.sizes:
+            widget = self.widget(size)
+            handle, name = tempfile.mkstemp(prefix="hexview-export-")
+            os.close(handle)
+            self.tempfiles.append(name)
+            for fmt in self.hexview.FORMATS:
+                timing = measure(lambda: self.hexview.export_file(widget.raw_data, name, fmt=fmt),
+                                 max(self.repeat // 5, 1))
+                self.record("export", {"size": size, "format": fmt}, timing,
+                            bytes_per_second=size / timing["median"])
+
+    def bench_async_scroll(self):
+        """ Scrolls through a FakeProvider with the given round trip time, which shows both
+        that painting never waits on the provider and how many frames still had placeholders """
+        from PyQt5.QtGui import QImage
+        for latency in (0.001, 0.01, 0.05):
+            provider = self.hexview.FakeProvider(self.data(MiB), latency=latency)
+            widget = self.hexview.HexDisplay(source=provider)
+            widget.resize(widget.maximumWidth(), self.height)
+            image = QImage(widget.viewport().size(), QImage.Format_ARGB32)
+            bar = widget.verticalScrollBar()
+            steps = 50
+            placeholders = []
+            def scroll():
+                for i in range(steps):
+                    bar.setValue(i * widget.visibleLines() // 4)
+                    widget.viewport().render(image)
+                    self.app.processEvents()
+                    placeholders.append(widget.row(widget.pos).loading is not None)
+            timing = measure(scroll, max(self.repeat // 5, 1))
+            self.record("async_scroll", {"latency": latency, "steps": steps}, timing,
+                        frames_per_second=steps / timing["median"],
+                        placeholder_frames=sum(placeholders) / float(len(placeholders)),
+                        reads=provider.reads)
+            widget.data.close()
+
+    def run(self, only=None):
+        for name in sorted(dir(self)):
+            if name.startswith("bench_") and (not only or name[len("bench_"):] in only):
+                getattr(self, name)()
+
+
+def metadata():
+    meta = {"python": platform.python_version(), "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    try:
+        from PyQt5.QtCore import QT_VERSION_STR
+        meta["qt"] = QT_VERSION_STR
+    except ImportError:
+        pass
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        meta["commit"] = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=here).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return meta
+
+
+def compare(before_file, after_file):
+    """ Prints the median of every benchmark in both files, and how much it changed """
+    with open(before_file) as f:
+        before = json.load(f)
+    with open(after_file) as f:
+        after = json.load(f)
+    key = lambda r: (r["name"], json.dumps(r["params"], sort_keys=True))
+    old = dict((key(r), r) for r in before["results"])
+    for result in after["results"]:
+        k = key(result)
+        if k not in old:
+            continue
+        a = old[k]["median"]
+        b = result["median"]
+        change = (b - a) / a * 100 if a else 0.0
+        print("{:<16} {:<60} {:9.3f} -> {:9.3f} ms ({:+.1f}%)".format(k[0], k[1], a * 1000, b * 1000, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless HexDisplay benchmarks")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--repeat", type=int, default=10, help="runs per measurement")
+    parser.add_argument("--quick", action="store_true", help="skip the 64 MiB and 1 GiB data sizes")
+    parser.add_argument("--only", nargs="*", help="benchmarks to run, eg: paint scroll")
+    parser.add_argument("--height", type=int, default=2160, help="viewport height in pixels")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    sizes = [s for s in SIZES if s <= MiB] if args.quick else SIZES
+    bench = Bench(args.repeat, sizes, args.height)
+    try:
+        bench.run(args.only)
+    finally:
+        bench.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": metadata(), "results": bench.results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import collections
+import re
+
+from datasource import BufferSource, DataSource, SegmentMap, SliceSource
+
+# One aligned stretch of a diff. kind is "equal", "replace", "delete" (only in old) or
+# "insert" (only in new), and the ranges are [start, end) indexes into old and new.
+DiffBlock = collections.namedtuple("DiffBlock", "kind old_start old_end new_start new_end")
+
+# How much of each buffer is read at a time
+CHUNK = 1 << 20
+
+
+def _match_forward(old, new, i, j, limit):
+    """ Returns how many bytes of old[i:] and new[j:] are equal, up to `limit`, comparing
+    in growing steps so that long matches cost a handful of string comparisons """
+    length = 0
+    step = 64
+    while length < limit:
+        n = min(step, limit - length)
+        if old[i + length:i + length + n] == new[j + length:j + length + n]:
+            length += n
+            step = min(step * 2, CHUNK)
+        elif n > 8:
+            step = n // 2
+        else:
+            a = bytearray(old[i + length:i + length + n])
+            b = bytearray(new[j + length:j + length + n])
+            for x, y in zip(a, b):
+                if x != y:
+                    break
+                length += 1
+            return length
+    return length
+
+
+def _match_backward(old, new, i, j, limit):
+    """ Returns how many bytes just before old[i] and new[j] are equal, up to `limit` """
+    length = 0
+    step = 64
+    while length < limit:
+        n = min(step, limit - length)
+        if old[i - length - n:i - length] == new[j - length - n:j - length]:
+            length += n
+            step = min(step * 2, CHUNK)
+        elif n > 1:
+            step = n // 2
+        else:
+            return length
+    return length
+
+
+def _gap(blocks, old_start, old_end, new_start, new_end):
+    if old_start < old_end and new_start < new_end:
+        blocks.append(DiffBlock("replace", old_start, old_end, new_start, new_end))
+    elif old_start < old_end:
+        blocks.append(DiffBlock("delete", old_start, old_end, new_start, new_start))
+    elif new_start < new_end:
+        blocks.append(DiffBlock("insert", old_start, old_start, new_start, new_end))
+
+
+# Anchors are placed where the content says so rather than at fixed offsets, so that the
+# same bytes get the same anchors in both buffers however far they've moved. Every byte is
+# mapped to one pseudo-random bit, and an anchor goes wherever a 0 bit is followed by
+# ANCHOR_BITS 1 bits, which on typical data is every 2 ** (ANCHOR_BITS + 1) bytes. The
+# mapping and the search both run in C (translate and a regex), not a byte at a time.
+ANCHOR_BITS = 6
+_bits = bytes(bytearray(1 if (b * 47 + 53) & 0x80 else 0 for b in range(256)))
+_boundary = re.compile(b"\x00" + b"\x01" * ANCHOR_BITS)
+
+
+def _anchors(data, window, cancelled=None):
+    """ Yields (index, the `window` bytes there) for the anchors of `data`. Stretches
+    without a boundary (eg: runs of zeros, where every byte maps to the same bit) get an
+    anchor every boundary spacing once they've gone on for 8 times that, counting from
+    the last boundary so they still line up between buffers. """
+    length = len(data)
+    spacing = 2 << ANCHOR_BITS
+    next_fill = 8 * spacing
+    for chunk_start in range(0, length, CHUNK):
+        if cancelled is not None and cancelled():
+            return
+        # read a little more than the chunk, so the boundaries and anchors at its end are whole
+        chunk = data[chunk_start:chunk_start + CHUNK + max(window, ANCHOR_BITS + 1)]
+        chunk_end = chunk_start + min(CHUNK, len(chunk))
+        boundaries = [chunk_start + m.start() for m in _boundary.finditer(chunk.translate(_bits))]
+        for pos in [pos for pos in boundaries if pos < chunk_end] + [chunk_end]:
+            while next_fill < pos:
+                if next_fill + window <= length:
+                    yield next_fill, chunk[next_fill - chunk_start:next_fill - chunk_start + window]
+                next_fill += spacing
+            if pos == chunk_end:
+                break
+            if pos + window <= length:
+                yield pos, chunk[pos - chunk_start:pos - chunk_start + window]
+            next_fill = pos + 8 * spacing
+
+
+def diff_blocks(old, new, window=32, progress=None, cancelled=None):
+    """ Lines up two buffers (strings or DataSources) that have had data inserted,
+    deleted or changed, and returns the list of DiffBlocks covering both of them in order.
+
+    Both buffers are sampled at content-defined anchors (see _anchors), about one every
+    128 bytes, and the `window` bytes at each anchor of old go into an index. The anchors
+    of new are looked up in it, and each one that's found is grown in both directions
+    into a match, which the scan skips over. Where several places in old have the same
+    window (eg: runs of zeros), the one that keeps the current alignment wins. Matches
+    have to move forward in both buffers, so data that was moved back shows up as a
+    deletion and an insertion, and matches much shorter than the anchor spacing can be
+    missed.
+
+    Matching stretches cost a few comparisons each and everything else costs one dict
+    lookup per anchor, so the Python work is a small fraction of the size of the buffers
+    whatever they hold. `progress(done, total)` is called as new is scanned, and if
+    `cancelled()` becomes true, None is returned. """
+    old_len = len(old)
+    new_len = len(new)
+    anchors = {} # window -> [number of times seen, keep every nth, places]
+    for place, key in _anchors(old, window, cancelled):
+        entry = anchors.get(key)
+        if entry is None:
+            anchors[key] = [1, 1, [place]]
+            continue
+        # windows that repeat a lot (eg: zeros) keep an evenly thinned out sample of places
+        if entry[0] % entry[1] == 0:
+            entry[2].append(place)
+            if len(entry[2]) >= 64:
+                entry[2] = entry[2][::2]
+                entry[1] *= 2
+        entry[0] += 1
+    if cancelled is not None and cancelled():
+        return None
+
+    matches = []
+    old_floor = new_floor = 0 # ends of the last match
+    shift = 0 # old index - new index along the last match
+    next_report = CHUNK
+    for j, key in _anchors(new, window, cancelled):
+        if progress is not None and j >= next_report:
+            progress(j, new_len)
+            next_report = j + CHUNK
+        if j < new_floor:
+            continue # inside the last match
+        entry = anchors.get(key)
+        if entry is None:
+            continue
+        best = None
+        if old_floor <= j + shift and old[j + shift:j + shift + window] == key:
+            best = j + shift # the current alignment still holds, whatever places were kept
+        else:
+            for place in entry[2]:
+                if place >= old_floor and (best is None or abs(place - j - shift) < abs(best - j - shift)):
+                    best = place
+        if best is None:
+            continue
+        # grow the anchor backwards, then forwards
+        back = _match_backward(old, new, best, j, min(j - new_floor, best - old_floor))
+        length = back + _match_forward(old, new, best, j, min(old_len - best, new_len - j))
+        start_old = best - back
+        start_new = j - back
+        matches.append((start_old, start_new, length))
+        old_floor = start_old + length
+        new_floor = start_new + length
+        shift = start_old - start_new
+    if cancelled is not None and cancelled():
+        return None
+    if progress is not None:
+        progress(new_len, new_len)
+
+    blocks = []
+    i = j = 0
+    for start_old, start_new, length in matches:
+        _gap(blocks, i, start_old, j, start_new)
+        if blocks and blocks[-1].kind == "equal" and blocks[-1].old_end == start_old and blocks[-1].new_end == start_new:
+            blocks[-1] = blocks[-1]._replace(old_end=start_old + length, new_end=start_new + length)
+        else:
+            blocks.append(DiffBlock("equal", start_old, start_old + length, start_new, start_new + length))
+        i = start_old + length
+        j = start_new + length
+    _gap(blocks, i, old_len, j, new_len)
+    return blocks
+
+
+class AlignedMap(SegmentMap):
+    """ One side of a diff, as a SegmentMap whose pieces are placed at given indexes
+    rather than packed together, so that both sides can have the same layout """
+
+    def __init__(self, pieces, length, align):
+        """ `pieces` are (index, address, source, ruled) in order, where `ruled` says
+        whether a line should be drawn above the piece """
+        self.pieces = pieces
+        self.total = length
+        super(AlignedMap, self).__init__((), align)
+        self.segments = [(address, source) for _, address, source, _ in pieces]
+        self._layout()
+
+    def _layout(self):
+        self.addresses = [address for _, address, _, _ in self.pieces]
+        self.indexes = [index for index, _, _, _ in self.pieces]
+        self.collapsed = [ruled for _, _, _, ruled in self.pieces]
+        self.length = self.total
+
+    def add(self, address, data):
+        raise TypeError("The layout of an AlignedMap is fixed")
+
+    def remove(self, address):
+        raise TypeError("The layout of an AlignedMap is fixed")
+
+    def replace(self, address, data):
+        raise TypeError("The layout of an AlignedMap is fixed")
+
+
+def align_blocks(blocks, old, new, old_address=0, new_address=0, bpl=32):
+    """ Lays both sides of a diff out in lines of `bpl` bytes, starting every block on a
+    new line and padding the shorter side of each block so that the two line up.
+    Returns (old side, new side, [(block, index where it starts)]). """
+    if not isinstance(old, DataSource):
+        old = BufferSource(old)
+    if not isinstance(new, DataSource):
+        new = BufferSource(new)
+    old_pieces = []
+    new_pieces = []
+    placed = []
+    index = 0
+    previous = None
+    for block in blocks:
+        # rule off every change, and the matching stretch after it
+        ruled = index > 0 and (block.kind != "equal" or previous != "equal")
+        size = max(block.old_end - block.old_start, block.new_end - block.new_start)
+        if block.old_end > block.old_start:
+            old_pieces.append((index, old_address + block.old_start,
+                               SliceSource(old, block.old_start, block.old_end - block.old_start), ruled))
+        if block.new_end > block.new_start:
+            new_pieces.append((index, new_address + block.new_start,
+                               SliceSource(new, block.new_start, block.new_end - block.new_start), ruled))
+        placed.append((block, index))
+        index += -(-size // bpl) * bpl
+        previous = block.kind
+    return AlignedMap(old_pieces, index, bpl), AlignedMap(new_pieces, index, bpl), placed
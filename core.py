@@ -0,0 +1,13 @@
+# Everything that works without Qt, for scripts and CI: import this module rather than
+# the package, whose __init__ pulls in PyQt5. It only takes a few milliseconds to import.
+from datasource import *
+from dirty import *
+from highlights import *
+from history import *
+from layout import *
+from rowcache import *
+from formats import *
+from selection import *
+from export import *
+from search import *
+from bindiff import *
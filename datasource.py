@@ -0,0 +1,407 @@
+import mmap
+import os
+import bisect
+import collections
+import threading
+
+
+class DataSource(object):
+    """ Backing store for the bytes shown by a HexDisplay. Sources behave like a
+    byte string: len() is the size of the segment, indexing returns the value of
+    a single byte, and slicing returns a byte string. Subclasses only need to
+    implement read() and __len__, plus write() if they can be patched in place. """
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def read(self, start, length):
+        """ Returns up to `length` bytes starting at 0-based index `start` """
+        raise NotImplementedError
+
+    def write(self, start, data):
+        """ Overwrites the bytes at `start` in place. The write has to fit inside the source. """
+        raise NotImplementedError("This data source is read-only")
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self.read(start, stop - start)[::step]
+            return self.read(start, max(0, stop - start))
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError("DataSource index out of range")
+        return self.read(key, 1)[0]
+
+    def __iter__(self):
+        return iter(self.read(0, len(self)))
+
+    def close(self):
+        pass
+
+
+class BufferSource(DataSource):
+    """ Wraps a byte string that is already held in memory. This is what you get
+    when you assign a string to HexDisplay.data. """
+
+    def __init__(self, data=b""):
+        self.buffer = data
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def read(self, start, length):
+        if isinstance(self.buffer, bytearray):
+            return bytes(self.buffer[start:start + length])
+        return self.buffer[start:start + length]
+
+    def write(self, start, data):
+        if not isinstance(self.buffer, bytearray):
+            self.buffer = bytearray(self.buffer) # copy once, then patch in place from now on
+        self.buffer[start:start + len(data)] = data
+
+
+class MmapSource(DataSource):
+    """ Maps a file into memory instead of reading it. Opening is O(1) no matter
+    how large the file is, and the OS only pages in the parts that actually get
+    read, which in practice means the lines visible in paintEvent. The mapping is
+    read-only, so it costs no commit charge however big the file is. Writes are kept
+    as patched copies of the pages they touch and laid over the reads, so they only
+    change what's displayed, never the file. """
+
+    page_size = 4096
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._size = os.fstat(self._file.fileno()).st_size
+        if self._size > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = None # mmap refuses to map empty files
+        self.written = {} # page index -> patched contents
+        self._writtenIndexes = [] # the keys of written, sorted
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self._size
+
+    def read(self, start, length):
+        if self._map is None:
+            return b""
+        data = self._map[start:start + length]
+        if not self.written or not data:
+            return data
+        end = start + len(data)
+        with self.lock:
+            first = bisect.bisect_left(self._writtenIndexes, start // self.page_size)
+            last = bisect.bisect_right(self._writtenIndexes, (end - 1) // self.page_size)
+            if first == last:
+                return data
+            data = bytearray(data)
+            for index in self._writtenIndexes[first:last]:
+                page_start = index * self.page_size
+                lo = max(page_start, start)
+                hi = min(page_start + self.page_size, end)
+                data[lo - start:hi - start] = self.written[index][lo - page_start:hi - page_start]
+        return bytes(data)
+
+    def write(self, start, data):
+        if start < 0 or start + len(data) > self._size:
+            raise ValueError("Write outside of the mapped file")
+        with self.lock:
+            pos = 0
+            while pos < len(data):
+                index = (start + pos) // self.page_size
+                offset = (start + pos) - index * self.page_size
+                page = self.written.get(index)
+                if page is None:
+                    page = bytearray(self._map[index * self.page_size:(index + 1) * self.page_size])
+                    self.written[index] = page
+                    bisect.insort(self._writtenIndexes, index)
+                count = min(len(data) - pos, len(page) - offset)
+                page[offset:offset + count] = data[pos:pos + count]
+                pos += count
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class PagedSource(DataSource):
+    """ Reads through a callback (eg: a debugger's memory read) one page at a time
+    and keeps the most recently used pages around. Resident memory is bounded by
+    page_size * max_pages regardless of how large the segment is.
+
+    `reader(start, length)` is called with 0-based indexes and should return the
+    bytes at that location. Pages that have been written to are pinned until the next
+    invalidate(), so writes can't be lost to eviction. The cache is locked, so the
+    source can be read from a worker thread (eg: a search) while the view paints. """
+
+    def __init__(self, reader, size, page_size=4096, max_pages=256):
+        self.reader = reader
+        self.size = size
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.pages = collections.OrderedDict()
+        self.written = {} # page index -> patched contents
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self.size
+
+    def page(self, index):
+        """ Returns the contents of a page, fetching it if it isn't cached """
+        with self.lock:
+            if index in self.written:
+                return self.written[index]
+            if index in self.pages:
+                data = self.pages.pop(index)
+            else:
+                start = index * self.page_size
+                data = self.reader(start, min(self.page_size, self.size - start))
+            self.pages[index] = data # (re)insert as most recently used
+            while len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+            return data
+
+    def read(self, start, length, fetch=True):
+        """ With `fetch` False, pages that aren't cached read as zeros instead of being
+        read, and the cache is left as it is """
+        end = min(start + length, self.size)
+        if start >= end:
+            return b""
+        first = start // self.page_size
+        last = (end - 1) // self.page_size
+        if fetch:
+            chunks = [self.page(i) for i in range(first, last + 1)]
+        else:
+            chunks = [self._cached(i) for i in range(first, last + 1)]
+        offset = start - first * self.page_size
+        return b"".join(chunks)[offset:offset + (end - start)]
+
+    def _cached(self, index):
+        with self.lock:
+            data = self.written.get(index)
+            if data is None:
+                data = self.pages.get(index)
+        if data is None:
+            data = b"\0" * min(self.page_size, self.size - index * self.page_size)
+        return data
+
+    def available(self, start, end):
+        """ The parts of the indexes [start, end) whose pages are cached or written, as a
+        list of (start, end) ranges """
+        with self.lock:
+            indexes = sorted(set(self.pages) | set(self.written))
+        spans = []
+        for index in indexes:
+            lo = max(index * self.page_size, start)
+            hi = min((index + 1) * self.page_size, end, self.size)
+            if lo >= hi:
+                continue
+            if spans and spans[-1][1] == lo:
+                spans[-1] = (spans[-1][0], hi)
+            else:
+                spans.append((lo, hi))
+        return spans
+
+    def write(self, start, data):
+        with self.lock:
+            pos = 0
+            while pos < len(data):
+                index = (start + pos) // self.page_size
+                offset = (start + pos) - index * self.page_size
+                page = bytearray(self.page(index))
+                count = min(len(data) - pos, len(page) - offset)
+                page[offset:offset + count] = data[pos:pos + count]
+                self.written[index] = bytes(page)
+                self.pages.pop(index, None)
+                pos += count
+
+    def invalidate(self):
+        """ Drops every cached page, eg: after the target has been resumed """
+        with self.lock:
+            self.pages.clear()
+            self.written.clear()
+
+
+class SegmentMap(DataSource):
+    """ Several non-contiguous segments of an address space (eg: the stack, the heap and
+    some mapped libraries) shown as one source, without allocating the holes between them.
+
+    The segments are laid out one after another in the 0-based index space, keeping
+    index % align == address % align so that lines still start at round addresses as
+    long as bpl divides `align`. Gaps shorter than `align` are kept as they are; longer
+    ones are collapsed down to the padding needed to realign. Indexes that fall in a gap
+    read as zeros and are reported by unmapped(). Looking up the segment of an index or
+    an address is a binary search. """
+
+    def __init__(self, segments=(), align=64):
+        self.align = align
+        self.segments = [] # (address, source), sorted by address
+        self._layout()
+        for address, data in segments:
+            self.add(address, data)
+
+    def __len__(self):
+        return self.length
+
+    def _layout(self):
+        """ Works out where each segment starts in the index space """
+        self.addresses = [address for address, _ in self.segments]
+        self.indexes = []
+        self.collapsed = [] # whether the gap before each segment was collapsed
+        index = 0
+        end = None # address just past the previous segment
+        for address, source in self.segments:
+            if end is not None and address - end < self.align:
+                index += address - end
+                self.collapsed.append(False)
+            else:
+                index = -(-index // self.align) * self.align + address % self.align
+                self.collapsed.append(end is not None)
+            self.indexes.append(index)
+            index += len(source)
+            end = address + len(source)
+        self.length = index
+
+    def add(self, address, data):
+        """ Maps `data` (a DataSource or a string) at `address` """
+        if not isinstance(data, DataSource):
+            data = BufferSource(data)
+        i = bisect.bisect_left(self.addresses, address)
+        if i > 0 and self.segments[i - 1][0] + len(self.segments[i - 1][1]) > address or \
+                i < len(self.segments) and address + len(data) > self.segments[i][0]:
+            raise ValueError("Segment at {:#x} overlaps another segment".format(address))
+        self.segments.insert(i, (address, data))
+        self._layout()
+
+    def remove(self, address):
+        """ Unmaps the segment starting at `address` """
+        i = bisect.bisect_left(self.addresses, address)
+        if i == len(self.segments) or self.addresses[i] != address:
+            raise KeyError("No segment starts at {:#x}".format(address))
+        del self.segments[i]
+        self._layout()
+
+    def replace(self, address, data):
+        """ Returns a copy of the map where the segment holding `address` (or ending right
+        before it) is cut off at `address` and followed by `data`, like update_addr does
+        to a single segment. An address outside of every segment starts a new one. The
+        other segments are shared with this map rather than copied. """
+        segments = list(self.segments)
+        i = bisect.bisect_right(self.addresses, address) - 1
+        if i >= 0 and address <= segments[i][0] + len(segments[i][1]):
+            start, source = segments[i]
+            segments[i] = (start, source[0:address - start] + bytes(data))
+        else:
+            segments.append((address, data))
+        return SegmentMap(sorted(segments, key=lambda segment: segment[0]), self.align)
+
+    def segment(self, index):
+        """ Returns the number of the segment holding `index`, or if it's in a gap, of the
+        segment before it (-1 if there isn't one) """
+        return bisect.bisect_right(self.indexes, index) - 1
+
+    def index_to_address(self, index):
+        """ Returns the address of `index`. Indexes in a gap are numbered on from the
+        segment they share a line of `align` bytes with. """
+        i = self.segment(index)
+        if i + 1 < len(self.segments) and (i < 0 or (index - self.indexes[i] >= len(self.segments[i][1])
+                                                     and index // self.align == self.indexes[i + 1] // self.align)):
+            i += 1
+        if i < 0:
+            return index
+        return self.addresses[i] + index - self.indexes[i]
+
+    def address_to_index(self, address, after=None):
+        """ Returns the index of `address`. Unmapped addresses raise a ValueError, unless
+        `after` is given, in which case the index of the next (after=True) or previous
+        (after=False) mapped byte is returned. """
+        i = bisect.bisect_right(self.addresses, address) - 1
+        if i >= 0 and address < self.addresses[i] + len(self.segments[i][1]):
+            return self.indexes[i] + address - self.addresses[i]
+        if after is None:
+            raise ValueError("Address {:#x} isn't in any segment".format(address))
+        if after:
+            return self.indexes[i + 1] if i + 1 < len(self.segments) else self.length
+        return self.indexes[i] + len(self.segments[i][1]) - 1 if i >= 0 else -1
+
+    def unmapped(self, start, end):
+        """ Returns the parts of the indexes [start, end) that aren't in any segment, as a
+        list of (start, end) ranges """
+        spans = []
+        pos = start
+        i = max(self.segment(start), 0)
+        while pos < end:
+            if i < len(self.segments) and pos >= self.indexes[i]:
+                pos = max(pos, self.indexes[i] + len(self.segments[i][1]))
+                i += 1
+                continue
+            gap_end = min(self.indexes[i] if i < len(self.segments) else end, end)
+            if pos < gap_end:
+                spans.append((pos, gap_end))
+            pos = gap_end
+        return spans
+
+    def boundaries(self, start, end):
+        """ Returns the indexes in [start, end) where a segment starts after a collapsed gap """
+        first = bisect.bisect_left(self.indexes, start)
+        last = bisect.bisect_left(self.indexes, end)
+        return [self.indexes[i] for i in range(first, last) if self.collapsed[i]]
+
+    def _pieces(self, start, end):
+        """ Yields (segment number, offset into it, index, count) for the mapped parts of [start, end) """
+        i = max(self.segment(start), 0)
+        while i < len(self.segments) and self.indexes[i] < end:
+            lo = max(start, self.indexes[i])
+            hi = min(end, self.indexes[i] + len(self.segments[i][1]))
+            if lo < hi:
+                yield i, lo - self.indexes[i], lo, hi - lo
+            i += 1
+
+    def read(self, start, length):
+        end = min(start + length, self.length)
+        if start >= end:
+            return b""
+        chunks = []
+        pos = start
+        for i, offset, index, count in self._pieces(start, end):
+            if index > pos:
+                chunks.append(b"\0" * (index - pos))
+            chunks.append(self.segments[i][1].read(offset, count))
+            pos = index + count
+        if pos < end:
+            chunks.append(b"\0" * (end - pos))
+        return b"".join(chunks)
+
+    def write(self, start, data):
+        for i, offset, index, count in self._pieces(start, start + len(data)):
+            self.segments[i][1].write(offset, data[index - start:index - start + count])
+
+    def close(self):
+        for _, source in self.segments:
+            source.close()
+
+
+class SliceSource(DataSource):
+    """ The `length` bytes of another source starting at `start`, without copying them """
+
+    def __init__(self, source, start, length):
+        self.source = source
+        self.start = start
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, start, length):
+        length = max(min(length, self.length - start), 0)
+        return self.source.read(self.start + start, length)
+
+    def write(self, start, data):
+        self.source.write(self.start + start, data)
@@ -0,0 +1,242 @@
+# Number of set bits in every possible byte, for counting dirty bytes with bytes.translate
+popcount = bytes(bytearray(bin(b).count("1") for b in range(256)))
+# The 8 flags of every possible bitmap byte, lowest bit first, for expanding a run of the map
+bit_flags = [tuple(bool(b & (1 << i)) for i in range(8)) for b in range(256)]
+
+
+class DirtyMap(object):
+    """ Tracks which bytes changed in the last update, using one bit per byte.
+    Indexing with a 0-based index returns whether that byte is dirty; anything
+    past the end of the map is clean.
+
+    The bitmap is split into blocks that are only allocated once something in them
+    is marked, so an update that changes a few bytes of a huge segment stays cheap. """
+
+    # Bytes compared at a time before looking for the individual changes
+    chunk_size = 4096
+    coarse_size = 1 << 20
+    sub_chunk_size = 64 # without int.from_bytes
+    # Bitmap bytes per block; each block covers block_size * 8 bytes of data
+    block_size = 512
+    block_shift = 12 # log2(block_size * 8), to go from a data index to its block
+    full_block = b"\xff" * block_size # shared by blocks that are entirely dirty
+
+    def __init__(self, length=0):
+        self.length = length
+        self.blocks = {}
+        # bounds of everything that has been marked, so the changes can be repainted later
+        self.low = length
+        self.high = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self.length:
+            return False
+        block = self.blocks.get(index >> self.block_shift)
+        if block is None:
+            return False
+        return bool(block[(index >> 3) % self.block_size] & (1 << (index & 7)))
+
+    def flags(self, start, length):
+        """ Returns whether each of the bytes [start, start + length) is dirty, as a list,
+        reading the bitmap a byte at a time instead of indexing it once per byte """
+        end = min(start + length, self.length)
+        flags = []
+        pos = max(start, 0)
+        if pos > start:
+            flags.extend([False] * (min(pos, start + length) - start))
+        while pos < end:
+            number = pos >> self.block_shift
+            stop = min((number + 1) << self.block_shift, end)
+            block = self.blocks.get(number)
+            if block is None:
+                flags.extend([False] * (stop - pos))
+            elif block is self.full_block:
+                flags.extend([True] * (stop - pos))
+            else:
+                first = (pos >> 3) % self.block_size
+                last = ((stop - 1) >> 3) % self.block_size + 1
+                expanded = [flag for value in bytearray(block[first:last]) for flag in bit_flags[value]]
+                flags.extend(expanded[pos & 7:(pos & 7) + stop - pos])
+            pos = stop
+        flags.extend([False] * (length - len(flags)))
+        return flags
+
+    def set(self, index):
+        self._or_bytes(index >> 3, bytearray([1 << (index & 7)]))
+        self._extend(index, index + 1)
+
+    def _extend(self, start, end):
+        self.low = min(self.low, start)
+        self.high = max(self.high, end)
+
+    def _or_bytes(self, first, packed):
+        """ ORs `packed` into the bitmap starting at bitmap byte `first` """
+        pos = 0
+        while pos < len(packed):
+            number, offset = divmod(first + pos, self.block_size)
+            count = min(len(packed) - pos, self.block_size - offset)
+            chunk = packed[pos:pos + count]
+            block = self.blocks.get(number)
+            if block is self.full_block:
+                pass
+            elif count == self.block_size and chunk == self.full_block:
+                self.blocks[number] = self.full_block
+            elif block is None:
+                block = self.blocks[number] = bytearray(self.block_size)
+                block[offset:offset + count] = chunk
+            elif block[offset:offset + count].count(b"\0") == count:
+                block[offset:offset + count] = chunk
+            else:
+                for i, value in enumerate(bytearray(chunk)):
+                    if value:
+                        block[offset + i] |= value
+            pos += count
+
+    def set_range(self, start, end):
+        """ Marks every byte in [start, end) as dirty """
+        start = max(start, 0)
+        end = min(end, self.length)
+        if start < end:
+            self._extend(start, end)
+        while start < end and start & 7:
+            self.set(start)
+            start += 1
+        full = end >> 3
+        while (start >> 3) < full:
+            count = min(full - (start >> 3), self.block_size - ((start >> 3) % self.block_size))
+            self._or_bytes(start >> 3, self.full_block[:count])
+            start += count * 8
+        while start < end:
+            self.set(start)
+            start += 1
+
+    def chunks(self):
+        """ Yields (start, end) index ranges that contain every dirty byte, one per block
+        of the bitmap that has anything marked in it """
+        size = 1 << self.block_shift
+        for number in sorted(self.blocks):
+            block = self.blocks[number]
+            if block.count(b"\0") != len(block):
+                yield number * size, min((number + 1) * size, self.length)
+
+    def counts(self):
+        """ Yields (start, number of dirty bytes) for every block of the bitmap that has
+        anything marked in it, where each block covers 1 << block_shift bytes """
+        size = 1 << self.block_shift
+        for number in sorted(self.blocks):
+            count = sum(bytearray(bytes(self.blocks[number]).translate(popcount)))
+            if count:
+                yield number * size, count
+
+    def copy(self):
+        copy = DirtyMap(self.length)
+        copy.blocks = dict((number, block if block is self.full_block else bytearray(block))
+                           for number, block in self.blocks.items())
+        copy.low = self.low
+        copy.high = self.high
+        return copy
+
+    def any(self):
+        return any(block.count(b"\0") != len(block) for block in self.blocks.values())
+
+    def mark_changes(self, start, old, new):
+        """ Marks the bytes where `old` and `new` differ, with index 0 of both at `start` """
+        pad = start & 7
+        if pad:
+            old = b"\0" * pad + bytes(old)
+            new = b"\0" * pad + bytes(new)
+        self.compare(old, new, start - pad, min(len(old), len(new)))
+
+    def compare(self, old, new, start, length):
+        """ Marks the bytes where old[0:length] and new[0:length] differ, where index 0 of
+        both strings corresponds to `start` in this map. `start` must be a multiple of 8. """
+        if old[:length] == new[:length]:
+            return
+        self._extend(start, start + length)
+        if not hasattr(int, 'from_bytes'): # python 2
+            self._compare_bytewise(old, new, start, length)
+            return
+        # XOR the two chunks as big integers, fold every nonzero byte down to its lowest
+        # bit, then gather the low bits of each group of 8 bytes into the first byte of
+        # the group. That leaves exactly the bitmap we want in every 8th byte.
+        pad = b"\0" * (-length % 8)
+        size = length + len(pad)
+        x = int.from_bytes(bytes(old) + pad, 'little') ^ int.from_bytes(bytes(new) + pad, 'little')
+        x |= x >> 4
+        x |= x >> 2
+        x |= x >> 1
+        x &= int.from_bytes(b"\x01" * size, 'little')
+        x |= x >> 7
+        x |= x >> 14
+        x |= x >> 28
+        self._or_bytes(start >> 3, x.to_bytes(size, 'little')[::8])
+
+    def _compare_bytewise(self, old, new, start, length):
+        for offset in range(0, length, self.sub_chunk_size):
+            a = old[offset:offset + self.sub_chunk_size]
+            b = new[offset:offset + self.sub_chunk_size]
+            if a == b:
+                continue
+            a = bytearray(a)
+            b = bytearray(b)
+            for base in range(0, len(a), 8):
+                bit = 0
+                for i in range(base, min(base + 8, len(a))):
+                    if a[i] != b[i]:
+                        bit |= 1 << (i - base)
+                if bit:
+                    self._or_bytes((start + offset + base) >> 3, bytearray([bit]))
+
+    @classmethod
+    def diff(cls, old, new, shift=0, spans=None):
+        """ Builds the map of bytes in `new` that differ from `old`, where new[i] lines up
+        with old[i + shift]. Bytes with nothing before them in `old` (ie: the stack grew)
+        are dirty, bytes past the end of `old` are not. Both arguments only need to
+        support len() and slicing, so DataSources work. If `spans` is given, only the
+        indexes in those (start, end) ranges are read and compared; the rest count as
+        clean, which keeps an AsyncSource from fetching pages nobody has looked at.
+
+        Equal stretches are skipped a chunk at a time using string comparisons, so the
+        cost is dominated by the parts that actually changed. """
+        dirty = cls(len(new))
+        if old is new and shift == 0:
+            return dirty
+        first = 0
+        if shift < 0:
+            first = min(-shift, len(new))
+            dirty.set_range(0, first)
+        # don't compare past the end of either buffer
+        last = min(len(new), len(old) - shift)
+        if spans is None:
+            spans = [(first, last)]
+        for start, end in spans:
+            start = max(start, first)
+            end = min(end, last)
+            if start < end:
+                dirty._diff_range(old, new, shift, start, end)
+        return dirty
+
+    def _diff_range(self, old, new, shift, pos, last):
+        # the stack can grow by an amount that isn't a multiple of 8, so compare up to the
+        # next whole byte of the map one at a time
+        head = min((pos + 7) & ~7, last)
+        while pos < head:
+            if old[pos + shift:pos + shift + 1] != new[pos:pos + 1]:
+                self.set(pos)
+            pos += 1
+        while pos < last:
+            # skip over big identical stretches first, then look at the chunks of the rest
+            coarse_end = min((pos // self.coarse_size + 1) * self.coarse_size, last)
+            if old[pos + shift:coarse_end + shift] == new[pos:coarse_end]:
+                pos = coarse_end
+                continue
+            while pos < coarse_end:
+                end = min((pos // self.chunk_size + 1) * self.chunk_size, coarse_end)
+                a = old[pos + shift:end + shift]
+                b = new[pos:end]
+                if a != b:
+                    self.compare(a, b, pos, end - pos)
+                pos = end
@@ -0,0 +1,104 @@
+import base64
+import binascii
+import struct
+
+from layout import address_width, format_address, iter_chunks
+from rowcache import ascii_translation, to_ascii, to_hex
+
+FORMATS = ("hexdump", "carray", "base64")
+
+# How much is read and formatted at a time, whatever the size of the range
+CHUNK = 1 << 20
+
+
+def _interleave(template, count, columns):
+    """ Builds `count` fixed width lines at once: `template` repeated, with column c of
+    every line then set from columns[c], a string with one byte per line. That's one
+    strided slice assignment per column instead of formatting line by line. """
+    out = bytearray(template * count)
+    length = len(template)
+    for column, values in columns:
+        out[column::length] = values
+    return bytes(out)
+
+
+def _hexdump_lines(data, address, bpl, width):
+    """ The hexdump text of the whole lines in `data`, laid out like the widget:
+    address, hex, then ascii, two spaces apart """
+    count = len(data) // bpl
+    data = bytes(data[:count * bpl])
+    hex_start = width + 2
+    ascii_start = hex_start + bpl * 3 + 1
+    template = b" " * (ascii_start + bpl) + b"\n"
+    digits = binascii.hexlify(data)
+    text = data.translate(ascii_translation)
+    columns = []
+    for i in range(bpl):
+        columns.append((hex_start + 3 * i, digits[2 * i::2 * bpl]))
+        columns.append((hex_start + 3 * i + 1, digits[2 * i + 1::2 * bpl]))
+        columns.append((ascii_start + i, text[i::bpl]))
+    # every address in one go, as big endian 64 bit ints
+    addresses = binascii.hexlify(struct.pack(">{}Q".format(count), *range(address, address + count * bpl, bpl)))
+    for i in range(width):
+        columns.append((i, addresses[16 - width + i::16]))
+    return _interleave(template, count, columns)
+
+
+def _carray_lines(data, bpl):
+    count = len(data) // bpl
+    digits = binascii.hexlify(bytes(data[:count * bpl]))
+    template = b"   " + b" 0x??," * bpl + b"\n"
+    columns = []
+    for i in range(bpl):
+        columns.append((6 + 6 * i, digits[2 * i::2 * bpl]))
+        columns.append((7 + 6 * i, digits[2 * i + 1::2 * bpl]))
+    return _interleave(template, count, columns)
+
+
+def export(source, out, start=0, end=None, fmt="hexdump", bpl=16, address=None, name="data"):
+    """ Writes the indexes [start, end) of `source` (a DataSource or string) to `out`, a
+    file opened for writing bytes, as one of FORMATS:
+        "hexdump" - `bpl` bytes a line, labelled from `address` (by default `start`)
+        "carray"  - a C unsigned char array called `name`, `bpl` bytes a line
+        "base64"  - base64 in lines of 76 characters
+    The range is read and written CHUNK bytes at a time, so exporting any amount takes
+    the same memory. Returns the number of bytes exported. """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown export format: {}".format(fmt))
+    if bpl < 1:
+        raise ValueError("Bytes per line has to be at least 1: {}".format(bpl))
+    end = len(source) if end is None else min(end, len(source))
+    start = min(start, end)
+    if address is None:
+        address = start
+    if fmt == "base64":
+        size = CHUNK - CHUNK % 57 # 57 bytes make a 76 character line
+    else:
+        size = max(CHUNK - CHUNK % bpl, bpl)
+    width = address_width(address + max(end - start - 1, 0))
+    if fmt == "carray":
+        out.write("unsigned char {}[{}] = {{\n".format(name, end - start).encode("ascii"))
+    for index, data in iter_chunks(source, start, end, size):
+        whole = len(data) - len(data) % bpl
+        if fmt == "base64":
+            encoded = base64.b64encode(data)
+            out.write(b"\n".join([encoded[i:i + 76] for i in range(0, len(encoded), 76)]) + b"\n")
+        elif fmt == "hexdump":
+            out.write(_hexdump_lines(data, address + index - start, bpl, width))
+            if whole < len(data):
+                rest = data[whole:]
+                out.write("{}  {:<{}}  {}\n".format(format_address(address + index - start + whole, width),
+                                                    to_hex(rest), bpl * 3 - 1, to_ascii(rest)).encode("latin-1"))
+        else:
+            out.write(_carray_lines(data, bpl))
+            if whole < len(data):
+                out.write(("   " + "".join(" 0x{:02x},".format(b) for b in bytearray(data[whole:])) + "\n").encode("ascii"))
+    if fmt == "carray":
+        out.write(b"};\n")
+    return end - start
+
+
+def export_file(source, path, start=0, end=None, fmt="hexdump", **options):
+    """ Like export, but to the file at `path` """
+    with open(path, "wb") as out:
+        return export(source, out, start, end, fmt, **options)
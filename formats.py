@@ -0,0 +1,56 @@
+import binascii
+import struct
+
+from rowcache import to_hex
+
+
+class DisplayMode(object):
+    """ How the hex column shows a line: as `size` byte elements, each `width` characters
+    wide and separated by a space. Integers are shown in hex, most significant digit
+    first whatever the byte order; floats are shown in decimal.
+
+    render() decodes a whole window of lines at once, with a single struct call for all
+    of its elements rather than one per cell, so it can be done for every visible line
+    without slowing painting down. """
+
+    def __init__(self, name, code=None, size=1, big_endian=False, width=None, float_format=None):
+        self.name = name
+        self.code = code # struct format character, or None for plain bytes
+        self.size = size
+        self.big_endian = big_endian
+        self.float_format = float_format
+        self.width = width or 2 * size
+        self.cell = self.width + 1 # characters per element, including the space after it
+
+    def render(self, data, bpl):
+        """ Returns the hex column text of every line of `bpl` bytes in `data` """
+        if self.code is None:
+            return [to_hex(data[i:i + bpl]) for i in range(0, len(data), bpl)]
+        count = len(data) // self.size
+        whole = bytes(data[:count * self.size])
+        if self.float_format is None:
+            if not self.big_endian: # swap every element around, then read the digits straight off
+                fmt = "{}" + str(count) + self.code
+                whole = struct.pack(fmt.format(">"), *struct.unpack(fmt.format("<"), whole))
+            digits = binascii.hexlify(whole).decode("ascii")
+            cells = [digits[i:i + self.width] for i in range(0, len(digits), self.width)]
+        else:
+            values = struct.unpack("{}{}{}".format(">" if self.big_endian else "<", count, self.code), whole)
+            cells = [self.float_format.format(v) for v in values]
+        if count * self.size < len(data): # a partial element at the end
+            cells.append(binascii.hexlify(bytes(data[count * self.size:])).decode("ascii").ljust(self.width))
+        per_line = bpl // self.size
+        return [" ".join(cells[i:i + per_line]) for i in range(0, len(cells), per_line)]
+
+
+MODES = {"hex": DisplayMode("hex")}
+for _bits, _code in ((16, "H"), (32, "I"), (64, "Q")):
+    MODES["u{}le".format(_bits)] = DisplayMode("u{}le".format(_bits), _code, _bits // 8)
+    MODES["u{}be".format(_bits)] = DisplayMode("u{}be".format(_bits), _code, _bits // 8, True)
+for _bits, _code, _format in ((32, "f", "{:>13.6g}"), (64, "d", "{:>22.15g}")):
+    _width = int(_format[3:5])
+    MODES["f{}le".format(_bits)] = DisplayMode("f{}le".format(_bits), _code, _bits // 8, False, _width, _format)
+    MODES["f{}be".format(_bits)] = DisplayMode("f{}be".format(_bits), _code, _bits // 8, True, _width, _format)
+# pointer-sized, for the usual little endian targets
+MODES["ptr"] = MODES["u64le"]
+MODES["ptr32"] = MODES["u32le"]
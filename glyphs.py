@@ -0,0 +1,78 @@
+from PyQt5.QtCore import Qt, QPointF, QRectF
+from PyQt5.QtGui import QPainter, QPixmap, QColor
+
+
+class GlyphAtlas(object):
+    """ Pre-renders the hex and ascii text of all 256 byte values into one pixmap per
+    text color, so painting a cell is a blit instead of a trip through the font engine.
+    Sheets are keyed by (color, font, device pixel ratio). The owning widget has to
+    call invalidate() when its font or palette changes.
+
+    Each sheet has two rows: the two-character hex text of every byte, followed by
+    its ascii representation. """
+
+    def __init__(self, widget, hex_table, ascii_table):
+        self.widget = widget
+        self.hex_table = hex_table
+        self.ascii_table = ascii_table
+        self.sheets = {}
+        self.fragments = {}
+
+    def invalidate(self):
+        self.sheets = {}
+        self.fragments = {}
+
+    def sheet(self, color):
+        widget = self.widget
+        dpr = widget.devicePixelRatioF()
+        key = (QColor(color).rgba(), widget.font().key(), dpr)
+        pixmap = self.sheets.get(key)
+        if pixmap is None:
+            pixmap = self.render(color, dpr)
+            self.sheets[key] = pixmap
+        return pixmap
+
+    def render(self, color, dpr):
+        charw = self.widget.charWidth
+        charh = self.widget.charHeight
+        baseline = charh - self.widget.magic_font_offset
+        pixmap = QPixmap(int(256 * 2 * charw * dpr), int(2 * charh * dpr))
+        pixmap.setDevicePixelRatio(dpr)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setFont(self.widget.font())
+        painter.setPen(color)
+        for b in range(256):
+            painter.drawText(b * 2 * charw, baseline, self.hex_table[b])
+            painter.drawText(b * charw, charh + baseline, self.ascii_table[b])
+        painter.end()
+        return pixmap
+
+    def fragment(self, column, value, step, ascii, dpr):
+        """ Returns the (cached) fragment that places the glyph of `value` in the given
+        column of a line whose first cell starts at (0, 0) """
+        key = (column, value, step, ascii, dpr)
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            charw = self.widget.charWidth
+            charh = self.widget.charHeight
+            width = charw if ascii else 2 * charw
+            row = charh if ascii else 0
+            fragment = QPainter.PixmapFragment.create(
+                QPointF(column * step + width / 2.0, charh / 2.0),
+                QRectF(value * width * dpr, row * dpr, width * dpr, charh * dpr),
+                1.0 / dpr, 1.0 / dpr)
+            self.fragments[key] = fragment
+        return fragment
+
+    def drawRun(self, painter, x, y, start, values, color, step, ascii=False):
+        """ Blits the glyphs for `values` in a single call. (x, y) is the top left corner
+        of the line's first cell, `start` is the column of the first value, and each
+        column is `step` pixels wide. """
+        pixmap = self.sheet(color)
+        dpr = pixmap.devicePixelRatio()
+        fragment = self.fragment
+        fragments = [fragment(start + i, b, step, ascii, dpr) for i, b in enumerate(values)]
+        painter.translate(x, y)
+        painter.drawPixmapFragments(fragments, pixmap)
+        painter.translate(-x, -y)
@@ -0,0 +1,54 @@
+""" Exports part of a file as a hexdump, C array or base64, without needing Qt:
+
+    python hexdump.py firmware.bin --start 0x1000 --length 4096
+    python hexdump.py firmware.bin --format carray --name firmware -o firmware.h
+
+The file is memory-mapped and written out a chunk at a time, so any size works.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from core import FORMATS, MmapSource, export
+
+
+def number(text):
+    return int(text, 0)
+
+
+def positive(text):
+    value = number(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("has to be at least 1: {}".format(text))
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export part of a file as text")
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=FORMATS, default="hexdump")
+    parser.add_argument("--start", type=number, default=0, help="offset in the file to start at")
+    parser.add_argument("--length", type=number, help="how many bytes to export (default: to the end)")
+    parser.add_argument("--bpl", type=positive, default=16, help="bytes per line")
+    parser.add_argument("--address", type=number, help="address of the first byte (default: the offset)")
+    parser.add_argument("--name", default="data", help="name of the C array")
+    parser.add_argument("-o", "--output", help="file to write to (default: stdout)")
+    args = parser.parse_args()
+
+    source = MmapSource(args.file)
+    end = len(source) if args.length is None else args.start + args.length
+    out = open(args.output, "wb") if args.output else getattr(sys.stdout, "buffer", sys.stdout)
+    try:
+        export(source, out, args.start, end, args.format, args.bpl, args.address, args.name)
+    finally:
+        if args.output:
+            out.close()
+        source.close()
+
+
+if __name__ == "__main__":
+    main()
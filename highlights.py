@@ -0,0 +1,102 @@
+import bisect
+
+
+class HighlightIndex(object):
+    """ Stores the NamedSelections used as highlights, sorted by start address so that
+    "which highlights overlap this range" costs a bisect plus the number of nearby
+    highlights instead of a scan over all of them. A name -> highlights index makes
+    clearing a name proportional to the number of highlights it has.
+
+    Highlights are kept in levels by the bit length of their length, each sorted on its
+    own. A level only has to be searched from its own longest possible highlight before
+    the range, so one very long highlight doesn't make every lookup scan everything
+    that starts before it.
+
+    Iterating yields highlights in the order they were added, which is also the order
+    of precedence when several of them cover the same byte.
+
+    Removal leaves a tombstone in the sorted list; the list is compacted once
+    tombstones make up half of it. """
+
+    def __init__(self):
+        self._levels = {} # bit length of (end - start) -> sorted [(start address, sequence number)]
+        self._entries = {} # sequence number -> selection
+        self._names = {} # name -> set of sequence numbers
+        self._seq = 0
+        self._size = 0 # items in the levels, tombstones included
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter([self._entries[seq] for seq in sorted(self._entries)])
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def append(self, selection):
+        seq = self._seq
+        self._seq += 1
+        self._entries[seq] = selection
+        level = (selection.end_address - selection.start_address).bit_length()
+        bisect.insort(self._levels.setdefault(level, []), (selection.start_address, seq))
+        self._size += 1
+        self._names.setdefault(getattr(selection, 'name', None), set()).add(seq)
+
+    def clear(self):
+        self.__init__()
+
+    def overlapping(self, start, end):
+        """ Returns the highlights that cover any address in [start, end], in order of precedence """
+        return [self._entries[seq] for seq in self._overlapping(start, end)]
+
+    def remove_containing(self, address):
+        """ Deletes all the highlights that contain a given address, and returns them """
+        removed = [self._remove(seq) for seq in self._overlapping(address, address)]
+        self._compact()
+        return removed
+
+    def remove_named(self, name):
+        """ Deletes all the highlights with the given name, and returns them """
+        removed = [self._remove(seq) for seq in list(self._names.get(name, ()))]
+        self._compact()
+        return removed
+
+    def _overlapping(self, start, end):
+        found = []
+        for level, starts in self._levels.items():
+            # nothing in this level is longer than this, so nothing starting before it can reach start
+            reach = (1 << level) - 1
+            lo = bisect.bisect_left(starts, (start - reach, -1))
+            hi = bisect.bisect_right(starts, (end, self._seq))
+            for _, seq in starts[lo:hi]:
+                selection = self._entries.get(seq)
+                if selection is not None and selection.end_address >= start:
+                    found.append(seq)
+        found.sort()
+        return found
+
+    def _remove(self, seq):
+        selection = self._entries.pop(seq)
+        name = getattr(selection, 'name', None)
+        self._names[name].discard(seq)
+        if not self._names[name]:
+            del self._names[name]
+        self._dead += 1
+        return selection
+
+    def _compact(self):
+        if self._dead * 2 < self._size:
+            return
+        for level in list(self._levels):
+            starts = [item for item in self._levels[level] if item[1] in self._entries]
+            if starts:
+                self._levels[level] = starts
+            else:
+                del self._levels[level]
+        self._size = len(self._entries)
+        self._dead = 0
@@ -0,0 +1,99 @@
+import collections
+
+from dirty import DirtyMap
+
+
+class SnapshotHistory(object):
+    """ Remembers what memory looked like over the last `depth` updates without keeping a
+    full copy of any of them. Each update is stored as the previous contents of just the
+    pages it changed (a copy-on-write delta), so the cost of a step is proportional to
+    how much changed in it. Pages are aligned to absolute addresses, which keeps them
+    stable when the starting address moves.
+
+    States are numbered by generation: update number g turns generation g - 1 into
+    generation g, and `generation` is the state currently on display. Anything older
+    than `oldest` has been forgotten, either because there are more than `depth` steps
+    or because the stored pages would take more than `max_bytes`. """
+
+    def __init__(self, depth=32, max_bytes=64 << 20, page_size=4096):
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.page_size = page_size
+        self.steps = collections.deque() # (generation, {page number: (address, old bytes)})
+        self.generation = 0
+        self.checkpoints = {} # name -> generation
+        self.used = 0
+
+    @property
+    def oldest(self):
+        """ The oldest generation that can still be compared against """
+        return self.steps[0][0] - 1 if self.steps else self.generation
+
+    def capture(self, pages, source, base, start, end):
+        """ Saves what `source` (whose index 0 is at address `base`) holds in the pages
+        covering the addresses [start, end) into `pages`, skipping pages already saved.
+        Call this before the bytes are overwritten, then pass `pages` to commit. """
+        size = self.page_size
+        for page in range(start // size, (end - 1) // size + 1):
+            if page in pages:
+                continue
+            lo = max(page * size, base)
+            hi = min((page + 1) * size, base + len(source))
+            pages[page] = (lo, bytes(source[lo - base:hi - base]) if lo < hi else b"")
+
+    def commit(self, pages):
+        """ Records one update, given the old contents of the pages it changed """
+        self.generation += 1
+        self.steps.append((self.generation, pages))
+        self.used += sum(len(old) for _, old in pages.values())
+        while self.steps and (len(self.steps) > self.depth or self.used > self.max_bytes):
+            _, dropped = self.steps.popleft()
+            self.used -= sum(len(old) for _, old in dropped.values())
+        for name, generation in list(self.checkpoints.items()):
+            if generation < self.oldest:
+                del self.checkpoints[name]
+
+    def checkpoint(self, name):
+        """ Names the current generation so it can be compared against later """
+        self.checkpoints[name] = self.generation
+
+    def resolve(self, baseline):
+        """ Turns a baseline into a generation: an int counts updates back from the current
+        state (1 is the state before the last update), a string names a checkpoint """
+        if isinstance(baseline, int):
+            generation = self.generation - baseline
+        elif baseline in self.checkpoints:
+            generation = self.checkpoints[baseline]
+        else:
+            raise KeyError("No checkpoint named {}".format(baseline))
+        if generation < self.oldest:
+            raise ValueError("That snapshot is no longer in the history")
+        return generation
+
+    def dirty_since(self, generation, source, base):
+        """ Builds the DirtyMap of bytes in `source` (index 0 at address `base`) that are
+        different from what they were at `generation`. Only the pages some later update
+        touched are looked at, and the old state is never put back together. """
+        pages = {}
+        for step, changed in reversed(self.steps):
+            if step <= generation:
+                break
+            pages.update(changed) # older steps overwrite newer ones, leaving the contents at `generation`
+        dirty = DirtyMap(len(source))
+        end = base + len(source)
+        for page, (address, old) in pages.items():
+            lo = max(page * self.page_size, base)
+            hi = min((page + 1) * self.page_size, end)
+            if lo >= hi:
+                continue
+            # bytes that weren't part of the segment back then count as changed
+            known_lo = max(lo, address)
+            known_hi = min(hi, address + len(old))
+            if known_lo >= known_hi:
+                dirty.set_range(lo - base, hi - base)
+                continue
+            dirty.set_range(lo - base, known_lo - base)
+            dirty.set_range(known_hi - base, hi - base)
+            dirty.mark_changes(known_lo - base, old[known_lo - address:known_hi - address],
+                               source[known_lo - base:known_hi - base])
+        return dirty
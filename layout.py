@@ -0,0 +1,20 @@
+# Line layout shared by the widget, the exporters and scripts. Nothing in here needs Qt.
+
+
+def format_address(address, width=16):
+    """ The address label of a line, as `width` zero padded hex digits """
+    return "{:0{}x}".format(address, width)
+
+
+def address_width(last_address):
+    """ The label width that fits every address up to `last_address`: 8 digits for
+    32 bit addresses, 16 beyond that """
+    return 8 if last_address < 1 << 32 else 16
+
+
+def iter_chunks(source, start, end, size):
+    """ Yields (index, bytes) for [start, end) of a DataSource (or string), at most
+    `size` bytes at a time, so that a range of any length is read in constant memory """
+    end = min(end, len(source))
+    for index in range(start, end, size):
+        yield index, source[index:min(index + size, end)]
@@ -0,0 +1,105 @@
+import collections
+import time
+
+try:
+    clock = time.perf_counter
+except AttributeError: # python 2
+    clock = time.time
+
+# The parts of paintEvent that get timed separately, in the order they happen
+PHASES = ("background", "highlights", "address", "hex", "ascii")
+
+
+class Frame(object):
+    """ Timings for one paintEvent. Each phase is the total time in seconds spent on
+    that part of the frame, and `calls` counts the QPainter calls that were made. """
+
+    def __init__(self):
+        self.started = clock()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.calls = 0
+        self.rows = 0
+        self.total = 0.0
+
+    def finish(self):
+        self.total = clock() - self.started
+        return self
+
+    def as_dict(self):
+        result = dict(self.phases)
+        result["total"] = self.total
+        result["calls"] = self.calls
+        result["rows"] = self.rows
+        return result
+
+
+class FrameStats(object):
+    """ Rolling statistics over the last `window` frames painted by a HexDisplay """
+
+    def __init__(self, window=240):
+        self.frames = collections.deque(maxlen=window)
+        self.count = 0 # frames seen over the lifetime of the widget
+
+    def record(self, frame):
+        self.frames.append(frame)
+        self.count += 1
+
+    def reset(self):
+        self.frames.clear()
+        self.count = 0
+
+    def values(self, key):
+        if key == "total":
+            return [f.total for f in self.frames]
+        if key == "calls":
+            return [f.calls for f in self.frames]
+        return [f.phases[key] for f in self.frames]
+
+    def percentile(self, p, key="total"):
+        """ Nearest-rank percentile (0-100) of a phase, "total", or "calls" over the window """
+        values = sorted(self.values(key))
+        if not values:
+            return 0.0
+        rank = int(round(p / 100.0 * (len(values) - 1)))
+        return values[rank]
+
+    def summary(self):
+        """ p50/p95/p99 and mean of every phase, the frame total, and painter calls """
+        result = {"frames": len(self.frames), "count": self.count}
+        for key in PHASES + ("total", "calls"):
+            values = self.values(key)
+            result[key] = {
+                "p50": self.percentile(50, key),
+                "p95": self.percentile(95, key),
+                "p99": self.percentile(99, key),
+                "mean": sum(values) / float(len(values)) if values else 0.0,
+            }
+        return result
+
+
+class SlowFrameLog(object):
+    """ Passes a message about frames slower than `threshold` seconds to `sink`, but no
+    more than once every `interval` seconds. Frames that were slow in between are
+    counted and mentioned in the next message instead of being logged on their own. """
+
+    def __init__(self, sink, threshold=1 / 60.0, interval=5.0):
+        self.sink = sink
+        self.threshold = threshold
+        self.interval = interval
+        self.last = None
+        self.suppressed = 0
+
+    def __call__(self, frame):
+        if frame.total < self.threshold:
+            return
+        now = clock()
+        if self.last is not None and now - self.last < self.interval:
+            self.suppressed += 1
+            return
+        phases = ", ".join("{}={:.1f}ms".format(p, frame.phases[p] * 1000) for p in PHASES)
+        message = "painting took {:.1f}ms ({}; {} painter calls)".format(frame.total * 1000, phases, frame.calls)
+        if self.suppressed:
+            message += " [{} more slow frames since the last message]".format(self.suppressed)
+        self.sink(message)
+        self.last = now
+        self.suppressed = 0
@@ -0,0 +1,414 @@
+import bisect
+import contextlib
+
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal
+
+from datasource import BufferSource, DataSource, SegmentMap
+from dirty import DirtyMap
+from highlights import HighlightIndex
+from history import SnapshotHistory
+from metrics import clock
+from provider import AsyncProvider, AsyncSource, LoadedView
+from selection import NamedSelection
+
+
+class _Unwritten(DataSource):
+    """ A read-only view of `source` with page deltas (see SnapshotHistory.capture) laid
+    over it, ie: what it held before the writes they were saved from. Nothing is copied
+    or written back, since the source can share segments with the live data. """
+
+    def __init__(self, source, pages, base, page_size):
+        self.shown = source
+        self.source = LoadedView(source) if isinstance(source, AsyncSource) else source
+        self.pages = pages
+        self.numbers = sorted(pages)
+        self.base = base
+        self.page_size = page_size
+
+    def __len__(self):
+        return len(self.source)
+
+    def read(self, start, length):
+        data = self.source.read(start, length)
+        end = start + len(data)
+        first = bisect.bisect_left(self.numbers, (start + self.base) // self.page_size)
+        last = bisect.bisect_right(self.numbers, (end - 1 + self.base) // self.page_size)
+        if first >= last:
+            return data
+        data = bytearray(data)
+        for number in self.numbers[first:last]:
+            address, old = self.pages[number]
+            index = address - self.base
+            lo = max(index, start)
+            hi = min(index + len(old), end)
+            if lo < hi:
+                data[lo - start:hi - start] = old[lo - index:hi - index]
+        return bytes(data)
+
+
+def _intersect(a, b):
+    """ The overlap of two sorted lists of disjoint (start, end) ranges """
+    out = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start < end:
+            out.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return out
+
+
+class HexModel(QObject):
+    """ The memory a HexDisplay shows: the bytes, which of them changed in the last
+    update, the update history, and the highlights. Several displays can show the same
+    model (eg: a stack view and a second view of the same segment), in which case they
+    all read the one DataSource without copying it, every update is diffed once, and
+    the signals below tell each display what to repaint. The displays themselves only
+    keep their scroll position, cursor, selection and rendered rows.
+
+    Indexes are 0-based, and starting_address is the address of index 0 (see
+    indexToAddress for segment maps). """
+    dataReplaced = pyqtSignal() # a different DataSource, or a new layout of it
+    bytesChanged = pyqtSignal(object, object) # the bytes at the indexes [start, end) changed
+    updated = pyqtSignal(object, object) # the dirty bytes or highlights in [start, end) changed
+
+    def __init__(self, data=b"", starting_address=0, parent=None):
+        super(HexModel, self).__init__(parent)
+        self._source = None
+        self._dataVersion = 0
+        self.data = data
+        self.old_data = self.data
+        self.starting_address = starting_address # Stores the memory address to start numbering from
+        self.dirty = DirtyMap() # Stores whether a given byte should be highlighted
+        self.history = SnapshotHistory() # page deltas of the last few updates
+        self.dirtyBaseline = None # what dirty bytes are compared against, see setDirtyBaseline
+        self._lastStep = None
+        self.highlights = HighlightIndex()
+
+        # Updates can be deferred and merged, see batch()
+        self.maxFrameRate = 60
+        self.throttleUpdates = False # defer every update, as if it was made in a batch
+        self._batchDepth = 0
+        self._shown = None # (data, starting_address, pages) last flushed, while anything is pending
+        self._lastFlush = 0.0
+        self._flushTimer = QTimer(self)
+        self._flushTimer.setSingleShot(True)
+        self._flushTimer.timeout.connect(self.flush)
+
+    @property
+    def data(self):
+        return self._source
+
+    @data.setter
+    def data(self, value):
+        """ Accepts either a DataSource or a plain string, which gets wrapped in a BufferSource.
+        An AsyncProvider gets wrapped in an AsyncSource, which fills in as pages arrive. """
+        if isinstance(value, AsyncProvider):
+            value = AsyncSource(value)
+        elif not isinstance(value, DataSource):
+            value = BufferSource(value)
+        old = self._source
+        if isinstance(old, AsyncSource) and old is not value:
+            old.loaded.disconnect(self.refresh)
+        if isinstance(value, AsyncSource) and old is not value:
+            value.loaded.connect(self.refresh)
+        self._source = value
+        self._dataVersion += 1
+        self.dataReplaced.emit()
+
+    @property
+    def pending(self):
+        """ Whether there are deferred updates waiting for the next flush """
+        return self._shown is not None
+
+    def refresh(self, start=0, end=None):
+        """ Call this after changing the contents of the data source behind the model's
+        back (eg: PagedSource.invalidate), so the indexes [start, end) get re-read. """
+        if end is None:
+            end = len(self.data)
+        self.bytesChanged.emit(start, end)
+
+    def repaint(self):
+        """ Repaints everything in every display """
+        self.updated.emit(0, max(len(self.data), 1))
+
+    @contextlib.contextmanager
+    def batch(self):
+        """ Defers every update made inside the block (update_addr, set_new_offset,
+        write_ranges, and highlight edits) until the next frame, eg:
+
+            with hexview.batch():
+                hexview.update_addr(0, memory)
+                hexview.set_new_offset(sp)
+                hexview.highlight_address(pc, 4, name="pc")
+
+        The next flush then makes a single diff against what was last displayed, one
+        history step, and one repaint, however many updates came in. Flushes happen at
+        most maxFrameRate times a second, so states that would never have been seen are
+        never diffed or painted. Batches can be nested; the outermost one schedules the
+        flush. Set throttleUpdates to treat every update as if it was in a batch. """
+        self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            self._batchDepth -= 1
+            if self._batchDepth == 0 and self._shown is not None:
+                self.scheduleFlush()
+
+    def _deferred(self):
+        """ Returns whether an update should be left for the next flush. Updates made
+        while nothing is deferring them flush whatever is pending first. """
+        if self._batchDepth or self.throttleUpdates:
+            if self._shown is None:
+                self._shown = (self.data, self.starting_address, {})
+            if not self._batchDepth:
+                self.scheduleFlush()
+            return True
+        if self._shown is not None:
+            self.flush()
+        return False
+
+    def scheduleFlush(self):
+        """ Flushes the pending updates once a frame's worth of time has passed since
+        the last flush """
+        if self._flushTimer.isActive():
+            return
+        wait = self._lastFlush + 1.0 / self.maxFrameRate - clock()
+        self._flushTimer.start(max(int(wait * 1000), 0))
+
+    def settle(self):
+        """ Flushes the pending updates unless a batch is still open, so a display
+        never paints a state the dirty bytes haven't caught up with """
+        if self._shown is not None and not self._batchDepth:
+            self.flush()
+
+    def flush(self):
+        """ Applies the updates deferred since the last flush, see batch() """
+        self._flushTimer.stop()
+        if self._shown is None:
+            return
+        shown, offset, pages = self._shown
+        self._shown = None
+        self._lastFlush = clock()
+        base = offset if not isinstance(shown, SegmentMap) else 0
+        if self.data is shown and self.starting_address == offset:
+            if pages: # only in-place writes; compare them with the pages they replaced
+                self.dirty = DirtyMap(len(self.data))
+                for address, old in pages.values():
+                    index = address - base
+                    self.dirty.mark_changes(index, old, self.data[index:index + len(old)])
+                self.history.commit(pages)
+                self.applyDirtyBaseline()
+        else:
+            # diff what was displayed against the latest state, with the pages that were
+            # written over since then read from the saved copies
+            if pages:
+                shown = _Unwritten(shown, pages, base, self.history.page_size)
+            self.old_data = shown
+            self._applyOffset(offset, self.starting_address)
+        self.old_data = self.data
+        self.repaint()
+
+    def set_new_offset(self, newoffset):
+        """ Sets a new starting offset. Has to be this complicated to make sure
+        highlighting doesn't get weird """
+        if self._deferred():
+            self.starting_address = newoffset
+            return
+        self._applyOffset(self.starting_address, newoffset)
+        self.repaint()
+
+    def _applyOffset(self, old, newoffset):
+        """ Moves from `old` to `newoffset`, and works out what changed since old_data """
+        if(old != newoffset):
+            # print("Changing starting address from {0} to {1}".format(hex(old), hex(newoffset)))
+            self.starting_address = newoffset
+        # old_data[i + shift] held the byte now at data[i]
+        shift = newoffset - old
+        # only what has arrived can be compared or saved; anything else would be fetched
+        previous = LoadedView(self.old_data) if isinstance(self.old_data, AsyncSource) else self.old_data
+        current = LoadedView(self.data) if isinstance(self.data, AsyncSource) else self.data
+        self.dirty = DirtyMap.diff(previous, current, shift, self._loadedSpans(shift))
+        step = (self._dataVersion, old, newoffset)
+        if step != self._lastStep: # don't record the same update twice
+            self._lastStep = step
+            pages = {}
+            base = self.linearBase()
+            for start, end in self.dirty.chunks():
+                self.history.capture(pages, previous, base + old - newoffset, start + base, end + base)
+            self.history.commit(pages)
+            self.applyDirtyBaseline()
+
+    def _loadedSpans(self, shift):
+        """ The indexes of data that can be compared with old_data without fetching
+        anything, or None if neither is an AsyncSource. Pages that haven't arrived read
+        as zeros, so comparing them would both request them and mark them dirty. """
+        spans = None
+        for source, delta in ((self.data, 0), (self.old_data, shift)):
+            if isinstance(source, _Unwritten):
+                source = source.shown
+            if isinstance(source, AsyncSource):
+                loaded = [(start - delta, end - delta) for start, end in source.available(0, len(source))]
+                spans = loaded if spans is None else _intersect(spans, loaded)
+        return spans
+
+    def checkpoint(self, name):
+        """ Remembers the current state of memory under `name`, to use with setDirtyBaseline """
+        self.history.checkpoint(name)
+
+    def setDirtyBaseline(self, baseline=None):
+        """ Chooses what the dirty (orange) bytes are compared against:
+            None - the state before the last update, which is the default
+            n    - the state n updates ago
+            name - the state when checkpoint(name) was called
+        The comparison uses the page deltas in self.history, whose depth is limited, so
+        baselines that have fallen out of it are clamped to the oldest state it has. """
+        self.dirtyBaseline = baseline
+        if baseline is None and self.history.steps:
+            self.dirty = self.history.dirty_since(self.history.generation - 1, self.data, self.linearBase())
+        self.applyDirtyBaseline()
+        self.repaint()
+
+    def applyDirtyBaseline(self):
+        if self.dirtyBaseline is None:
+            return
+        try:
+            generation = self.history.resolve(self.dirtyBaseline)
+        except (KeyError, ValueError):
+            generation = self.history.oldest
+        self.dirty = self.history.dirty_since(generation, self.data, self.linearBase())
+        self.repaint()
+
+    def highlight_address(self, address, length, color=Qt.darkRed, name="*"):
+        """ Uses named selections, which track absolute addresses instead of indexes.
+        This means this will move if the offset is changed, and that .contains will work
+        properly on addresses instead of indices. """
+        self._deferred()
+        select = NamedSelection(self, name, address, address + length - 1, color)
+        self.highlights.append(select)
+        self._highlightChanged(select)
+
+    def clear_highlight(self, address):
+        """ Deletes all the highlights that contain a given address """
+        self._deferred()
+        for highlight in self.highlights.remove_containing(address):
+            self._highlightChanged(highlight)
+
+    def clear_named_highlight(self, name):
+        """ Deletes all the highlights with the given name """
+        self._deferred()
+        for highlight in self.highlights.remove_named(name):
+            self._highlightChanged(highlight)
+
+    def _highlightChanged(self, highlight):
+        if self._shown is None: # otherwise everything gets repainted by the flush
+            self.updated.emit(highlight.start, highlight.end + 1)
+
+    def write_range(self, address, values):
+        """ Patches `values` into memory at `address` in place. See write_ranges. """
+        self.write_ranges([(address, values)])
+
+    def write_ranges(self, writes):
+        """ Patches a batch of (address, values) writes into memory in place. Only the
+        written bytes are compared against what was there before, so the dirty
+        highlighting afterwards covers exactly what changed in this batch, and only
+        the lines that were (or used to be) dirty are repainted.
+        Each write has to land inside the segment; use update_addr to grow it. """
+        length = len(self.data)
+        indexes = []
+        for address, values in writes:
+            try:
+                index = self.addressToIndex(address)
+                valid = index >= 0 and index + len(values) <= length and \
+                        self.addressToIndex(address + len(values) - 1) == index + len(values) - 1
+            except ValueError: # unmapped, between two segments
+                valid = False
+            if not valid:
+                raise ValueError("Attempted to display data outside the contiguous bounds of this memory segment!")
+            indexes.append(index)
+        if self._deferred():
+            shown, offset, pages = self._shown
+            base = offset if not isinstance(shown, SegmentMap) else 0
+            for index, (address, values) in zip(indexes, writes):
+                if self.data is shown: # keep what was displayed, for the flush to compare with
+                    self.history.capture(pages, shown, base, index + base, index + base + len(values))
+                self.data.write(index, values)
+                self.bytesChanged.emit(index, index + len(values))
+            return
+        previous = self.dirty
+        self.dirty = DirtyMap(length)
+        self.updated.emit(previous.low, previous.high)
+        pages = {}
+        base = self.linearBase()
+        for index, (address, values) in zip(indexes, writes):
+            self.history.capture(pages, self.data, base, index + base, index + base + len(values))
+            self.dirty.mark_changes(index, self.data[index:index + len(values)], values)
+            self.data.write(index, values)
+            self.bytesChanged.emit(index, index + len(values))
+        self.old_data = self.data # the dirty bytes have already been worked out
+        self.history.commit(pages)
+        self.applyDirtyBaseline()
+
+    def update_addr(self, addr, newval):
+        """ Updates the display. Works a lot better if you just pass in the entire
+        new block of memory at address 0x0 rather than try to be precise about it.
+        It strips off anything following the new memory, so updating in the above way
+        is probably in your best interest anyway. If you know which bytes changed,
+        write_range/write_ranges patch them in place without resending everything."""
+        self._deferred()
+        if isinstance(self.data, SegmentMap):
+            self.old_data = self.data
+            self.data = self.data.replace(addr, newval)
+            return
+        length = len(self.data)
+        # print("Writing",len(newval),"bytes at", hex(addr))
+        if (addr > length):
+            raise ValueError("Attempted to display data outside the contiguous bounds of this memory segment!")
+        part_one = self.data[0:(addr - self.starting_address)] + newval
+        #newdata = part_one + self.data[len(part_one):] # Overwrite, don't append
+        self.old_data = self.data
+        self.data = part_one #newdata
+
+    def is_dirty(self, index):
+        """ Figures out if a given index was modified in the last update """
+        return self.dirty[index]
+
+    def addSegment(self, address, data):
+        """ Maps another segment of memory at `address`, turning the data into a SegmentMap
+        if it isn't one yet (the current data becomes a segment at starting_address).
+        Gaps between segments are collapsed, so one view can show a whole process map. """
+        source = self.data
+        if not isinstance(source, SegmentMap):
+            segments = [(self.starting_address, source)] if len(source) else []
+            source = SegmentMap(segments)
+            self.starting_address = 0
+        source.add(address, data)
+        self.data = source
+        self.old_data = source
+        self.dirty = DirtyMap(len(source))
+        self.dataReplaced.emit()
+
+    def indexToAddress(self, index):
+        """ Returns the memory address of a 0-based index """
+        source = self.data
+        if isinstance(source, SegmentMap):
+            return source.index_to_address(index)
+        return index + self.starting_address
+
+    def addressToIndex(self, address, after=None):
+        """ Returns the 0-based index of a memory address. Addresses that aren't mapped
+        raise a ValueError, or with `after` given, are rounded to the next or previous
+        mapped byte (see SegmentMap.address_to_index). """
+        source = self.data
+        if isinstance(source, SegmentMap):
+            return source.address_to_index(address, after)
+        return address - self.starting_address
+
+    def linearBase(self):
+        """ The address that index 0 is numbered from when keeping snapshots. Segment maps
+        aren't linear, so their history is kept by index. """
+        return 0 if isinstance(self.data, SegmentMap) else self.starting_address
@@ -0,0 +1,407 @@
+import array
+import collections
+import math
+import threading
+
+from PyQt5.QtCore import QObject, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPainter, QPalette
+from PyQt5.QtWidgets import QWidget
+
+from datasource import PagedSource
+from provider import AsyncSource, LoadedView
+
+
+def summarize(data):
+    """ Returns the (entropy, share of 0x00 bytes, share of 0xff bytes) of a byte string,
+    each between 0 and 1. Entropy is in bits per byte, divided by 8. """
+    length = len(data)
+    if not length:
+        return 0.0, 0.0, 0.0
+    entropy = 0.0
+    for count in collections.Counter(bytearray(data)).values():
+        p = count / float(length)
+        entropy -= p * math.log(p, 2)
+    return entropy / 8, data.count(b"\0") / float(length), data.count(b"\xff") / float(length)
+
+
+def _mean(values):
+    return sum(values) / len(values)
+
+
+class Pyramid(object):
+    """ A value per block at every resolution. Level 0 has one value per block, and each
+    level above combines pairs from the one below with `combine` (eg: max), down to a
+    single value. Values that haven't been worked out yet are negative and get left
+    out when combining, so a partly computed pyramid still shows what it knows. """
+
+    def __init__(self, count, combine=_mean, initial=-1.0):
+        self.combine = combine
+        self.levels = []
+        while True:
+            self.levels.append(array.array('f', [initial]) * count)
+            if count <= 1:
+                break
+            count = (count + 1) // 2
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def combineUp(self, lo, hi):
+        """ Recomputes the values above the level 0 blocks [lo, hi) """
+        for below, level in zip(self.levels, self.levels[1:]):
+            lo //= 2
+            hi = (hi + 1) // 2
+            for i in range(lo, hi):
+                known = [v for v in below[2 * i:2 * i + 2] if v >= 0]
+                level[i] = self.combine(known) if known else -1.0
+
+    def update(self, first, values):
+        """ Sets the level 0 values from block `first` on, and the levels above them """
+        self.levels[0][first:first + len(values)] = array.array('f', values)
+        self.combineUp(first, first + len(values))
+
+    def rebuild(self):
+        """ Recomputes every level after level 0 has been changed directly """
+        self.combineUp(0, len(self))
+
+    def sample(self, start, end, rows):
+        """ Returns `rows` values covering the level 0 blocks [start, end), read from the
+        coarsest level that still has at least one value per row """
+        span = max(end - start, 1)
+        shift = 0
+        while shift + 1 < len(self.levels) and (span >> (shift + 1)) >= rows:
+            shift += 1
+        level = self.levels[shift]
+        values = []
+        for row in range(rows):
+            lo = (start + span * row // rows) >> shift
+            hi = max((start + span * (row + 1) // rows) >> shift, lo + 1)
+            known = [v for v in level[lo:hi] if v >= 0]
+            values.append(self.combine(known) if known else -1.0)
+        return values
+
+
+class OverviewWorker(QObject):
+    """ Summarizes blocks of a data source on a background thread, taking ranges of
+    blocks from a queue that can be added to at any time. Blocks bigger than
+    `samples` * `sample_size` bytes are summarized from `samples` evenly spaced windows
+    rather than read in full, which keeps a pass over multi-GB data short.
+
+    With `loaded_only`, the source has to have available() (an AsyncSource or
+    PagedSource), and only the parts of each block that are already in memory are
+    summarized, so nothing gets requested or pushed out of the cache. Blocks with none
+    of their pages in memory come out as None. """
+    blocksReady = pyqtSignal(object, object, object) # source, first block, [(entropy, zeros, ffs) or None]
+
+    def __init__(self, block_size, sample_size=4096, samples=4, batch=64, loaded_only=False):
+        super(OverviewWorker, self).__init__()
+        self.block_size = block_size
+        self.sample_size = sample_size
+        self.samples = samples
+        self.batch = batch
+        self.loaded_only = loaded_only
+        self.source = None
+        self._queue = collections.deque()
+        self._wake = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve, name="hexview-overview")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def enqueue(self, source, ranges, replace=False):
+        """ Queues the block ranges [(first, last)] of `source`. With `replace`, whatever
+        was still waiting is dropped first. """
+        with self._wake:
+            if replace:
+                self._queue.clear()
+            self.source = source
+            self._queue.extend(ranges)
+            self._wake.notify()
+
+    def close(self):
+        with self._wake:
+            self._closed = True
+            self._queue.clear()
+            self._wake.notify()
+        self._thread.join()
+
+    def summarizeBlock(self, source, index):
+        start = index * self.block_size
+        end = min(start + self.block_size, len(source))
+        if self.loaded_only:
+            view = LoadedView(source)
+            spans = source.available(start, end)
+            return summarize(b"".join(view[lo:hi] for lo, hi in spans)) if spans else None
+        if end - start <= self.sample_size * self.samples:
+            return summarize(source[start:end])
+        step = (end - start) // self.samples
+        return summarize(b"".join(source[start + i * step:start + i * step + self.sample_size]
+                                  for i in range(self.samples)))
+
+    def _next(self):
+        """ Takes the next batch of blocks off the queue """
+        with self._wake:
+            while not self._queue and not self._closed:
+                self._wake.wait()
+            if self._closed:
+                return None
+            first, last = self._queue.popleft()
+            if last - first > self.batch:
+                self._queue.appendleft((first + self.batch, last))
+                last = first + self.batch
+            return self.source, first, last
+
+    def _serve(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            source, first, last = job
+            last = min(last, (len(source) + self.block_size - 1) // self.block_size)
+            if first < last:
+                self.blocksReady.emit(source, first, [self.summarizeBlock(source, i) for i in range(first, last)])
+
+
+class Overview(QWidget):
+    """ A strip to put next to a HexDisplay that shows the whole segment at once, eg:
+
+        layout.addWidget(display)
+        layout.addWidget(Overview(display))
+
+    Each pixel row stands for a stretch of the segment, and the four columns show its
+    byte entropy, how much of it is 0x00 and 0xff, and how much of it is dirty. The part
+    shown in the display is outlined. Clicking jumps there with goto, and the mouse
+    wheel zooms in and out.
+
+    Entropy and densities are computed per block in a background thread, only for the
+    blocks that changed once the whole segment has been done, and kept in Pyramids
+    so that drawing costs the same at any zoom.
+
+    An AsyncSource or PagedSource is only summarized where its pages are already in
+    memory, as they load or get shown, since reading all of it would mean fetching
+    every page (and pushing the shown ones out of the cache). Set `full_scan` to read
+    them in full anyway. """
+    max_blocks = 16384
+    full_scan = False
+    entropy_color = QColor(80, 140, 255)
+    zeros_color = QColor(160, 160, 160)
+    ffs_color = QColor(230, 230, 110)
+    dirty_color = QColor(255, 153, 51)
+
+    def __init__(self, display, parent=None):
+        super(Overview, self).__init__(parent)
+        self.display = display
+        self.setMinimumWidth(16)
+        self.setMaximumWidth(48)
+        self.setCursor(Qt.PointingHandCursor)
+        self.block_size = 4096
+        self.zoom = None # (first block, last block) shown, or None for all of them
+        self.entropy = self.zeros = self.ffs = self.dirtyDensity = None
+        self.worker = None
+        self._source = None
+        self._dirty = None
+        self._dirtyBlocks = set() # blocks with a nonzero dirty density
+        self._shown = None # blocks of the last frame, when only loaded pages are summarized
+        display.framePainted.connect(self.sync)
+        display.topLineChanged.connect(lambda line: self.update())
+        self.sync()
+
+    def closeEvent(self, event):
+        self.closeWorker()
+        super(Overview, self).closeEvent(event)
+
+    def closeWorker(self):
+        if self.worker is not None:
+            self.worker.close()
+            self.worker = None
+
+    def blockCount(self):
+        return (len(self._source) + self.block_size - 1) // self.block_size
+
+    def loadedOnly(self, source):
+        """ Whether only the pages of `source` that are in memory get summarized """
+        return not self.full_scan and isinstance(source, (AsyncSource, PagedSource))
+
+    def blockRanges(self, spans):
+        """ Turns (start, end) index ranges into merged (first, last) block ranges """
+        ranges = []
+        for start, end in spans:
+            first, last = start // self.block_size, (end - 1) // self.block_size + 1
+            if ranges and ranges[-1][1] >= first:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], last))
+            else:
+                ranges.append((first, last))
+        return ranges
+
+    def sync(self, frame=None):
+        """ Catches up with the display's data and dirty map. Called after every frame the
+        display paints, which is cheap unless something has been replaced. """
+        source = self.display.raw_data
+        dirty = self.display.dirty
+        if source is self._source and dirty is self._dirty:
+            if self.worker is not None and self.worker.loaded_only:
+                self.syncShown()
+            return
+        if self._source is None or len(source) != len(self._source):
+            self._source = source
+            self.rescan()
+        elif dirty is not self._dirty:
+            # only the blocks with dirty bytes can have changed
+            self._source = source
+            self.worker.enqueue(source, self.blockRanges(dirty.chunks()))
+        elif source is not self._source:
+            if self.loadedOnly(source) != self.worker.loaded_only:
+                self._source = source
+                self.rescan()
+            else:
+                self._source = source
+                self.worker.enqueue(source, self.initialRanges(), replace=True)
+        self._dirty = dirty
+        self.updateDirty()
+        self.update()
+
+    def rescan(self):
+        """ Starts summarizing the whole segment over, beginning with what's on screen """
+        self.closeWorker()
+        size = len(self._source)
+        self.block_size = 4096
+        while size > self.block_size * self.max_blocks:
+            self.block_size *= 2
+        count = self.blockCount()
+        self.zoom = None
+        self.entropy = Pyramid(count)
+        self.zeros = Pyramid(count)
+        self.ffs = Pyramid(count)
+        self.dirtyDensity = Pyramid(count, max, 0.0)
+        self._dirtyBlocks = set()
+        self._shown = None
+        self.worker = OverviewWorker(self.block_size, loaded_only=self.loadedOnly(self._source))
+        self.worker.blocksReady.connect(self.addBlocks)
+        self.worker.enqueue(self._source, self.initialRanges())
+
+    def initialRanges(self):
+        """ The block ranges to summarize the whole source with, starting from what's on
+        screen, or only the blocks that have pages in memory """
+        if self.worker.loaded_only:
+            if isinstance(self._source, AsyncSource):
+                self._source.loaded.connect(self.pagesLoaded, Qt.UniqueConnection)
+            return self.blockRanges(self._source.available(0, len(self._source)))
+        count = self.blockCount()
+        here = min(self.display.pos // self.block_size, count)
+        return [(here, count), (0, here)]
+
+    def pagesLoaded(self, start, end):
+        if self.sender() is self._source and self.worker is not None and self.worker.loaded_only:
+            self.worker.enqueue(self._source, self.blockRanges([(start, end)]))
+
+    def syncShown(self):
+        """ Summarizes the blocks on screen whenever they change, since painting them has
+        just put their pages in memory """
+        display = self.display
+        end = min(display.pos + display.visibleLines() * display.bpl, len(self._source))
+        if display.pos >= end:
+            return
+        shown = self.blockRanges([(display.pos, end)])
+        if shown != self._shown:
+            self._shown = shown
+            self.worker.enqueue(self._source, shown)
+
+    def updateDirty(self):
+        """ Recomputes the share of dirty bytes in the blocks that had or have any """
+        pyramid = self.dirtyDensity
+        if pyramid is None:
+            return
+        level = pyramid.levels[0]
+        density = collections.defaultdict(float)
+        for start, count in self._dirty.counts():
+            density[start // self.block_size] += count / float(self.block_size)
+        touched = self._dirtyBlocks | set(density)
+        for block in touched:
+            if block < len(level):
+                level[block] = density.get(block, 0.0)
+        if len(touched) > len(level) // 64:
+            pyramid.rebuild()
+        else:
+            for block in touched:
+                if block < len(level):
+                    pyramid.combineUp(block, block + 1)
+        self._dirtyBlocks = set(density)
+
+    def addBlocks(self, source, first, summaries):
+        if self.sender() is not self.worker or len(source) != len(self._source):
+            return # left over from before the segment was resized
+        # blocks with nothing in memory keep whatever they had
+        for pyramid, column in ((self.entropy, 0), (self.zeros, 1), (self.ffs, 2)):
+            level = pyramid.levels[0]
+            pyramid.update(first, [s[column] if s is not None else level[first + i]
+                                   for i, s in enumerate(summaries)])
+        self.update()
+
+    def visibleBlocks(self):
+        if self.zoom is not None:
+            return self.zoom
+        return 0, len(self.entropy)
+
+    def rowToIndex(self, y):
+        first, last = self.visibleBlocks()
+        block = first + (last - first) * max(min(y, self.height() - 1), 0) / float(self.height())
+        return min(int(block * self.block_size), len(self._source) - 1)
+
+    def indexToRow(self, index):
+        first, last = self.visibleBlocks()
+        return (index / float(self.block_size) - first) * self.height() / max(last - first, 1)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton and self._source is not None and len(self._source):
+            self.display.goto(self.rowToIndex(event.pos().y()))
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton and self._source is not None and len(self._source):
+            self.display.goto(self.rowToIndex(event.pos().y()))
+
+    def wheelEvent(self, event):
+        """ Zooms in or out by a factor of two around the block under the mouse """
+        if self.entropy is None:
+            return
+        first, last = self.visibleBlocks()
+        count = len(self.entropy)
+        steps = event.angleDelta().y() / 120.0
+        span = max(int((last - first) / 2 ** steps), min(8, count))
+        if span >= count:
+            self.zoom = None
+        else:
+            anchor = first + (last - first) * event.pos().y() / float(max(self.height(), 1))
+            start = int(anchor - span * event.pos().y() / float(max(self.height(), 1)))
+            start = max(min(start, count - span), 0)
+            self.zoom = (start, start + span)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        background = self.palette().color(QPalette.Base)
+        painter.fillRect(self.rect(), background)
+        if self.entropy is None or not len(self.entropy) or self.height() <= 0:
+            return
+        first, last = self.visibleBlocks()
+        rows = self.height()
+        columns = ((self.entropy, self.entropy_color), (self.zeros, self.zeros_color),
+                   (self.ffs, self.ffs_color), (self.dirtyDensity, self.dirty_color))
+        image = QImage(len(columns), rows, QImage.Format_RGB32)
+        image.fill(background)
+        for column, (pyramid, color) in enumerate(columns):
+            # 17 shades from the background to the full color
+            shades = [QColor(int(background.red() + (color.red() - background.red()) * i / 16.0),
+                             int(background.green() + (color.green() - background.green()) * i / 16.0),
+                             int(background.blue() + (color.blue() - background.blue()) * i / 16.0)).rgb()
+                      for i in range(17)]
+            minimum = 4 if pyramid is self.dirtyDensity else 0 # a single dirty byte should still show up
+            for row, value in enumerate(pyramid.sample(first, last, rows)):
+                if value > 0:
+                    image.setPixel(column, row, shades[max(int(min(value, 1.0) * 16), minimum)])
+        painter.drawImage(self.rect(), image)
+
+        # outline what the display is showing
+        top = self.indexToRow(self.display.pos)
+        bottom = self.indexToRow(self.display.pos + self.display.visibleLines() * self.display.bpl)
+        painter.setPen(self.palette().color(QPalette.Highlight))
+        painter.drawRect(0, int(top), self.width() - 1, max(int(bottom - top), 1))
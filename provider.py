@@ -0,0 +1,348 @@
+import collections
+import threading
+import time
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from datasource import DataSource
+
+
+class AsyncProvider(QObject):
+    """ Memory that takes a round trip to read, eg: a remote debugger or an emulator.
+    HexDisplay never waits on a provider: it asks for ranges with request() and paints
+    placeholders until pagesLoaded comes back with the bytes. Subclasses implement
+    __len__, request, cancel_prefetch, and read, the blocking version of a request
+    that is only ever called from worker threads (eg: a search).
+
+    `tag` is passed back untouched with the result, so stale answers can be told apart. """
+    pagesLoaded = pyqtSignal(object, object, object) # start, bytes, tag
+    loadFailed = pyqtSignal(object, object, object, object) # start, length, tag, error message
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def request(self, start, length, tag=None, prefetch=False):
+        """ Asks for the bytes at [start, start + length) without waiting for them.
+        Prefetches are only served once there are no other requests waiting. """
+        raise NotImplementedError
+
+    def cancel_prefetch(self):
+        """ Forgets the prefetches that haven't started yet, and returns them as a list
+        of (start, length, tag) """
+        return []
+
+    def read(self, start, length):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ThreadedProvider(AsyncProvider):
+    """ Turns a blocking `reader(start, length)` into an AsyncProvider by calling it on a
+    background thread. Requests for adjacent ranges that are waiting in the queue at the
+    same time are merged into a single read of up to `max_read` bytes. """
+
+    def __init__(self, reader, size, max_read=256 << 10):
+        super(ThreadedProvider, self).__init__()
+        self.reader = reader
+        self.size = size
+        self.max_read = max_read
+        self._urgent = collections.deque()
+        self._prefetch = collections.deque()
+        self._wake = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve, name="hexview-provider")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return self.size
+
+    def request(self, start, length, tag=None, prefetch=False):
+        with self._wake:
+            (self._prefetch if prefetch else self._urgent).append((start, length, tag))
+            self._wake.notify()
+
+    def cancel_prefetch(self):
+        with self._wake:
+            dropped = list(self._prefetch)
+            self._prefetch.clear()
+        return dropped
+
+    def read(self, start, length):
+        return self.reader(start, length)
+
+    def close(self):
+        with self._wake:
+            self._closed = True
+            self._urgent.clear()
+            self._prefetch.clear()
+            self._wake.notify()
+        self._thread.join()
+
+    def _next(self):
+        """ Takes the next request off the queues, merged with any that follow on from it """
+        with self._wake:
+            while not self._urgent and not self._prefetch and not self._closed:
+                self._wake.wait()
+            if self._closed:
+                return None
+            queue = self._urgent if self._urgent else self._prefetch
+            start, length, tag = queue.popleft()
+            while queue and queue[0][0] == start + length and queue[0][2] == tag \
+                    and length + queue[0][1] <= self.max_read:
+                length += queue.popleft()[1]
+            return start, length, tag
+
+    def _serve(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            start, length, tag = job
+            try:
+                data = self.reader(start, length)
+            except Exception as e: # whatever the target threw, the view just shows the pages as unreadable
+                self.loadFailed.emit(start, length, tag, str(e))
+            else:
+                self.pagesLoaded.emit(start, data, tag)
+
+
+class FakeProvider(ThreadedProvider):
+    """ Serves a local byte string as if it were remote, taking `latency` seconds per
+    read plus `per_byte` seconds for every byte read. Handy for seeing how the view
+    behaves against a slow target without having one. """
+
+    def __init__(self, data, latency=0.05, per_byte=0.0, max_read=256 << 10):
+        self.data = data
+        self.latency = latency
+        self.per_byte = per_byte
+        self.reads = 0 # round trips made, to check that requests get merged
+        super(FakeProvider, self).__init__(self._read, len(data), max_read)
+
+    def _read(self, start, length):
+        time.sleep(self.latency + length * self.per_byte)
+        self.reads += 1
+        return bytes(self.data[start:start + length])
+
+
+class AsyncSource(QObject, DataSource):
+    """ DataSource over an AsyncProvider. Reads never block the GUI thread: pages that
+    haven't arrived yet read as zeros and get requested, and `loaded` fires with the
+    indexes [start, end) once they're in, which HexDisplay repaints. Consecutive missing
+    pages are requested together, at most `max_request` pages at a time, and the most
+    recently used `max_pages` pages are kept.
+
+    Reads from any other thread than the one the source was made on wait for the
+    provider instead, so a search sees the real bytes. Writes are kept as patches that
+    are applied on top of whatever the provider returns, until the next invalidate(). """
+    loaded = pyqtSignal(object, object)
+
+    def __init__(self, provider, page_size=4096, max_pages=1024, max_request=16):
+        super(AsyncSource, self).__init__()
+        self.provider = provider
+        self.size = len(provider)
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.max_request = max_request
+        self.pages = collections.OrderedDict()
+        self.pending = {} # page index -> True if it was only prefetched
+        self.failed = set() # pages the provider couldn't read, not asked for again until invalidate()
+        self.patches = {} # page index -> [(offset, bytes)] written locally
+        self.epoch = 0 # bumped by invalidate(), so answers to older requests get ignored
+        self.lastError = None
+        self.lock = threading.RLock()
+        self._owner = threading.current_thread()
+        provider.pagesLoaded.connect(self._pagesLoaded)
+        provider.loadFailed.connect(self._loadFailed)
+
+    def __len__(self):
+        return self.size
+
+    def _pageRange(self, start, end):
+        return range(start // self.page_size, (end - 1) // self.page_size + 1)
+
+    def _patch(self, index, data):
+        patches = self.patches.get(index)
+        if not patches:
+            return data
+        data = bytearray(data)
+        for offset, values in patches:
+            data[offset:offset + len(values)] = values
+        return bytes(data)
+
+    def read(self, start, length, fetch=True):
+        """ See the class docstring. With `fetch` False, pages that haven't arrived read as
+        zeros without being requested, on any thread. """
+        end = min(start + length, self.size)
+        if start >= end:
+            return b""
+        if fetch and threading.current_thread() is not self._owner:
+            return self._readBlocking(start, end)
+        chunks = []
+        missing = []
+        with self.lock:
+            for index in self._pageRange(start, end):
+                page = self.pages.pop(index, None)
+                if page is None:
+                    missing.append(index)
+                    page = b"\0" * min(self.page_size, self.size - index * self.page_size)
+                else:
+                    self.pages[index] = page # most recently used
+                chunks.append(page)
+        if missing and fetch:
+            self.fetch(missing)
+        offset = start - (start // self.page_size) * self.page_size
+        return b"".join(chunks)[offset:offset + (end - start)]
+
+    def _readBlocking(self, start, end):
+        first = (start // self.page_size) * self.page_size
+        last = min(((end - 1) // self.page_size + 1) * self.page_size, self.size)
+        data = self.provider.read(first, last - first)
+        with self.lock:
+            chunks = [self._patch(index, data[index * self.page_size - first:(index + 1) * self.page_size - first])
+                      for index in self._pageRange(start, end)]
+        return b"".join(chunks)[start - first:end - first]
+
+    def unloaded(self, start, end):
+        """ Returns the parts of the indexes [start, end) that haven't arrived yet, as a
+        list of (start, end) ranges """
+        spans = []
+        with self.lock:
+            for index in self._pageRange(start, min(end, self.size)):
+                if index in self.pages:
+                    continue
+                lo = max(index * self.page_size, start)
+                hi = min((index + 1) * self.page_size, end)
+                if spans and spans[-1][1] == lo:
+                    spans[-1] = (spans[-1][0], hi)
+                else:
+                    spans.append((lo, hi))
+        return spans
+
+    def available(self, start, end):
+        """ The opposite of unloaded: the parts of the indexes [start, end) that are in
+        memory, as a list of (start, end) ranges. Looks at the loaded pages rather than
+        every page in the range, so it's cheap on huge sources. """
+        spans = []
+        with self.lock:
+            indexes = sorted(self.pages)
+        for index in indexes:
+            lo = max(index * self.page_size, start)
+            hi = min((index + 1) * self.page_size, end, self.size)
+            if lo >= hi:
+                continue
+            if spans and spans[-1][1] == lo:
+                spans[-1] = (spans[-1][0], hi)
+            else:
+                spans.append((lo, hi))
+        return spans
+
+    def fetch(self, pages, prefetch=False):
+        """ Requests the pages that aren't already loaded or on their way, in runs of
+        consecutive pages. A page that was only prefetched is asked for again if it's
+        needed now, rather than waiting behind the other prefetches. """
+        runs = []
+        with self.lock:
+            for index in pages:
+                if index in self.pages or index in self.failed:
+                    continue
+                if index in self.pending and (prefetch or not self.pending[index]):
+                    continue
+                self.pending[index] = prefetch
+                if runs and runs[-1][1] == index and runs[-1][1] - runs[-1][0] < self.max_request:
+                    runs[-1][1] = index + 1
+                else:
+                    runs.append([index, index + 1])
+        for first, last in runs:
+            start = first * self.page_size
+            self.provider.request(start, min(last * self.page_size, self.size) - start, self.epoch, prefetch)
+
+    def prefetch(self, start, end, backwards=False):
+        """ Replaces the prefetches that are still waiting with the pages covering
+        [start, end), nearest first: from the end if `backwards`, else from the start """
+        with self.lock:
+            for first, length, tag in self.provider.cancel_prefetch():
+                for index in self._pageRange(first, first + length):
+                    if self.pending.get(index):
+                        del self.pending[index]
+        start = max(start, 0)
+        end = min(end, self.size)
+        if start >= end:
+            return
+        pages = list(self._pageRange(start, end))
+        if backwards:
+            # runs still have to be in ascending order to be merged, so only reverse the runs
+            runs = [pages[i:i + self.max_request] for i in range(0, len(pages), self.max_request)]
+            for run in reversed(runs):
+                self.fetch(run, prefetch=True)
+        else:
+            self.fetch(pages, prefetch=True)
+
+    def write(self, start, data):
+        with self.lock:
+            pos = 0
+            while pos < len(data):
+                index = (start + pos) // self.page_size
+                offset = (start + pos) - index * self.page_size
+                count = min(len(data) - pos, self.page_size - offset)
+                values = bytes(data[pos:pos + count])
+                self.patches.setdefault(index, []).append((offset, values))
+                if index in self.pages:
+                    page = bytearray(self.pages[index])
+                    page[offset:offset + count] = values
+                    self.pages[index] = bytes(page)
+                pos += count
+
+    def invalidate(self):
+        """ Forgets every page and local write, eg: after the target has been resumed.
+        Call HexDisplay.refresh afterwards so the visible pages get asked for again. """
+        with self.lock:
+            self.provider.cancel_prefetch()
+            self.epoch += 1
+            self.pages.clear()
+            self.pending.clear()
+            self.failed.clear()
+            self.patches.clear()
+
+    def close(self):
+        self.provider.close()
+
+    def _pagesLoaded(self, start, data, tag):
+        with self.lock:
+            if tag != self.epoch:
+                return
+            first = start // self.page_size
+            for i in range(0, len(data), self.page_size):
+                index = first + i // self.page_size
+                self.pending.pop(index, None)
+                self.pages.pop(index, None)
+                self.pages[index] = self._patch(index, data[i:i + self.page_size])
+            while len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+        self.loaded.emit(start, start + len(data))
+
+    def _loadFailed(self, start, length, tag, error):
+        with self.lock:
+            if tag != self.epoch:
+                return
+            for index in self._pageRange(start, start + length):
+                self.pending.pop(index, None)
+                self.failed.add(index)
+            self.lastError = error
+
+
+class LoadedView(DataSource):
+    """ The bytes of an AsyncSource (or PagedSource) that are already in memory, with
+    everything else reading as zeros. Reading it never requests anything, so it's safe
+    to diff or copy in full. """
+
+    def __init__(self, source):
+        self.source = source
+
+    def __len__(self):
+        return len(self.source)
+
+    def read(self, start, length):
+        return self.source.read(start, length, fetch=False)
@@ -0,0 +1,111 @@
+import collections
+
+from layout import format_address
+
+# Text for every possible byte value, so rendering never has to format anything
+hex_table = ["{:02x}".format(b) for b in range(256)]
+ascii_table = [chr(b) if b >= 33 and b <= 126 else "." for b in range(256)]
+# Maps every byte to its ascii representation in one bytes.translate call
+ascii_translation = bytes(bytearray(b if b >= 33 and b <= 126 else ord(".") for b in range(256)))
+
+
+def to_ascii(data):
+    return bytearray(data).translate(ascii_translation).decode("latin-1")
+
+
+def to_hex(data):
+    return " ".join([hex_table[b] for b in bytearray(data)])
+
+
+class Row(object):
+    """ The rendered text of one line: its bytes, their hex and ascii text, and the
+    address label. Character i of `ascii` and characters [3i, 3i + 2) of `hex` belong
+    to byte i, so the text of any run of bytes can be sliced out. With a display mode
+    (see formats.py) `hex` is the mode's text instead, and element k of `mode.size`
+    bytes has characters [k * mode.cell, (k + 1) * mode.cell - 1). """
+    __slots__ = ("values", "hex", "ascii", "base", "address", "loading", "mode")
+
+    def __init__(self, values, index, base, hex_text=None, mode=None):
+        self.values = values
+        self.hex = to_hex(values) if hex_text is None else hex_text
+        self.ascii = to_ascii(values)
+        self.loading = None
+        self.mode = mode
+        self.label(index, base)
+
+    def mask(self, spans, placeholder="?"):
+        """ Replaces the text of the bytes in `spans`, a list of (start, end) columns,
+        with placeholders, eg: for bytes that haven't been read yet or aren't mapped.
+        Any element with a byte in `spans` is masked as a whole.
+        Rows masked because their bytes are about to arrive shouldn't be cached. """
+        size, cell = (self.mode.size, self.mode.cell) if self.mode is not None else (1, 3)
+        hex_text = list(self.hex)
+        ascii_text = list(self.ascii)
+        for start, end in spans:
+            for element in range(start // size, (end - 1) // size + 1):
+                hex_text[element * cell:(element + 1) * cell - 1] = placeholder * (cell - 1)
+            for col in range(start, end):
+                ascii_text[col] = " "
+        self.hex = "".join(hex_text)
+        self.ascii = "".join(ascii_text)
+        self.loading = (self.loading or []) + spans
+
+    def label(self, index, base):
+        self.base = base
+        self.address = format_address(index + base)
+
+    def size(self):
+        """ Rough number of bytes held on to by this row """
+        return 3 * len(self.values) + len(self.hex) + len(self.ascii) + len(self.address) + 250
+
+
+class RowCache(object):
+    """ Least recently used cache of Rows, keyed by the 0-based index of the first byte
+    on the line and bounded by the memory the rows use. Rows have to be invalidated when
+    their bytes change; a change of starting address only relabels them (see get). """
+
+    def __init__(self, max_bytes=4 << 20):
+        self.max_bytes = max_bytes
+        self.rows = collections.OrderedDict()
+        self.used = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, index, base):
+        """ Returns the cached row starting at `index`, or None. `base` is the current
+        starting address, which the address label is brought up to date with. """
+        row = self.rows.pop(index, None)
+        if row is None:
+            return None
+        self.rows[index] = row # most recently used
+        if row.base != base:
+            row.label(index, base)
+        return row
+
+    def put(self, index, row):
+        old = self.rows.pop(index, None)
+        if old is not None:
+            self.used -= old.size()
+        self.rows[index] = row
+        self.used += row.size()
+        while self.used > self.max_bytes and len(self.rows) > 1:
+            _, evicted = self.rows.popitem(last=False)
+            self.used -= evicted.size()
+
+    def clear(self):
+        self.rows.clear()
+        self.used = 0
+
+    def invalidate(self, start, end, bpl):
+        """ Drops the rows holding any of the indexes [start, end) """
+        first = start - start % bpl
+        if (end - first) // bpl > len(self.rows):
+            # cheaper to look at every cached row than every line in the range
+            for index in [i for i in self.rows if i + bpl > start and i < end]:
+                self.used -= self.rows.pop(index).size()
+            return
+        for index in range(first, end, bpl):
+            row = self.rows.pop(index, None)
+            if row is not None:
+                self.used -= row.size()
@@ -0,0 +1,74 @@
+import re
+
+
+def compile_pattern(pattern, kind="bytes"):
+    """ Turns a search into a compiled bytes regex. `kind` is one of:
+        "bytes" - a literal byte string
+        "hex"   - hex digits, optionally space separated, with ?? matching any byte,
+                  eg: "DE AD ?? EF"
+        "regex" - a bytes regular expression
+    Text given for a "bytes" pattern is encoded as latin-1; regexes have to be bytes, as
+    that's what they're matched against.
+    Returns (regex, longest possible match), where the length is None for regexes. """
+    if kind == "bytes":
+        if isinstance(pattern, type(u"")):
+            try:
+                pattern = pattern.encode("latin-1")
+            except UnicodeEncodeError:
+                raise ValueError("Byte patterns can only have characters up to \\xff: {!r}".format(pattern))
+        if not pattern:
+            raise ValueError("Can't search for an empty byte string")
+        return re.compile(re.escape(pattern), re.DOTALL), len(pattern)
+    if kind == "hex":
+        digits = "".join(pattern.split())
+        if not digits or len(digits) % 2:
+            raise ValueError("Hex patterns need an even number of digits: {}".format(pattern))
+        parts = []
+        for i in range(0, len(digits), 2):
+            pair = digits[i:i + 2]
+            if pair == "??":
+                parts.append(b".")
+            else:
+                try:
+                    parts.append(re.escape(bytes(bytearray([int(pair, 16)]))))
+                except ValueError:
+                    raise ValueError("Not a hex byte or ??: {}".format(pair))
+        return re.compile(b"".join(parts), re.DOTALL), len(digits) // 2
+    if kind == "regex":
+        if isinstance(pattern, type(u"")):
+            raise ValueError("Regex patterns have to be bytes, eg: b{!r}".format(pattern))
+        return re.compile(pattern, re.DOTALL), None
+    raise ValueError("Unknown search kind: {}".format(kind))
+
+
+def scan(source, regex, overlap, chunk_size=1 << 20, limit=None, cancelled=None):
+    """ Looks for a compiled pattern in a data source (or string) one chunk at a time,
+    yielding (matches, bytes scanned, total bytes) after each chunk, where matches is a
+    list of (index, length). Consecutive chunks overlap by `overlap` bytes so that
+    matches spanning a chunk boundary are still found; a regex match longer than that
+    can be cut short at the boundary. Matches are non-overlapping, like re.finditer over
+    the whole buffer. Stops after `limit` matches, or once `cancelled()` is true. """
+    total = len(source)
+    pos = 0
+    resume = 0 # end of the last match, so matches never overlap
+    found = 0
+    while pos < total:
+        if cancelled is not None and cancelled():
+            return
+        end = min(pos + chunk_size, total)
+        window = source[pos:min(end + overlap, total)]
+        matches = []
+        for match in regex.finditer(window, max(resume - pos, 0)):
+            if match.start() + pos >= end:
+                break # belongs to the next chunk
+            if match.end() == match.start():
+                continue # empty regex matches aren't worth highlighting
+            matches.append((pos + match.start(), match.end() - match.start()))
+            resume = pos + match.end()
+        if limit is not None:
+            matches = matches[:limit - found]
+        found += len(matches)
+        yield matches, end, total
+        if limit is not None and found >= limit:
+            return
+        pos = end
@@ -1,7 +1,7 @@
-from PyQt5.QtCore import Qt, QObject
-
-class Selection(QObject):
-    def __init__(self, start=0, end=0, active=True, color=Qt.green):
+class Selection(object):
+    """ An inclusive range of indexes. Nothing in here needs Qt: `color` is whatever the
+    widget paints the background with, eg: a Qt.GlobalColor or QColor. """
+    def __init__(self, start=0, end=0, active=True, color=None):
         self._start = min(start, end)
         self._end = max(start, end)
         self.active = active
@@ -43,18 +43,27 @@ class NamedSelection(Selection):
     and a reference to the parent hexview, which introduces the distinct advantage of being able to
     retrieve the offset of the start of the stack, which means that this selection can work on actual
     memory addresses instead of indices in the 0-index scheme the hex viewer uses."""
-    def __init__(self, parent, name, start_address, end_address, color=Qt.green):
+    def __init__(self, parent, name, start_address, end_address, color=None):
         super(NamedSelection, self).__init__(start_address, end_address, True, color)
         self.parent = parent
         self.name = name
 
     def contains(self, address):
-        return address >= (self._start - self.parent.starting_address) and address <= (self._end - self.parent.starting_address)
+        return address >= self.start and address <= self.end
+
+    @property
+    def start_address(self):
+        return self._start
+
+    @property
+    def end_address(self):
+        return self._end
 
+    # The parent does the address -> index mapping, which takes care of gaps between segments
     @property
     def start(self):
-        return self._start - self.parent.starting_address
+        return self.parent.addressToIndex(self._start, after=True)
 
     @property
     def end(self):
-        return self._end - self.parent.starting_address
+        return self.parent.addressToIndex(self._end, after=False)
@@ -0,0 +1,78 @@
+import os
+import zlib
+
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from analytics import crc32_combine, entropy, histogram
+
+
+@pytest.mark.parametrize("split", [0, 1, 7, 1000, 4095, 4096])
+def test_crc32_combine(split):
+    data = os.urandom(4096)
+    a, b = data[:split], data[split:]
+    crc_a = zlib.crc32(a) & 0xffffffff
+    crc_b = zlib.crc32(b) & 0xffffffff
+    assert crc32_combine(crc_a, crc_b, len(b)) == zlib.crc32(data) & 0xffffffff
+
+
+def test_crc32_combine_of_many_blocks():
+    blocks = [os.urandom(n) for n in (10, 65536, 3, 100000)]
+    crc = 0
+    for block in blocks:
+        crc = crc32_combine(crc, zlib.crc32(block) & 0xffffffff, len(block))
+    assert crc == zlib.crc32(b"".join(blocks)) & 0xffffffff
+
+
+def test_histogram_and_entropy():
+    counts = histogram(bytes(bytearray(range(256))) * 4)
+    assert list(counts) == [4] * 256
+    assert entropy(counts) == pytest.approx(8.0)
+    assert entropy(histogram(bytes(100))) == 0
+
+
+def run_analysis(engine, source, start, end, qapp):
+    from PyQt5.QtCore import QEventLoop
+    results = []
+    engine.finished.connect(results.append)
+    engine.analyze(source, start, end)
+    for _ in range(1000):
+        if results:
+            break
+        engine.pool.waitForDone(10)
+        qapp.processEvents(QEventLoop.AllEvents, 10)
+    engine.finished.disconnect(results.append)
+    assert results
+    return results[0]
+
+
+def test_engine_matches_hashlib_and_zlib(qapp):
+    import hashlib
+    from analytics import AnalyticsEngine
+    from datasource import BufferSource
+    data = os.urandom(10000)
+    engine = AnalyticsEngine(block_size=1024)
+    for start, end in [(0, 10000), (100, 5000), (100, 7000), (100, 3000)]:
+        result = run_analysis(engine, BufferSource(data), start, end, qapp)
+        assert result.sha256 == hashlib.sha256(data[start:end]).hexdigest()
+        assert result.crc32 == zlib.crc32(data[start:end]) & 0xffffffff
+        assert sum(result.histogram) == end - start
+    engine.close()
+
+
+def test_hash_started_before_an_invalidate_isnt_cached(qapp):
+    import hashlib
+    from analytics import AnalyticsEngine, _Job
+    from datasource import BufferSource
+    source = BufferSource(bytearray(4096))
+    engine = AnalyticsEngine(block_size=1024)
+    run_analysis(engine, source, 0, 2048, qapp)
+    job = _Job(source, 0, 4096, engine.generation)
+    source.write(3000, b"changed") # the task below stands for one that read the bytes first...
+    engine.invalidate(3000, 3007) # ...and only saves its snapshots after this
+    engine._hash(job)
+    assert max(engine.hashes[0]) <= 3000
+    result = run_analysis(engine, source, 0, 4096, qapp)
+    assert result.sha256 == hashlib.sha256(source[:]).hexdigest()
+    engine.close()
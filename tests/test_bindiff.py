@@ -0,0 +1,116 @@
+import os
+import random
+
+import pytest
+
+from bindiff import diff_blocks
+
+
+def check_blocks(old, new, blocks):
+    """ The blocks cover both buffers in order, with no gaps, and equal blocks are equal """
+    i = j = 0
+    for block in blocks:
+        assert (block.old_start, block.new_start) == (i, j)
+        assert block.old_start <= block.old_end and block.new_start <= block.new_end
+        if block.kind == "equal":
+            assert old[block.old_start:block.old_end] == new[block.new_start:block.new_end]
+        elif block.kind == "delete":
+            assert block.new_start == block.new_end and block.old_start < block.old_end
+        elif block.kind == "insert":
+            assert block.old_start == block.old_end and block.new_start < block.new_end
+        else:
+            assert block.kind == "replace"
+        i, j = block.old_end, block.new_end
+    assert (i, j) == (len(old), len(new))
+    for a, b in zip(blocks, blocks[1:]):
+        assert not (a.kind == b.kind == "equal")
+
+
+def equal_bytes(blocks):
+    return sum(block.old_end - block.old_start for block in blocks if block.kind == "equal")
+
+
+def test_identical():
+    data = os.urandom(100000)
+    blocks = diff_blocks(data, data)
+    check_blocks(data, data, blocks)
+    assert [block.kind for block in blocks] == ["equal"]
+
+
+def test_unrelated():
+    old, new = os.urandom(100000), os.urandom(90000)
+    blocks = diff_blocks(old, new)
+    check_blocks(old, new, blocks)
+    assert equal_bytes(blocks) == 0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_edits(seed):
+    rng = random.Random(seed)
+    old = os.urandom(200000)
+    new = bytearray(old)
+    for _ in range(10):
+        pos = rng.randrange(len(new))
+        new[pos:pos] = os.urandom(rng.randrange(1, 300))
+        pos = rng.randrange(len(new))
+        del new[pos:pos + rng.randrange(1, 300)]
+    new = bytes(new)
+    blocks = diff_blocks(old, new)
+    check_blocks(old, new, blocks)
+    assert equal_bytes(blocks) > len(old) * 0.9
+
+
+def test_insertion_into_zeros():
+    old = bytes(1 << 18)
+    new = old[:5000] + b"inserted" * 8 + old[5000:]
+    blocks = diff_blocks(old, new)
+    check_blocks(old, new, blocks)
+    # zeros line up just as well either side of the insertion, so only the amount is certain
+    assert equal_bytes(blocks) >= len(old) - 64
+
+
+def test_empty_and_cancelled():
+    check_blocks(b"", b"abc", diff_blocks(b"", b"abc"))
+    check_blocks(b"abc", b"", diff_blocks(b"abc", b""))
+    assert diff_blocks(os.urandom(1000), os.urandom(1000), cancelled=lambda: True) is None
+
+
+def test_aligned_layout_is_fixed():
+    from bindiff import DiffBlock, align_blocks
+    blocks = [DiffBlock("equal", 0, 4, 0, 4), DiffBlock("insert", 4, 4, 4, 12)]
+    old_side, new_side, placed = align_blocks(blocks, b"abcd", b"abcd12345678", bpl=8)
+    assert len(old_side) == len(new_side) == 16
+    assert [index for _, index in placed] == [0, 8]
+    assert new_side[8:16] == b"12345678"
+    for side in (old_side, new_side):
+        with pytest.raises(TypeError):
+            side.add(0x1000, b"x")
+        with pytest.raises(TypeError):
+            side.remove(0)
+        with pytest.raises(TypeError):
+            side.replace(0, b"x")
+
+
+def test_diff_view_marks_replaced_bytes(qapp):
+    import time
+    from PyQt5.QtCore import QEventLoop
+    from __init__ import DiffView
+    old = bytearray(os.urandom(20000))
+    new = bytearray(old)
+    new[5000:5003] = b"\0\1\2" if old[5000:5003] != b"\0\1\2" else b"\3\4\5"
+    new[12000:12000] = b"inserted"
+    view = DiffView(bytes(old), bytes(new))
+    finished = []
+    view.diffFinished.connect(finished.append)
+    for _ in range(1000):
+        if finished:
+            break
+        qapp.processEvents(QEventLoop.AllEvents, 10)
+        time.sleep(0.005)
+    assert finished
+    changed = [index for block, index in view.placed if block.kind == "replace"
+               for index in range(index, index + block.new_end - block.new_start)
+               if view.right.dirty[index]]
+    assert len(changed) == sum(1 for a, b in zip(old[5000:5003], new[5000:5003]) if a != b)
+    assert [view.left.dirty[i] for i in changed] == [True] * len(changed)
+    assert view.left.dirty is not view.right.dirty
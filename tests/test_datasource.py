@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from datasource import BufferSource, MmapSource, PagedSource, SliceSource
+
+
+@pytest.fixture
+def data():
+    return os.urandom(3 * 4096 + 100)
+
+
+@pytest.fixture
+def mapped(tmp_path, data):
+    path = tmp_path / "data.bin"
+    path.write_bytes(data)
+    source = MmapSource(str(path))
+    yield source
+    source.close()
+
+
+def test_buffer_source(data):
+    source = BufferSource(data)
+    assert len(source) == len(data)
+    assert source[10:20] == data[10:20]
+    assert source[5] == bytearray(data)[5]
+    assert source[-1] == bytearray(data)[-1]
+    assert source[len(data) - 5:len(data) + 5] == data[-5:]
+    with pytest.raises(IndexError):
+        source[len(data)]
+
+
+def test_mmap_source_reads_the_file(mapped, data):
+    assert len(mapped) == len(data)
+    assert mapped[:] == data
+    assert mapped[4000:4200] == data[4000:4200]
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+    source = MmapSource(str(path))
+    assert len(source) == 0 and source[:] == b""
+    source.close()
+
+
+def test_paged_source_caches_pages(data):
+    reads = []
+
+    def reader(start, length):
+        reads.append((start, length))
+        return data[start:start + length]
+
+    source = PagedSource(reader, len(data), page_size=1024, max_pages=2)
+    assert source[1000:1100] == data[1000:1100]
+    assert reads == [(0, 1024), (1024, 1024)]
+    assert source[1000:1100] == data[1000:1100]
+    assert len(reads) == 2
+    assert source[5000:5001] == data[5000:5001] # evicts page 0
+    assert source[0:1] == data[0:1]
+    assert len(reads) == 4
+    assert source[len(data) - 10:] == data[-10:]
+
+
+def test_slice_source(data):
+    source = SliceSource(BufferSource(data), 100, 50)
+    assert len(source) == 50
+    assert source[:] == data[100:150]
+    assert source[40:60] == data[140:150]
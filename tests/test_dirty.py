@@ -0,0 +1,85 @@
+import os
+import random
+
+import pytest
+
+from dirty import DirtyMap
+
+
+def reference(old, new, shift):
+    """ What DirtyMap.diff should give, one byte at a time """
+    old = bytearray(old)
+    new = bytearray(new)
+    return [i + shift < 0 or (i + shift < len(old) and old[i + shift] != new[i]) for i in range(len(new))]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_diff_matches_reference(seed):
+    rng = random.Random(seed)
+    old = bytes(bytearray(rng.randrange(3) for _ in range(rng.randrange(20000))))
+    new = bytearray(old[:rng.randrange(len(old) + 1)] + os.urandom(rng.randrange(100)))
+    for _ in range(10):
+        if new:
+            new[rng.randrange(len(new))] ^= 1
+    shift = rng.randint(-20, 20)
+    dirty = DirtyMap.diff(old, bytes(new), shift)
+    assert [dirty[i] for i in range(len(new))] == reference(old, new, shift)
+
+
+def test_diff_spans_only_compares_inside_them():
+    old = bytes(10000)
+    new = os.urandom(10000)
+    dirty = DirtyMap.diff(old, new, 0, [(100, 200), (5000, 5003)])
+    expected = reference(old, new, 0)
+    for i in range(len(new)):
+        assert dirty[i] == (expected[i] and (100 <= i < 200 or 5000 <= i < 5003))
+
+
+def test_diff_same_buffer_is_clean():
+    data = os.urandom(1000)
+    dirty = DirtyMap.diff(data, data)
+    assert not any(dirty[i] for i in range(len(data)))
+    assert dirty.low == len(data) and dirty.high == 0
+
+
+def test_compare_marks_differences_and_bounds():
+    dirty = DirtyMap(1 << 16)
+    old = bytearray(256)
+    new = bytearray(256)
+    for i in (0, 7, 8, 100, 255):
+        new[i] = 1
+    dirty.compare(bytes(old), bytes(new), 4096, 256)
+    assert [i for i in range(1 << 16) if dirty[i]] == [4096, 4103, 4104, 4196, 4351]
+    assert dirty.low <= 4096 and dirty.high >= 4352
+
+
+def test_set_range():
+    dirty = DirtyMap(100)
+    dirty.set_range(3, 77)
+    assert [dirty[i] for i in range(100)] == [3 <= i < 77 for i in range(100)]
+    assert not dirty[-1] and not dirty[100]
+
+
+def test_copy_is_independent():
+    dirty = DirtyMap(100000)
+    dirty.set_range(0, 40000)
+    dirty.set(50000)
+    copy = dirty.copy()
+    copy.set(60000)
+    dirty.set(70000)
+    assert [i for i in (0, 39999, 40000, 50000, 60000, 70000) if copy[i]] == [0, 39999, 50000, 60000]
+    assert (copy.low, copy.high) == (0, 60001)
+    assert not dirty[60000]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_flags_match_indexing(seed):
+    rng = random.Random(seed)
+    dirty = DirtyMap(rng.randint(1, 100000))
+    for _ in range(30):
+        start = rng.randrange(len(dirty))
+        dirty.set_range(start, start + rng.choice([1, 3, 100, 5000, 40000]))
+    for _ in range(50):
+        start = rng.randint(-20, len(dirty) + 20)
+        length = rng.randint(0, 9000)
+        assert dirty.flags(start, length) == [dirty[i] for i in range(start, start + length)]
@@ -0,0 +1,56 @@
+import base64
+import io
+import os
+import re
+
+import pytest
+
+import export as export_module
+from datasource import BufferSource
+from export import export
+
+DATA = b"Hello, world!\x00\x01\xff" + bytes(bytearray(range(20)))
+
+
+def exported(data, start=0, end=None, **kwargs):
+    out = io.BytesIO()
+    assert export(data, out, start, end, **kwargs) == (len(data) if end is None else end) - start
+    return out.getvalue().decode("ascii")
+
+
+def test_hexdump():
+    lines = exported(DATA, fmt="hexdump", bpl=8, address=0x1000).splitlines()
+    assert lines[0] == "00001000  48 65 6c 6c 6f 2c 20 77  Hello,.w"
+    assert lines[1] == "00001008  6f 72 6c 64 21 00 01 ff  orld!..."
+    assert lines[-1] == "00001020  10 11 12 13              ...."
+    assert len(lines) == 5
+
+
+def test_carray():
+    text = exported(DATA, fmt="carray", name="blob")
+    assert text.startswith("unsigned char blob[36] = {\n") and text.endswith("};\n")
+    assert bytes(bytearray(int(x, 16) for x in re.findall(r"0x([0-9a-f]{2})", text))) == DATA
+
+
+def test_base64():
+    data = os.urandom(1000)
+    text = exported(data, fmt="base64")
+    assert all(len(line) <= 76 for line in text.splitlines())
+    assert base64.b64decode(text.replace("\n", "")) == data
+
+
+@pytest.mark.parametrize("fmt", ["hexdump", "carray", "base64"])
+def test_chunking_doesnt_change_the_output(fmt, monkeypatch):
+    data = BufferSource(os.urandom(5000))
+    whole = exported(data, 100, 4900, fmt=fmt, bpl=16)
+    monkeypatch.setattr(export_module, "CHUNK", 256)
+    assert exported(data, 100, 4900, fmt=fmt, bpl=16) == whole
+
+
+def test_range_and_bad_arguments():
+    lines = exported(DATA, 8, 16, bpl=8).splitlines()
+    assert lines == ["00000008  6f 72 6c 64 21 00 01 ff  orld!..."]
+    with pytest.raises(ValueError):
+        export(DATA, io.BytesIO(), fmt="srec")
+    with pytest.raises(ValueError):
+        export(DATA, io.BytesIO(), bpl=0)
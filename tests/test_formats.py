@@ -0,0 +1,67 @@
+import struct
+
+import pytest
+
+from formats import MODES, DisplayMode
+
+
+def test_hex():
+    assert MODES["hex"].render(bytes(bytearray(range(6))), 4) == ["00 01 02 03", "04 05"]
+
+
+def test_integers_read_most_significant_digit_first():
+    data = bytes(bytearray(range(1, 9)))
+    assert MODES["u16le"].render(data, 8) == ["0201 0403 0605 0807"]
+    assert MODES["u16be"].render(data, 8) == ["0102 0304 0506 0708"]
+    assert MODES["u32le"].render(data, 4) == ["04030201", "08070605"]
+    assert MODES["u64be"].render(data, 8) == ["0102030405060708"]
+    assert MODES["ptr"] is MODES["u64le"]
+
+
+def test_partial_element_at_the_end():
+    assert MODES["u32le"].render(b"\1\0\0\0\xaa\xbb", 8) == ["00000001 aabb    "]
+
+
+def test_floats():
+    data = struct.pack("<2f", 1.5, -2.0) + struct.pack(">d", 1e300)
+    lines = MODES["f32le"].render(data[:8], 8)
+    assert lines == ["{:>13.6g} {:>13.6g}".format(1.5, -2.0)]
+    assert MODES["f64be"].render(data[8:], 8) == ["{:>22.15g}".format(1e300)]
+    assert MODES["f32le"].cell == 14
+
+
+def test_every_mode_keeps_its_cells_aligned():
+    data = bytes(bytearray(range(256))) * 2
+    for mode in MODES.values():
+        bpl = 4 * mode.size
+        for line in mode.render(data, bpl):
+            assert len(line) == (bpl // mode.size) * mode.cell - 1
+
+
+def test_display_rounds_bytes_per_line_to_whole_elements(qapp):
+    from __init__ import HexDisplay
+    display = HexDisplay()
+    display.data = bytes(4096)
+    display.setBytesPerLine(20)
+    display.setDisplayMode("u64le")
+    assert display.bpl == 16
+    display.setBytesPerLine(4)
+    assert display.bpl == 8
+    display.setDisplayMode(DisplayMode("hex"))
+    display.setBytesPerLine(20)
+    assert display.bpl == 20
+    with pytest.raises(KeyError):
+        display.setDisplayMode("u128le")
+
+
+def test_changing_bytes_per_line_keeps_the_top_line(qapp):
+    from __init__ import HexDisplay
+    display = HexDisplay()
+    display.data = bytes(1 << 20)
+    display.resize(600, 300)
+    display.setBytesPerLine(16)
+    display.setTopLine(100)
+    display.setDisplayMode("u32le")
+    display.setBytesPerLine(24)
+    assert display.bpl == 24
+    assert display.topLine == 1600 // 24
@@ -0,0 +1,25 @@
+import sys
+
+import pytest
+
+import hexdump
+
+
+@pytest.mark.parametrize("bpl", ["0", "-16", "zero"])
+def test_bad_bpl_is_rejected(bpl, tmp_path, monkeypatch, capsys):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"\0" * 64)
+    monkeypatch.setattr(sys, "argv", ["hexdump.py", str(path), "--bpl", bpl])
+    with pytest.raises(SystemExit) as exit:
+        hexdump.main()
+    assert exit.value.code == 2
+    assert "--bpl" in capsys.readouterr().err
+
+
+def test_export_to_file(tmp_path, monkeypatch):
+    path = tmp_path / "data.bin"
+    path.write_bytes(bytes(bytearray(range(32))))
+    out = tmp_path / "out.txt"
+    monkeypatch.setattr(sys, "argv", ["hexdump.py", str(path), "--bpl", "0x10", "--start", "16", "-o", str(out)])
+    hexdump.main()
+    assert out.read_text() == "00000010  10 11 12 13 14 15 16 17 18 19 1a 1b 1c 1d 1e 1f  ................\n"
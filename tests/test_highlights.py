@@ -0,0 +1,42 @@
+import random
+
+from highlights import HighlightIndex
+
+
+class Highlight(object):
+    def __init__(self, start, end, name):
+        self.start_address = start
+        self.end_address = end
+        self.name = name
+
+
+def test_matches_brute_force():
+    rng = random.Random(1)
+    index = HighlightIndex()
+    added = []
+    for _ in range(500):
+        start = rng.randrange(10000)
+        highlight = Highlight(start, start + rng.choice([0, 3, 50, 5000]), rng.choice("ab"))
+        index.append(highlight)
+        added.append(highlight)
+        if rng.random() < 0.05:
+            address = rng.randrange(10000)
+            removed = index.remove_containing(address)
+            assert removed == [h for h in added if h.start_address <= address <= h.end_address]
+            added = [h for h in added if h not in removed]
+        lo = rng.randrange(11000)
+        hi = lo + rng.randrange(100)
+        assert index.overlapping(lo, hi) == [h for h in added if h.start_address <= hi and h.end_address >= lo]
+    assert list(index) == added
+    index.remove_named("a")
+    assert list(index) == [h for h in added if h.name != "a"]
+
+
+def test_one_wide_highlight_is_still_found():
+    index = HighlightIndex()
+    for i in range(1000):
+        index.append(Highlight(i * 16, i * 16 + 3, "x"))
+    wide = Highlight(0, 1 << 40, "wide")
+    index.append(wide)
+    assert index.overlapping(1 << 39, 1 << 39) == [wide]
+    assert index.overlapping(32, 32)[-1] is wide
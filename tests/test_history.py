@@ -0,0 +1,77 @@
+import pytest
+
+from history import SnapshotHistory
+
+
+def step(history, data, base, start, new):
+    """ Writes `new` at address `start` of `data` (at address `base`), saving the old
+    pages into the history first """
+    pages = {}
+    history.capture(pages, bytes(data), base, start, start + len(new))
+    data[start - base:start - base + len(new)] = new
+    history.commit(pages)
+
+
+def dirty_indexes(dirty):
+    return [i for i in range(len(dirty)) if dirty[i]]
+
+
+def test_capture_saves_each_page_once():
+    history = SnapshotHistory(page_size=16)
+    pages = {}
+    data = bytes(range(40))
+    history.capture(pages, data, 0x1008, 0x1008, 0x1012)
+    assert pages == {0x100: (0x1008, data[0:8]), 0x101: (0x1010, data[8:24])}
+    history.capture(pages, b"\xff" * 40, 0x1008, 0x1010, 0x1011)
+    assert pages[0x101] == (0x1010, data[8:24])
+
+
+def test_dirty_since():
+    history = SnapshotHistory(page_size=16)
+    data = bytearray(64)
+    step(history, data, 0x100, 0x104, b"\1\2")
+    step(history, data, 0x100, 0x130, b"\3")
+    step(history, data, 0x100, 0x104, b"\0") # back to what it was at first
+    assert history.generation == 3
+    assert dirty_indexes(history.dirty_since(3, bytes(data), 0x100)) == []
+    assert dirty_indexes(history.dirty_since(2, bytes(data), 0x100)) == [4]
+    assert dirty_indexes(history.dirty_since(1, bytes(data), 0x100)) == [4, 0x30]
+    assert dirty_indexes(history.dirty_since(0, bytes(data), 0x100)) == [5, 0x30]
+
+
+def test_bytes_that_werent_there_count_as_changed():
+    history = SnapshotHistory(page_size=16)
+    pages = {}
+    history.capture(pages, b"\0" * 8, 0x108, 0x108, 0x110)
+    history.commit(pages)
+    # the segment now starts 8 bytes lower and is one page long
+    assert dirty_indexes(history.dirty_since(0, b"\0" * 16, 0x100)) == list(range(8))
+
+
+def test_resolve_and_checkpoints():
+    history = SnapshotHistory(depth=3, page_size=16)
+    data = bytearray(16)
+    history.checkpoint("start")
+    step(history, data, 0, 0, b"\1")
+    history.checkpoint("one")
+    assert history.resolve(1) == 0
+    assert history.resolve("start") == 0
+    assert history.resolve("one") == 1
+    with pytest.raises(KeyError):
+        history.resolve("nope")
+    for value in (2, 3, 4):
+        step(history, data, 0, 0, bytes(bytearray([value])))
+    # only the last 3 steps are kept, and checkpoints older than that are forgotten
+    assert history.oldest == 1
+    assert "start" not in history.checkpoints and history.resolve("one") == 1
+    with pytest.raises(ValueError):
+        history.resolve(4)
+
+
+def test_bounded_by_memory():
+    history = SnapshotHistory(max_bytes=40, page_size=16)
+    data = bytearray(64)
+    for address in (0, 16, 32):
+        step(history, data, 0, address, b"\1")
+    assert history.used == 32
+    assert history.oldest == 1
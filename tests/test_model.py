@@ -0,0 +1,146 @@
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from datasource import BufferSource, DataSource
+from model import HexModel
+
+
+class ReadOnly(DataSource):
+    """ A BufferSource that fails the test if anything but write_range writes to it """
+
+    def __init__(self, data):
+        self.buffer = BufferSource(bytearray(data))
+        self.allowed = False
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def read(self, start, length):
+        return self.buffer.read(start, length)
+
+    def write(self, start, data):
+        assert self.allowed, "the model wrote to a source behind the caller's back"
+        self.buffer.write(start, data)
+
+
+def dirty_indexes(model):
+    return [i for i in range(len(model.data)) if model.dirty[i]]
+
+
+def test_batch_makes_one_step(qapp):
+    model = HexModel(b"\0" * 64)
+    generation = model.history.generation
+    with model.batch():
+        model.update_addr(0, b"\1" * 64)
+        model.update_addr(0, b"\0" * 8 + b"\2" * 56)
+        assert model.pending
+    model.flush()
+    assert not model.pending
+    assert model.history.generation == generation + 1
+    assert dirty_indexes(model) == list(range(8, 64))
+
+
+def test_throttled_updates_wait_for_the_flush(qapp):
+    model = HexModel(b"\0" * 16)
+    model.throttleUpdates = True
+    model.update_addr(0, b"\1" * 16)
+    assert model.pending and not dirty_indexes(model)
+    model.settle()
+    assert not model.pending
+    assert dirty_indexes(model) == list(range(16))
+
+
+def test_writes_and_offset_change_in_a_batch(qapp):
+    source = ReadOnly(b"A" * 8192)
+    model = HexModel(source, 0x1000)
+    source.allowed = True
+    with model.batch():
+        model.write_range(0x1010, b"XYZ")
+        source.allowed = False
+        model.set_new_offset(0x1008)
+    model.flush()
+    assert model.data[0x10:0x13] == b"XYZ"
+    assert model.old_data is model.data # nothing was copied
+    # data[i] is compared with what was shown at index i + 8, before the write
+    assert dirty_indexes(model) == [16, 17, 18]
+
+
+def test_writes_survive_an_update_to_another_segment(qapp):
+    model = HexModel()
+    model.addSegment(0x1000, b"A" * 256)
+    model.addSegment(0x100000, b"B" * 256)
+    with model.batch():
+        model.write_range(0x1010, b"XYZ")
+        model.update_addr(0x100000, b"C" * 256)
+    model.flush()
+    index = model.addressToIndex(0x1010)
+    assert model.data[index:index + 3] == b"XYZ"
+    assert model.data[model.addressToIndex(0x100000)] == ord("C")
+    assert [i for i in dirty_indexes(model) if i < model.addressToIndex(0x100000)] == [index, index + 1, index + 2]
+
+
+def test_writes_outside_the_segment_are_refused(qapp):
+    model = HexModel(b"\0" * 16, 0x1000)
+    with pytest.raises(ValueError):
+        model.write_range(0x100f, b"ab")
+    with pytest.raises(ValueError):
+        model.write_range(0xfff, b"a")
+
+
+def shared_displays(model):
+    from __init__ import HexDisplay
+    displays = [HexDisplay(model=model), HexDisplay(model=model)]
+    for display in displays:
+        display.resize(600, 300)
+    return displays
+
+
+def test_displays_share_one_model(qapp):
+    model = HexModel(b"\0" * 4096, 0x1000)
+    a, b = shared_displays(model)
+    b.setDisplayMode("u32be")
+    assert a.data is b.data is model.data
+    a.rowCache.put(0, a.row(0))
+    b.rowCache.put(0, b.row(0))
+    changed = []
+    model.bytesChanged.connect(lambda start, end: changed.append((start, end)))
+    a.write_range(0x1000, b"\x11\x22\x33\x44")
+    # one write, diffed once, and the cached rows of both displays are dropped
+    assert changed == [(0, 4)]
+    assert a.dirty is b.dirty and b.is_dirty(3) and not b.is_dirty(4)
+    assert a.row(0).hex.startswith("11 22 33 44")
+    assert b.row(0).hex.startswith("11223344")
+    # the scroll position is each display's own
+    a.setTopLine(10)
+    assert b.topLine == 0
+
+
+def test_replacing_the_data_reaches_every_display(qapp):
+    model = HexModel(b"\0" * 4096)
+    a, b = shared_displays(model)
+    replaced = []
+    model.dataReplaced.connect(lambda: replaced.append(True))
+    b.data = b"\1" * 16
+    assert replaced == [True]
+    assert model.data is a.data and len(a.data) == 16
+    assert a.row(0).hex.startswith("01 01")
+
+
+def test_dirty_baseline(qapp):
+    model = HexModel(b"\0" * 64)
+    model.checkpoint("start")
+    model.write_range(0, b"\1")
+    model.write_range(8, b"\1")
+    assert dirty_indexes(model) == [8]
+    model.setDirtyBaseline("start")
+    assert dirty_indexes(model) == [0, 8]
+    model.write_range(16, b"\1")
+    assert dirty_indexes(model) == [0, 8, 16]
+    model.setDirtyBaseline(1)
+    assert dirty_indexes(model) == [16]
+    model.setDirtyBaseline()
+    assert dirty_indexes(model) == [16]
+    # a checkpoint the history doesn't have compares against the oldest state it does
+    model.setDirtyBaseline("nope")
+    assert dirty_indexes(model) == [0, 8, 16]
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+from overview import Overview, OverviewWorker, Pyramid, summarize
+
+
+def known(overview):
+    return [i for i, v in enumerate(overview.entropy.levels[0]) if v >= 0]
+
+
+def settle(qapp, done, timeout=5.0):
+    """ Processes events until `done()` is true or `timeout` runs out """
+    deadline = time.time() + timeout
+    while not done() and time.time() < deadline:
+        qapp.processEvents()
+        time.sleep(0.005)
+    qapp.processEvents()
+    return done()
+
+
+def test_summarize():
+    assert summarize(b"") == (0.0, 0.0, 0.0)
+    assert summarize(bytes(16)) == (0.0, 1.0, 0.0)
+    entropy, zeros, ffs = summarize(bytes(bytearray(range(256))))
+    assert entropy == pytest.approx(1.0)
+    assert zeros == ffs == pytest.approx(1 / 256.0)
+
+
+def test_pyramid_leaves_out_unknown_blocks():
+    pyramid = Pyramid(5, max)
+    pyramid.update(1, [0.5, 0.25])
+    assert list(pyramid.levels[1]) == [0.5, 0.25, -1.0]
+    assert list(pyramid.levels[-1]) == [0.5]
+    assert pyramid.sample(0, 5, 1) == [0.5]
+    assert pyramid.sample(3, 5, 2) == [-1.0, -1.0]
+
+
+def test_worker_loaded_only_reads_nothing_new(qapp):
+    from datasource import PagedSource
+    reads = []
+    source = PagedSource(lambda start, length: (reads.append(start), b"\xff" * length)[1], 1 << 16)
+    source.page(3)
+    worker = OverviewWorker(4096, loaded_only=True)
+    try:
+        assert worker.summarizeBlock(source, 3) == (0.0, 0.0, 1.0)
+        assert worker.summarizeBlock(source, 4) is None
+    finally:
+        worker.close()
+    assert reads == [3 * 4096]
+
+
+def make_display(qapp, **kwargs):
+    from __init__ import HexDisplay
+    display = HexDisplay(**kwargs)
+    display.resize(600, 200)
+    display.show()
+    return display
+
+
+def test_paged_source_is_only_summarized_where_shown(qapp):
+    from datasource import PagedSource
+    reads = []
+    def reader(start, length):
+        reads.append(start)
+        return bytes(length)
+    source = PagedSource(reader, 1 << 24, max_pages=16)
+    display = make_display(qapp, source=source)
+    overview = Overview(display)
+    try:
+        assert settle(qapp, lambda: known(overview))
+        assert known(overview) == [0]
+        assert reads == [0]
+        display.goto(1 << 20)
+        assert settle(qapp, lambda: 256 in known(overview))
+        # only the pages painted around 1 MB were read, and only their blocks are known
+        assert all(abs(start - (1 << 20)) < 8192 for start in reads[1:])
+        assert [block for block in known(overview) if abs(block - 256) > 1] == [0]
+    finally:
+        overview.closeWorker()
+
+
+def test_full_scan_is_opt_in(qapp):
+    from datasource import PagedSource
+    reads = []
+    def reader(start, length):
+        reads.append(start)
+        return bytes(length)
+    source = PagedSource(reader, 1 << 16)
+    display = make_display(qapp, source=source)
+    overview = Overview(display)
+    overview.full_scan = True
+    try:
+        overview.rescan()
+        assert settle(qapp, lambda: len(known(overview)) == 16)
+        assert sorted(set(reads)) == list(range(0, 1 << 16, 4096))
+    finally:
+        overview.closeWorker()
+
+
+def test_async_source_blocks_fill_in_as_pages_load(qapp):
+    from provider import AsyncSource, FakeProvider
+    provider = FakeProvider(b"\xff" * (1 << 20), latency=0.001)
+    source = AsyncSource(provider)
+    display = make_display(qapp, source=source)
+    overview = Overview(display)
+    try:
+        assert settle(qapp, lambda: known(overview))
+        assert known(overview) == [0]
+        assert overview.ffs.levels[0][0] == pytest.approx(1.0)
+        reads = provider.reads
+        source.read(100 * 4096, 4096)
+        assert settle(qapp, lambda: 100 in known(overview))
+        assert known(overview) == [0, 100]
+        assert provider.reads == reads + 1
+    finally:
+        overview.closeWorker()
+        provider.close()
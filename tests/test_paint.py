@@ -0,0 +1,120 @@
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from dirty import DirtyMap
+
+
+class Sel(object):
+    def __init__(self, start, end, color, active=True):
+        self.start = start
+        self.end = end
+        self.color = color
+        self.active = active
+
+
+@pytest.fixture
+def display(qapp):
+    from __init__ import HexDisplay
+    display = HexDisplay()
+    display.data = bytes(bytearray(range(256))) * 256
+    display.old_data = display.data
+    display.resize(900, 400)
+    return display
+
+
+def render(display):
+    from PyQt5.QtGui import QImage
+    frames = []
+    display.framePainted.connect(frames.append)
+    image = QImage(display.viewport().size(), QImage.Format_ARGB32)
+    display.viewport().render(image)
+    display.framePainted.disconnect(frames.append)
+    return image, frames[-1]
+
+
+def test_row_styles_are_runs(display):
+    display.dirty = DirtyMap(len(display.data))
+    display.dirty.set_range(36, 40)
+    # selection ends are inclusive, and earlier selections win where they overlap
+    selections = [Sel(40, 43, "red"), Sel(42, 50, "blue"), Sel(0, 100, "green", active=False)]
+    runs = display.rowStyles(32, 32, selections, loading=[(28, 32)])
+    assert runs == [(0, 4, None, False, False), (4, 8, None, True, False), (8, 12, "red", False, False),
+                    (12, 19, "blue", False, False), (19, 28, None, False, False), (28, 32, None, False, True)]
+
+
+def test_row_styles_of_elements(display):
+    display.dirty = DirtyMap(len(display.data))
+    display.dirty.set(5)
+    runs = display.rowStyles(0, 16, [Sel(2, 3, "red")], size=4)
+    # elements take their first byte's background, and are dirty if any byte is
+    assert runs == [(0, 1, None, False, False), (1, 2, None, True, False), (2, 4, None, False, False)]
+
+
+def test_a_clean_line_takes_a_few_calls(display):
+    image, frame = render(display)
+    assert frame.rows >= 10
+    # per line: background, address, and one run each for hex and ascii
+    assert frame.calls <= 6 * frame.rows + 3
+
+
+def test_glyph_sheets_are_cached_per_color(display):
+    from PyQt5.QtCore import Qt
+    atlas = display.glyphs
+    sheet = atlas.sheet(Qt.black)
+    assert atlas.sheet(Qt.black) is sheet
+    assert atlas.sheet(Qt.red) is not sheet
+    dpr = sheet.devicePixelRatio()
+    assert (sheet.width(), sheet.height()) == (int(512 * display.charWidth * dpr), int(2 * display.charHeight * dpr))
+    atlas.invalidate()
+    assert atlas.sheet(Qt.black) is not sheet
+
+
+def test_painting_from_the_atlas(display):
+    from PyQt5.QtGui import QPalette
+    display.useGlyphCache = False
+    plain, plain_frame = render(display)
+    display.useGlyphCache = True
+    blitted, frame = render(display)
+    assert display.glyphs.sheets and display.glyphs.fragments
+    # the same lines in the same number of calls, with the text where the font puts it
+    assert (frame.rows, frame.calls) == (plain_frame.rows, plain_frame.calls)
+    background = display.palette().color(QPalette.Base).rgb()
+    def inked(image):
+        """ Pixels of the first hex cell of line 1 (which has the plain background) that aren't background """
+        left = display.data_start * display.charWidth
+        top = display.charHeight + display.magic_font_offset
+        return sum(1 for x in range(left, left + 2 * display.charWidth)
+                   for y in range(top, top + display.charHeight) if image.pixel(x, y) != background)
+    assert inked(blitted) and inked(plain)
+
+
+def test_changes_repaint_only_their_lines(display):
+    updates = []
+    viewport = display.viewport()
+    viewport.update = lambda *args: updates.append(args)
+    try:
+        display.invalidateRange(3 * display.bpl + 1, 3 * display.bpl + 2)
+        (rect,), = updates
+        assert rect.top() == 3 * display.charHeight + display.magic_font_offset
+        assert rect.height() == display.charHeight and rect.width() == viewport.width()
+        del updates[:]
+        display.invalidateRange(display.bpl - 1, 2 * display.bpl + 1) # lines 0 to 2
+        assert updates[0][0].height() == 3 * display.charHeight
+        del updates[:]
+        display.invalidateRange(len(display.data) - 4, len(display.data)) # off screen
+        display.invalidateRange(10, 10)
+        assert updates == []
+    finally:
+        del viewport.update
+
+
+def test_only_damaged_lines_are_painted(display):
+    from PyQt5.QtCore import QPoint, QRect
+    from PyQt5.QtGui import QImage, QRegion
+    frames = []
+    display.framePainted.connect(frames.append)
+    image = QImage(display.viewport().size(), QImage.Format_ARGB32)
+    top = 4 * display.charHeight + display.magic_font_offset
+    display.viewport().render(image, QPoint(), QRegion(QRect(0, top, 100, 2 * display.charHeight)))
+    assert frames[-1].rows == 2
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def data():
+    return os.urandom(64 * 4096)
+
+
+@pytest.fixture
+def provider(qapp, data):
+    from provider import FakeProvider
+    provider = FakeProvider(data, latency=0.001)
+    yield provider
+    provider.close()
+
+
+def settle(qapp, done, timeout=5.0):
+    deadline = time.time() + timeout
+    while not done() and time.time() < deadline:
+        qapp.processEvents()
+        time.sleep(0.002)
+    return done()
+
+
+def test_reads_dont_wait_and_fill_in(qapp, provider, data):
+    from provider import AsyncSource
+    source = AsyncSource(provider)
+    loaded = []
+    source.loaded.connect(lambda start, end: loaded.append((start, end)))
+    assert source.read(100, 3 * 4096) == bytes(3 * 4096)
+    assert source.unloaded(0, 5 * 4096) == [(0, 5 * 4096)]
+    assert settle(qapp, lambda: loaded)
+    # the four pages were asked for in one request
+    assert loaded == [(0, 4 * 4096)] and provider.reads == 1
+    assert source.read(100, 3 * 4096) == data[100:100 + 3 * 4096]
+    assert source.available(0, 5 * 4096) == [(0, 4 * 4096)]
+    assert source.unloaded(0, 5 * 4096) == [(4 * 4096, 5 * 4096)]
+
+
+def test_loaded_view_never_requests(qapp, provider, data):
+    from provider import AsyncSource, LoadedView
+    source = AsyncSource(provider)
+    view = LoadedView(source)
+    assert view[0:16] == bytes(16)
+    assert not settle(qapp, lambda: provider.reads, timeout=0.05)
+    source.read(0, 1)
+    assert settle(qapp, lambda: source.available(0, 4096))
+    assert view[0:8192] == data[0:4096] + bytes(4096)
+
+
+def test_other_threads_wait_for_the_provider(qapp, provider, data):
+    from provider import AsyncSource
+    source = AsyncSource(provider)
+    source.write(10, b"xyz")
+    result = []
+    thread = threading.Thread(target=lambda: result.append(source.read(0, 8192)))
+    thread.start()
+    thread.join()
+    assert result == [data[:10] + b"xyz" + data[13:8192]]
+
+
+def test_writes_are_kept_over_loaded_pages(qapp, provider, data):
+    from provider import AsyncSource
+    source = AsyncSource(provider)
+    source.write(4094, b"abcd") # across two pages, before either has arrived
+    source.read(0, 8192)
+    assert settle(qapp, lambda: not source.unloaded(0, 8192))
+    assert source.read(4090, 10) == data[4090:4094] + b"abcd" + data[4098:4100]
+    source.invalidate()
+    assert source.read(4094, 4) == bytes(4)
+    assert settle(qapp, lambda: not source.unloaded(0, 8192))
+    assert source.read(4094, 4) == data[4094:4098]
+
+
+def test_answers_from_before_invalidate_are_ignored(qapp, provider):
+    from provider import AsyncSource
+    source = AsyncSource(provider)
+    source._pagesLoaded(0, b"\xff" * 4096, source.epoch - 1)
+    assert source.available(0, 4096) == []
+
+
+def test_failed_reads(qapp):
+    from provider import AsyncSource, ThreadedProvider
+    def reader(start, length):
+        raise IOError("unmapped")
+    provider = ThreadedProvider(reader, 1 << 16)
+    try:
+        source = AsyncSource(provider)
+        source.read(0, 16)
+        assert settle(qapp, lambda: source.lastError)
+        assert source.lastError == "unmapped" and 0 in source.failed
+        # failed pages aren't asked for again until the next invalidate
+        source.read(0, 16)
+        assert not source.pending
+    finally:
+        provider.close()
+
+
+def test_prefetch_is_merged_and_replaced(qapp, provider, data):
+    from provider import AsyncSource
+    source = AsyncSource(provider, max_request=4)
+    source.prefetch(0, 8 * 4096)
+    source.prefetch(16 * 4096, 20 * 4096, backwards=True)
+    assert settle(qapp, lambda: not source.unloaded(16 * 4096, 20 * 4096))
+    assert source.read(16 * 4096, 4096) == data[16 * 4096:17 * 4096]
+    assert provider.reads <= 3 # at most the first prefetch was already under way
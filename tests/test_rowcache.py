@@ -0,0 +1,51 @@
+from rowcache import Row, RowCache, to_ascii, to_hex
+
+
+def test_text():
+    assert to_hex(b"\x00\x1f\xff") == "00 1f ff"
+    assert to_ascii(b"a\x00 ~\x7f") == "a..~."
+
+
+def test_row_mask():
+    row = Row(b"abcd", 0x10, 0x1000)
+    assert row.address.endswith("1010")
+    row.mask([(1, 3)])
+    assert row.hex == "61 ?? ?? 64"
+    assert row.ascii == "a  d"
+    assert row.loading == [(1, 3)]
+
+
+def test_get_relabels_rows():
+    cache = RowCache()
+    cache.put(16, Row(b"x" * 16, 16, 0))
+    assert cache.get(32, 0) is None
+    row = cache.get(16, 0x2000)
+    assert row.base == 0x2000 and row.address.endswith("2010")
+
+
+def test_bounded_by_memory():
+    row_size = Row(b"x" * 16, 0, 0).size()
+    cache = RowCache(max_bytes=row_size * 4)
+    for index in range(0, 16 * 10, 16):
+        cache.put(index, Row(b"x" * 16, index, 0))
+    assert sorted(cache.rows) == [96, 112, 128, 144]
+    assert cache.used == row_size * 4
+    # getting a row makes it the most recently used
+    cache.get(96, 0)
+    cache.put(160, Row(b"x" * 16, 160, 0))
+    assert sorted(cache.rows) == [96, 128, 144, 160]
+
+
+def test_invalidate():
+    for count in (4, 1000):
+        cache = RowCache()
+        for index in range(0, 16 * count, 16):
+            cache.put(index, Row(b"x" * 16, index, 0))
+        used = cache.used
+        cache.invalidate(20, 33, 16)
+        assert 16 not in cache.rows and 32 not in cache.rows
+        assert 0 in cache.rows and 48 in cache.rows
+        assert cache.used == used - 2 * cache.rows[0].size()
+        # a range much longer than the cache looks at the cached rows instead
+        cache.invalidate(0, 1 << 40, 16)
+        assert len(cache) == 0 and cache.used == 0
@@ -0,0 +1,81 @@
+import pytest
+
+
+@pytest.fixture
+def huge(qapp):
+    """ A display over 2 ** 50 bytes, far more lines than the scrollbar can count """
+    from __init__ import HexDisplay
+    from datasource import PagedSource
+    display = HexDisplay(source=PagedSource(lambda start, length: bytes(length), 1 << 50))
+    display.resize(600, 300)
+    display.adjust()
+    return display
+
+
+def wheel(display, pixels=0, angle=0):
+    from PyQt5.QtCore import QPoint, QPointF, Qt
+    from PyQt5.QtGui import QWheelEvent
+    event = QWheelEvent(QPointF(10, 10), QPointF(10, 10), QPoint(0, pixels), QPoint(0, angle),
+                        Qt.NoButton, Qt.NoModifier, Qt.NoScrollPhase, False)
+    display.wheelEvent(event)
+
+
+def test_top_line_is_exact_past_the_scrollbar_range(huge):
+    top = huge.maxTopLine()
+    assert top > huge.scrollResolution
+    line = (1 << 40) + 3
+    lines = []
+    huge.topLineChanged.connect(lines.append)
+    huge.setTopLine(line)
+    assert huge.topLine == line and huge.pos == line * huge.bpl
+    assert lines == [line]
+    huge.setTopLine(line) # no change, no signal
+    assert lines == [line]
+    bar = huge.verticalScrollBar()
+    assert bar.value() == (line * huge.scrollResolution + top // 2) // top
+    huge.setTopLine(top + 100)
+    assert huge.topLine == top and bar.value() == bar.maximum()
+    huge.setTopLine(-5)
+    assert huge.topLine == 0 and bar.value() == 0
+
+
+def test_dragging_the_bar(huge):
+    bar = huge.verticalScrollBar()
+    bar.setValue(huge.scrollResolution // 2)
+    assert huge.topLine == huge.maxTopLine() // 2
+    # a line in between bar positions stays put until the bar itself is moved
+    huge.setTopLine(huge.topLine + 1)
+    assert bar.value() == huge.scrollResolution // 2
+    assert huge.topLine == huge.maxTopLine() // 2 + 1
+
+
+def test_small_sources_scroll_a_line_per_bar_step(qapp):
+    from __init__ import HexDisplay
+    display = HexDisplay()
+    display.data = bytes(1 << 16)
+    display.resize(600, 300)
+    display.adjust()
+    bar = display.verticalScrollBar()
+    assert bar.maximum() == display.maxTopLine()
+    bar.setValue(7)
+    assert display.topLine == 7
+
+
+def test_wheel_moves_by_lines_and_keeps_fractions(huge, qapp):
+    from PyQt5.QtWidgets import QApplication
+    huge.setTopLine(1 << 40)
+    start = huge.topLine
+    wheel(huge, angle=-120)
+    assert huge.topLine == start + QApplication.wheelScrollLines()
+    wheel(huge, angle=120)
+    assert huge.topLine == start
+    # a third of a line at a time scrolls one line every three events, both ways
+    third = max(huge.charHeight // 3, 1)
+    steps = []
+    for _ in range(6):
+        wheel(huge, pixels=-third)
+        steps.append(huge.topLine - start)
+    for _ in range(6):
+        wheel(huge, pixels=third)
+    assert steps[-1] == 6 * third // huge.charHeight
+    assert huge.topLine == start
@@ -0,0 +1,84 @@
+import re
+
+import pytest
+
+from search import compile_pattern, scan
+
+
+def run_search(data, pattern, kind="bytes", chunk_size=16, overlap=None, limit=None):
+    regex, length = compile_pattern(pattern, kind)
+    found = []
+    scanned = []
+    for matches, done, total in scan(data, regex, overlap if length is None else length - 1, chunk_size, limit):
+        found.extend(matches)
+        scanned.append(done)
+        assert total == len(data)
+    assert scanned == sorted(scanned)
+    return found
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 16, 1 << 20])
+def test_matches_across_chunk_boundaries(chunk_size):
+    data = b"xxABCDxABCDABCDxxxxxxxxABCD"
+    expected = [(m.start(), 4) for m in re.finditer(b"ABCD", data)]
+    assert run_search(data, b"ABCD", chunk_size=chunk_size) == expected
+
+
+def test_matches_dont_overlap():
+    assert run_search(bytes(64), b"\0\0\0", chunk_size=7) == [(i, 3) for i in range(0, 63, 3)]
+
+
+def test_regex_overlap():
+    data = b"." * 30 + b"<" + b"a" * 20 + b">" + b"." * 30
+    assert run_search(data, b"<a+>", "regex", chunk_size=32, overlap=64) == [(30, 22)]
+
+
+def test_hex_pattern_with_wildcards():
+    assert run_search(b"\xde\xad\x00\xef\xde\xad\x01\xef", "DE AD ?? EF", "hex", chunk_size=3) == [(0, 4), (4, 4)]
+
+
+def test_text_patterns():
+    assert compile_pattern(u"\xe9t\xe9")[1] == 3
+    with pytest.raises(ValueError):
+        compile_pattern(u"a+", "regex")
+    with pytest.raises(ValueError):
+        compile_pattern(u"€")
+    with pytest.raises(ValueError):
+        compile_pattern("ABC", "hex")
+
+
+def test_limit_and_cancel():
+    assert run_search(bytes(64), b"\0", chunk_size=10, limit=15) == [(i, 1) for i in range(15)]
+    regex, length = compile_pattern(b"\0")
+    assert list(scan(bytes(64), regex, 0, 10, cancelled=lambda: True)) == []
+
+
+def test_worker(qapp):
+    from workers import SearchWorker
+    regex, length = compile_pattern(b"ab")
+    worker = SearchWorker(b"xxab" * 100, regex, length - 1, chunk_size=64)
+    found = []
+    finished = []
+    worker.matchesFound.connect(found.extend)
+    worker.finished.connect(finished.append)
+    worker.run()
+    assert found == [(i * 4 + 2, 2) for i in range(100)]
+    assert finished == [False]
+
+
+def test_errors_are_reported(qapp):
+    from workers import SearchWorker
+
+    class Broken(object):
+        def __len__(self):
+            return 100
+
+        def __getitem__(self, key):
+            raise IOError("unreadable")
+
+    worker = SearchWorker(Broken(), re.compile(b"a"), 0)
+    events = []
+    worker.failed.connect(events.append)
+    worker.finished.connect(events.append)
+    worker.run()
+    assert len(events) == 2 and "unreadable" in events[0] and events[1] is True
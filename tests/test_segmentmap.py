@@ -0,0 +1,51 @@
+import pytest
+
+from datasource import SegmentMap
+
+
+@pytest.fixture
+def segments():
+    # a gap short enough to keep, one that gets collapsed, and a segment that isn't aligned
+    return SegmentMap([(0x1000, b"a" * 100), (0x1080, b"b" * 64), (0x7fff0000, b"c" * 1000),
+                       (0x7fff2003, b"d" * 10)], align=64)
+
+
+def test_indexes_keep_address_alignment(segments):
+    for i, (address, source) in enumerate(segments.segments):
+        assert segments.indexes[i] % segments.align == address % segments.align
+
+
+def test_address_round_trip(segments):
+    for address, source in segments.segments:
+        for offset in (0, 1, len(source) - 1):
+            index = segments.address_to_index(address + offset)
+            assert segments.index_to_address(index) == address + offset
+            assert segments[index:index + 1] == source[offset:offset + 1]
+
+
+def test_short_gap_is_kept_and_long_gap_collapsed(segments):
+    assert segments.indexes[1] - segments.indexes[0] == 0x80
+    assert segments.collapsed == [False, False, True, True]
+    assert len(segments) < 0x2000
+
+
+def test_unmapped_addresses(segments):
+    with pytest.raises(ValueError):
+        segments.address_to_index(0x2000)
+    after = segments.address_to_index(0x2000, after=True)
+    before = segments.address_to_index(0x2000, after=False)
+    assert after == segments.indexes[2]
+    assert before == segments.indexes[1] + 63
+
+
+def test_gaps_read_as_zeros(segments):
+    gaps = segments.unmapped(0, len(segments))
+    assert gaps
+    for start, end in gaps:
+        assert segments[start:end] == b"\0" * (end - start)
+    assert sum(end - start for start, end in gaps) + 100 + 64 + 1000 + 10 == len(segments)
+
+
+def test_overlapping_segment_is_rejected(segments):
+    with pytest.raises(ValueError):
+        segments.add(0x1050, b"x" * 64)
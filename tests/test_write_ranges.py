@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from datasource import BufferSource, MmapSource, PagedSource
+
+
+@pytest.fixture
+def mapped(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(bytes(bytearray(range(256))) * 64)
+    source = MmapSource(str(path))
+    yield source
+    source.close()
+
+
+def test_mmap_writes_are_laid_over_reads(mapped):
+    original = mapped[:]
+    mapped.write(4090, b"X" * 10) # across a page boundary
+    mapped.write(100, b"ab")
+    mapped.write(101, b"c")
+    expected = bytearray(original)
+    expected[4090:4100] = b"X" * 10
+    expected[100:102] = b"ac"
+    assert mapped[:] == bytes(expected)
+    assert mapped[4095:4097] == b"XX"
+    assert mapped[4100] == original[4100]
+
+
+def test_mmap_writes_never_reach_the_file(mapped):
+    mapped.write(0, b"\xff" * 16)
+    with open(mapped.filename, "rb") as f:
+        assert f.read(16) == bytes(bytearray(range(16)))
+
+
+def test_mmap_write_outside_the_file(mapped):
+    with pytest.raises(ValueError):
+        mapped.write(len(mapped) - 1, b"ab")
+
+
+def test_huge_sparse_file_opens_read_only(tmp_path):
+    path = tmp_path / "sparse.bin"
+    with open(str(path), "wb") as f:
+        try:
+            f.truncate(1 << 40)
+        except (OSError, IOError):
+            pytest.skip("no sparse files here")
+    try:
+        source = MmapSource(str(path))
+    except (OSError, ValueError, OverflowError):
+        pytest.skip("can't map 1 TiB in this address space")
+    assert len(source) == 1 << 40
+    source.write((1 << 40) - 4, b"tail")
+    assert source[(1 << 40) - 8:] == b"\0\0\0\0tail"
+    source.close()
+
+
+def test_paged_writes_are_pinned():
+    data = os.urandom(8192)
+    source = PagedSource(lambda start, length: data[start:start + length], len(data), page_size=1024, max_pages=1)
+    source.write(1020, b"1234")
+    for page in range(8):
+        source[page * 1024] # push everything else out of the cache
+    assert source[1020:1024] == b"1234"
+    assert source[1018:1026] == data[1018:1020] + b"1234" + data[1024:1026]
+    source.invalidate()
+    assert source[1020:1024] == data[1020:1024]
+
+
+def test_buffer_writes():
+    source = BufferSource(b"hello world")
+    source.write(6, b"there")
+    assert source[:] == b"hello there"
+
+
+def test_write_ranges_marks_only_what_changed(qapp):
+    from model import HexModel
+    model = HexModel(b"\0" * 64, 0x1000)
+    model.write_ranges([(0x1004, b"\0\1\0"), (0x1010, b"ab")])
+    assert model.data[:] == b"\0" * 5 + b"\1" + b"\0" * 10 + b"ab" + b"\0" * 46
+    assert [i for i in range(64) if model.dirty[i]] == [5, 16, 17]
+    model.write_range(0x1010, b"ab")
+    assert not any(model.dirty[i] for i in range(64))
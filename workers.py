@@ -0,0 +1,63 @@
+# QObject wrappers that run the Qt-free algorithms (see core.py) in the background. Each
+# is meant to be moved to a QThread, with run() connected to the thread's started signal.
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from bindiff import diff_blocks
+from search import scan
+
+
+class SearchWorker(QObject):
+    """ Runs search.scan over a data source. Matches are reported in batches (one per
+    chunk) as lists of (index, length), where index is 0-based like everything else
+    inside HexDisplay. """
+    matchesFound = pyqtSignal(object)
+    progress = pyqtSignal(object, object) # bytes scanned, total bytes
+    failed = pyqtSignal(object) # error message, emitted just before finished(True)
+    finished = pyqtSignal(bool) # True if the search was cancelled or failed
+
+    def __init__(self, source, regex, overlap, chunk_size=1 << 20, limit=None):
+        super(SearchWorker, self).__init__()
+        self.source = source
+        self.regex = regex
+        self.overlap = overlap
+        self.chunk_size = chunk_size
+        self.limit = limit # stop after this many matches
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        # an exception escaping a slot aborts the whole process, so report it instead
+        try:
+            for matches, scanned, total in scan(self.source, self.regex, self.overlap, self.chunk_size,
+                                                self.limit, self._cancelled.is_set):
+                if matches:
+                    self.matchesFound.emit(matches)
+                self.progress.emit(scanned, total)
+        except Exception as e:
+            self.failed.emit("{}: {}".format(type(e).__name__, e))
+            self.finished.emit(True)
+            return
+        self.finished.emit(self._cancelled.is_set())
+
+
+class DiffWorker(QObject):
+    """ Runs bindiff.diff_blocks in the background, like SearchWorker """
+    progress = pyqtSignal(object, object) # bytes of new scanned, total bytes
+    finished = pyqtSignal(object) # the DiffBlocks, or None if the diff was cancelled
+
+    def __init__(self, old, new, window=32):
+        super(DiffWorker, self).__init__()
+        self.old = old
+        self.new = new
+        self.window = window
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        self.finished.emit(diff_blocks(self.old, self.new, self.window, self.progress.emit, self._cancelled.is_set))